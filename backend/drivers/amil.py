@@ -1,10 +1,72 @@
 # -*- coding: utf-8 -*-
-import asyncio
 import os
 import unicodedata
-from typing import Any, Optional
+import weakref
+from typing import Any, List, Optional
 
 from .base import BaseDriver, DriverResult, BlockedRequestError
+from .debug_capture import LookupCapture
+
+AMIL_SHELL_URL = "https://www.amil.com.br/institucional/"
+AMIL_FORM_HASH = "#/servicos/saude/rede-credenciada/amil/busca-avancada"
+AMIL_ROUTE_MARKER = "rede-credenciada/amil"
+# Prazo para o shell da SPA subir e o campo de CPF aparecer (antes: 24s fixos de sleep).
+AMIL_READY_TIMEOUT_MS = int(os.getenv("AMIL_READY_TIMEOUT_MS", "30000"))
+# Prazo para desfazer a consulta anterior num shell reaproveitado.
+AMIL_RESET_TIMEOUT_MS = int(os.getenv("AMIL_RESET_TIMEOUT_MS", "5000"))
+AMIL_POLL_MS = 250
+AMIL_MODAL = "div.modal-content"
+AMIL_MODAL_CLOSE = (
+    "div.modal-content button.close, div.modal-content [aria-label='Close'], "
+    "div.modal-content button:has-text('Fechar'), div.modal-content button:has-text('OK')"
+)
+
+_VISIBLE_JS = "(el) => !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length))"
+
+# Reaplica o hash enquanto o roteador da SPA nao assume a rota e devolve o input do CPF
+# assim que ele estiver visivel (null = continuar esperando).
+FORM_READY_JS = """
+([hash, marker]) => {
+  const visible = %s;
+  if (!location.hash.includes(marker)) {
+    location.hash = hash;
+    return null;
+  }
+  const byId = document.querySelector('#cpf_input');
+  if (byId && byId.tagName === 'INPUT' && visible(byId)) return byId;
+  const norm = (value) => (value || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '');
+  for (const el of document.querySelectorAll('input')) {
+    if (!visible(el)) continue;
+    const hint = norm(el.getAttribute('placeholder')) + ' ' + norm(el.getAttribute('label'));
+    if (hint.includes('Beneficiario')) return el;
+  }
+  return null;
+}
+""" % _VISIBLE_JS
+
+# Texto visivel dos containers de resultado, para detectar a troca apos o ENTER.
+_SIGNATURE_JS = """
+(selectors) => {
+  const visible = %s;
+  return selectors.map((selector) => {
+    try {
+      return Array.from(document.querySelectorAll(selector))
+        .filter(visible)
+        .map((el) => String(el.innerText || '').trim())
+        .join('|');
+    } catch (err) {
+      return '';
+    }
+  }).join('||');
+}
+""" % _VISIBLE_JS
+RESULT_SIGNATURE_JS = _SIGNATURE_JS
+RESULT_CHANGED_JS = r"""
+([selectors, before]) => {
+  const signature = (%s)(selectors);
+  return signature.replace(/\|/g, '') !== '' && signature !== before;
+}
+""" % _SIGNATURE_JS.strip()
 
 
 def _normalize_accents(txt: str) -> str:
@@ -17,141 +79,58 @@ def _normalize_accents(txt: str) -> str:
 class AmilDriver(BaseDriver):
     """Driver para Amil com validação do campo CPF após renderização completa da SPA."""
 
+    # Fluxo proprio em _perform: do mapping so o result_parsing e usado.
+    uses_mapping_steps = False
+
     def __init__(self) -> None:
         super().__init__("amil", supported_id_types=("cpf",))
-
-    async def consult(
-        self,
-        identifier: str,
-        id_type: str,
-        *,
-        page: Optional[Any] = None,
-    ) -> DriverResult:
-        if page is None:
-            return await super().consult(identifier, id_type, page=page)
-        return await self._perform(identifier, id_type, page=page)
+        # Paginas cuja ultima consulta ou reset falhou: a proxima recarrega o shell.
+        self._stale_pages: "weakref.WeakSet[Any]" = weakref.WeakSet()
 
     async def _perform(
         self,
         identifier: str,
         id_type: str,
         page: Optional[Any] = None,
+        capture: Optional[LookupCapture] = None,
     ) -> DriverResult:
-        async def _run(page_obj: Any) -> DriverResult:
-            self.step("Carregando shell principal e injetando hash do formulário")
+        capture = capture or LookupCapture.for_level()
 
-            current_url = getattr(page_obj, "url", "") or ""
-            current_url_lower = current_url.lower()
-
-            if "amil.com.br" in current_url_lower:
-                print("[DEBUG] Iniciando teste de renderização Amil (modo manual detectado)")
-                if "rede-credenciada/amil" not in current_url_lower:
-                    print("[INFO] Tentando ajustar hash local sem recarregar página...")
-                    try:
-                        await page_obj.evaluate(
-                            "if (!window.location.hash.includes('rede-credenciada/amil')) "
-                            "window.location.hash = '#/servicos/saude/rede-credenciada/amil/busca-avancada';"
-                        )
-                    except Exception as exc:
-                        print(f"[WARN] Falha ao ajustar hash automaticamente: {exc}")
-                await asyncio.sleep(5)
-                print("[DEBUG] Página pronta, iniciando varredura do DOM.")
-            else:
-                if current_url:
-                    print("[WARN] Página não está na Amil — abortando execução.")
-                    raise Exception(
-                        "Página incorreta: abra manualmente a busca Amil antes de executar."
-                    )
-                print("[DEBUG] Iniciando teste de renderização Amil (modo automático)")
-                await page_obj.goto(
-                    "https://www.amil.com.br/institucional/",
-                    wait_until="commit",
-                )
-                await asyncio.sleep(12)
-                await page_obj.evaluate(
-                    "window.location.hash = '#/servicos/saude/rede-credenciada/amil/busca-avancada'"
-                )
-                await asyncio.sleep(12)
-
-            html = await page_obj.content()
-            print("[DEBUG] Tamanho do HTML renderizado:", len(html))
-            text_snapshot = await page_obj.inner_text("body")
-            print(
-                "[DEBUG] Texto visível (primeiros 300 chars):",
-                text_snapshot[:300],
-            )
-            os.makedirs("debug", exist_ok=True)
-            await page_obj.screenshot(path="debug/amil_debug.png", full_page=True)
-            print("[DEBUG] Screenshot salva em debug/amil_debug.png")
-
-            raw_html = await page_obj.content()
+        async def _run(page_obj: Any) -> DriverResult:
+            await self._apply_resource_policy(page_obj)
+            monitor = self._response_monitor(page_obj)
+            if monitor is not None:
+                monitor.reset()
 
-            try:
-                normalized_html = raw_html.encode("latin1").decode("utf-8", errors="ignore")
-            except Exception:
-                normalized_html = raw_html
-            normalized_html = (
-                normalized_html.replace("á", "á")
-                .replace("é", "é")
-                .replace("ê", "ê")
-                .replace("ã", "ã")
-                .replace("ó", "ó")
+            reused = (
+                self.plan is not None
+                and self.plan.reuse_page
+                and self._prepared_pages.get(page_obj) is self.plan
             )
-
-            visible_text = await page_obj.inner_text("body")
-            visible_text_norm = _normalize_accents(visible_text).lower()
-
-            self.step("Varredura textual pós-normalização concluída.")
-
-            if ("beneficiario" in visible_text_norm) or ("cpf" in visible_text_norm):
-                self.step("Texto 'Beneficiário ou CPF' localizado no corpo da página (normalizado).")
-            else:
-                self.step("Texto 'Beneficiário ou CPF' não apareceu no corpo da página após normalização; seguindo para localizar o campo diretamente.")
-
-            self.step("Buscando input associado ao texto encontrado")
-            cpf_input = None
-
-            cpf_input = await page_obj.query_selector("#cpf_input")
-
+            cpf_input = await self._reset_form(page_obj) if reused else None
             if cpf_input is None:
-                cpf_input = await page_obj.query_selector(
-                    "input[placeholder*='Beneficiário'], input[placeholder*='Beneficiario']"
-                )
+                reload = reused or page_obj in self._stale_pages
+                reused = False
+                self._prepared_pages.pop(page_obj, None)
+                cpf_input = await self._open_form(page_obj, reload=reload)
+                self._stale_pages.discard(page_obj)
 
-            if cpf_input is None:
-                cpf_input_handle = await page_obj.evaluate_handle(
-                    """
-                    () => {
-                        const all = Array.from(document.querySelectorAll('input'));
-                        for (const el of all) {
-                            if (!el) continue;
-                            const placeholder = (el.getAttribute('placeholder') || '')
-                                .normalize('NFD')
-                                .replace(/[̀-ͯ]/g, '');
-                            const label = (el.getAttribute('label') || '')
-                                .normalize('NFD')
-                                .replace(/[̀-ͯ]/g, '');
-                            const visible = !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
-                            if (visible && (placeholder.includes('Beneficiario') || label.includes('Beneficiario'))) {
-                                return el;
-                            }
-                        }
-                        return null;
-                    }
-                    """
+            if capture.level == "full":
+                # Diagnostico da renderizacao: so no nivel full (custa dois round trips).
+                visible_text = await page_obj.inner_text("body")
+                print(
+                    "[DEBUG] Texto visível (primeiros 300 chars):",
+                    visible_text[:300],
                 )
-                if cpf_input_handle:
-                    cpf_input = cpf_input_handle.as_element()
-
-            if cpf_input is None:
-                raise Exception("Campo 'Nº do Beneficiário ou CPF' não encontrado.")
-
-            tag_name = await cpf_input.evaluate("(el) => el.tagName.toLowerCase()")
-            if tag_name != "input":
-                raise Exception("Elemento localizado não é um campo de input.")
+                visible_text_norm = _normalize_accents(visible_text).lower()
+                if ("beneficiario" in visible_text_norm) or ("cpf" in visible_text_norm):
+                    self.step("Texto 'Beneficiário ou CPF' localizado no corpo da página (normalizado).")
+                else:
+                    self.step("Texto 'Beneficiário ou CPF' não apareceu no corpo da página após normalização.")
 
             placeholder = await cpf_input.get_attribute("placeholder") or ""
             self.step(f"Campo CPF localizado (placeholder={placeholder}), preenchendo valor.")
+            before = await self._result_signature(page_obj)
             await cpf_input.click()
             await cpf_input.fill(identifier)
 
@@ -159,18 +138,25 @@ class AmilDriver(BaseDriver):
             await page_obj.keyboard.press("Enter")
 
             self.step("Aguardando resultado da consulta")
-            await asyncio.sleep(3)
-
-            self.step("Capturando screenshot de verificação de layout")
-            os.makedirs("debug", exist_ok=True)
-            await page_obj.screenshot(path=f"debug/amil_{identifier}.png")
+            changed = await self._wait_result_change(page_obj, before)
 
-            parsing = (self.mapping or {}).get("result_parsing", {})
-            if parsing:
-                status, plan, message, debug = await self._parse_result(page_obj, parsing)
+            if self.plan is not None and self.plan.result.status_selectors:
+                status, plan, message, debug = await self._parse_result(
+                    page_obj, self.plan.result
+                )
             else:
                 status, plan, message, debug = "indefinido", "", "", {}
             debug.setdefault("steps_extra", True)
+            debug["page_reused"] = reused
+            debug["result_changed"] = changed
+            debug["debug_capture"] = capture.level
+            if capture.on_success:
+                self.step("Capturando screenshot e HTML de verificação de layout")
+                debug["artifacts"] = await self._capture_debug_artifacts(
+                    page_obj, identifier, capture.level
+                )
+            if self.plan is not None and self.plan.reuse_page:
+                self._prepared_pages[page_obj] = self.plan
 
             self.step(
                 f"Resultado final: status={status} | plano={plan or '-'} | mensagem={message or '-'}"
@@ -185,20 +171,130 @@ class AmilDriver(BaseDriver):
                 id_type=id_type,
             )
 
-        if page is not None:
+        async def _guarded(page_obj: Any) -> DriverResult:
             try:
-                return await _run(page)
-            except BlockedRequestError:
-                raise
+                return await _run(page_obj)
             except Exception as error:
-                self.log_exception(error)
+                self._prepared_pages.pop(page_obj, None)
+                self._stale_pages.add(page_obj)
+                if not isinstance(error, BlockedRequestError):
+                    self.log_exception(error)
+                if capture.on_error:
+                    artifact = await self._capture_failure_artifact(page_obj)
+                    if artifact:
+                        self.step(f"Captura do erro salva em {artifact}")
                 raise
 
+        if page is not None:
+            return await _guarded(page)
+
         async with self._persistent_browser() as page_obj:
-            try:
-                return await _run(page_obj)
-            except BlockedRequestError:
-                raise
-            except Exception as error:
-                self.log_exception(error)
-                raise
+            return await _guarded(page_obj)
+
+    async def _open_form(self, page: Any, reload: bool = False) -> Any:
+        """
+        Carrega o shell (ou aproveita a aba aberta manualmente na Amil) e espera a rota da busca
+        avancada renderizar o campo de CPF. Com `reload` (apos falha de consulta ou de reset) a
+        SPA pode estar travada: navega de novo para o shell em vez de esperar na mesma pagina.
+        """
+        current_url = getattr(page, "url", "") or ""
+        if current_url == "about:blank":
+            current_url = ""
+
+        if reload and "amil.com.br" in current_url.lower():
+            self.step("Recarregando o shell após falha anterior")
+            await page.goto(AMIL_SHELL_URL, wait_until="domcontentloaded")
+        elif "amil.com.br" in current_url.lower():
+            print("[DEBUG] Iniciando teste de renderização Amil (modo manual detectado)")
+        elif current_url:
+            print("[WARN] Página não está na Amil — abortando execução.")
+            raise Exception(
+                "Página incorreta: abra manualmente a busca Amil antes de executar."
+            )
+        else:
+            print("[DEBUG] Iniciando teste de renderização Amil (modo automático)")
+            self.step("Carregando shell principal e injetando hash do formulário")
+            await page.goto(AMIL_SHELL_URL, wait_until="domcontentloaded")
+        return await self._wait_form(page, AMIL_READY_TIMEOUT_MS)
+
+    async def _wait_form(self, page: Any, timeout_ms: int) -> Any:
+        """Campo de CPF visivel na rota do formulario; reaplica o hash se a SPA o descartar."""
+        try:
+            handle = await self._until_blocked(
+                self._response_monitor(page),
+                page.wait_for_function(
+                    FORM_READY_JS,
+                    arg=[AMIL_FORM_HASH, AMIL_ROUTE_MARKER],
+                    polling=AMIL_POLL_MS,
+                    timeout=timeout_ms,
+                ),
+            )
+        except BlockedRequestError:
+            raise
+        except Exception as exc:
+            raise Exception(
+                f"Campo 'Nº do Beneficiário ou CPF' não encontrado em {timeout_ms}ms: {exc}"
+            )
+        cpf_input = handle.as_element()
+        if cpf_input is None:
+            raise Exception("Elemento localizado não é um campo de input.")
+        self.step("Formulário pronto: campo de CPF visível")
+        return cpf_input
+
+    async def _reset_form(self, page: Any) -> Optional[Any]:
+        """
+        Shell reaproveitado: fecha o modal da consulta anterior e confirma que o campo voltou.
+        None quando nao der, e o chamador recarrega o formulario.
+        """
+        try:
+            close = page.locator(AMIL_MODAL_CLOSE).first
+            if await close.is_visible():
+                self.step("Fechando modal da consulta anterior")
+                await close.click(timeout=AMIL_RESET_TIMEOUT_MS)
+            await page.keyboard.press("Escape")
+            await page.locator(AMIL_MODAL).first.wait_for(
+                state="hidden", timeout=AMIL_RESET_TIMEOUT_MS
+            )
+            return await self._wait_form(page, AMIL_RESET_TIMEOUT_MS)
+        except BlockedRequestError:
+            raise
+        except Exception as exc:
+            self.step(f"Reaproveitamento do shell falhou ({exc}); recarregando o formulário")
+            return None
+
+    def _result_selectors(self) -> List[str]:
+        return list(self.plan.result.status_selectors) if self.plan is not None else []
+
+    async def _result_signature(self, page: Any) -> str:
+        selectors = self._result_selectors()
+        if not selectors:
+            return ""
+        try:
+            return await page.evaluate(RESULT_SIGNATURE_JS, selectors)
+        except Exception:
+            return ""
+
+    async def _wait_result_change(self, page: Any, before: str) -> bool:
+        """
+        Espera os containers de resultado mudarem em relacao ao estado antes do ENTER. Sem
+        mudanca no prazo, segue para o parse (que tem seus proprios prazos e checagens).
+        """
+        selectors = self._result_selectors()
+        if not selectors:
+            return False
+        try:
+            await self._until_blocked(
+                self._response_monitor(page),
+                page.wait_for_function(
+                    RESULT_CHANGED_JS,
+                    arg=[selectors, before],
+                    polling=AMIL_POLL_MS,
+                    timeout=self.plan.result.status_timeout_ms,
+                ),
+            )
+            return True
+        except BlockedRequestError:
+            raise
+        except Exception as exc:
+            self.step(f"Containers de resultado não mudaram no prazo: {exc}")
+            return False
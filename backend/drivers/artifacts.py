@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Capturas de falha fora do caminho critico da consulta:
+- limite por operador (janela de um minuto) e amostragem, para que uma queda do portal nao
+  gere um screenshot por identificador;
+- JPEG com dimensoes limitadas no proprio navegador (clip), WebP opcional via Pillow;
+- hash, conversao, escrita e limpeza em thread de fundo;
+- nome pelo hash do conteudo (falhas concorrentes nao se sobrescrevem e telas identicas
+  viram um unico arquivo);
+- retencao por idade, quantidade e tamanho total por operador.
+Capturas de depuracao (debug_capture sampled/full) usam o mesmo formato e a mesma gravacao em
+segundo plano, sem limite por operador: o nivel do job ja decidiu capturar.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import random
+import tempfile
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Optional, Set
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# jpeg (padrao) ou webp (requer Pillow; sem ele fica em jpeg).
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "jpeg").strip().lower()
+ARTIFACT_QUALITY = int(os.getenv("ARTIFACT_QUALITY", "60"))
+ARTIFACT_MAX_WIDTH = int(os.getenv("ARTIFACT_MAX_WIDTH", "1366"))
+ARTIFACT_MAX_HEIGHT = int(os.getenv("ARTIFACT_MAX_HEIGHT", "2000"))
+# Capturas por operador por minuto (0 = sem limite) e fracao das falhas capturadas.
+ARTIFACT_MAX_PER_MINUTE = int(os.getenv("ARTIFACT_MAX_PER_MINUTE", "6"))
+ARTIFACT_SAMPLE_RATE = float(os.getenv("ARTIFACT_SAMPLE_RATE", "1.0"))
+# Retencao por operador (0 desliga o criterio).
+ARTIFACT_RETENTION_DAYS = float(os.getenv("ARTIFACT_RETENTION_DAYS", "7"))
+ARTIFACT_RETENTION_MAX_FILES = int(os.getenv("ARTIFACT_RETENTION_MAX_FILES", "500"))
+ARTIFACT_RETENTION_MAX_MB = int(os.getenv("ARTIFACT_RETENTION_MAX_MB", "200"))
+# Intervalo minimo entre limpezas do mesmo diretorio.
+ARTIFACT_PRUNE_INTERVAL_SECONDS = 60.0
+
+ARTIFACT_EXTENSIONS = (".jpg", ".webp", ".png")
+
+
+class ArtifactService:
+    """Decide, captura e grava screenshots de falha e de depuracao; uma instancia por processo."""
+
+    def __init__(
+        self,
+        *,
+        fmt: str = ARTIFACT_FORMAT,
+        quality: int = ARTIFACT_QUALITY,
+        max_width: int = ARTIFACT_MAX_WIDTH,
+        max_height: int = ARTIFACT_MAX_HEIGHT,
+        max_per_minute: int = ARTIFACT_MAX_PER_MINUTE,
+        sample_rate: float = ARTIFACT_SAMPLE_RATE,
+        retention_days: float = ARTIFACT_RETENTION_DAYS,
+        retention_max_files: int = ARTIFACT_RETENTION_MAX_FILES,
+        retention_max_mb: int = ARTIFACT_RETENTION_MAX_MB,
+    ) -> None:
+        if fmt not in ("jpeg", "webp"):
+            logger.warning("ARTIFACT_FORMAT invalido (%s): usando jpeg", fmt)
+            fmt = "jpeg"
+        if fmt == "webp" and Image is None:
+            logger.info("Pillow ausente: capturas de falha seguem em JPEG")
+            fmt = "jpeg"
+        self.fmt = fmt
+        self.quality = max(1, min(100, quality))
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_per_minute = max_per_minute
+        self.sample_rate = sample_rate
+        self.retention_days = retention_days
+        self.retention_max_files = retention_max_files
+        self.retention_max_bytes = retention_max_mb * 1024 * 1024
+        self._recent: Dict[str, Deque[float]] = defaultdict(deque)
+        self._last_prune: Dict[str, float] = {}
+        self._pending: Set["asyncio.Task[Any]"] = set()
+
+    @property
+    def extension(self) -> str:
+        return ".webp" if self.fmt == "webp" else ".jpg"
+
+    def should_capture(self, operator: str) -> bool:
+        """Amostragem e janela deslizante de um minuto por operador."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self.max_per_minute <= 0:
+            return True
+        now = time.monotonic()
+        recent = self._recent[operator]
+        while recent and now - recent[0] >= 60.0:
+            recent.popleft()
+        if len(recent) >= self.max_per_minute:
+            return False
+        recent.append(now)
+        return True
+
+    async def capture(self, page: Any, directory: str, operator: str) -> Optional[str]:
+        """
+        Tira o screenshot limitado e agenda a gravacao; devolve o caminho final (o arquivo
+        aparece quando a tarefa de fundo terminar) ou None se a captura foi descartada.
+        """
+        if page is None or not self.should_capture(operator):
+            return None
+        data = await self._screenshot(page)
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        path = os.path.normpath(os.path.join(directory, f"{digest}{self.extension}"))
+        self._schedule(self._store, data, path, directory)
+        return path
+
+    async def capture_debug(self, page: Any, directory: str, name: str) -> Dict[str, str]:
+        """
+        Screenshot e HTML de uma consulta concluida; devolve os caminhos ({"screenshot",
+        "html"}) ja agendados para gravacao. O sufixo aleatorio evita que consultas no mesmo
+        segundo sobrescrevam os arquivos umas das outras.
+        """
+        if page is None:
+            return {}
+        data = await self._screenshot(page)
+        html = await page.content()
+        base_path = os.path.normpath(os.path.join(directory, f"{name}_{uuid.uuid4().hex[:8]}"))
+        paths = {"screenshot": f"{base_path}{self.extension}", "html": f"{base_path}.html"}
+        self._schedule(self._store_debug, data, html, paths, directory)
+        return paths
+
+    async def _screenshot(self, page: Any) -> bytes:
+        return await page.screenshot(
+            type="jpeg",
+            quality=self.quality,
+            full_page=True,
+            clip={"x": 0, "y": 0, "width": self.max_width, "height": self.max_height},
+            scale="css",
+        )
+
+    def _schedule(self, func: Callable[..., None], *args: Any) -> None:
+        task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        self._pending.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: "asyncio.Task[Any]") -> None:
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("falha ao gravar captura: %s", task.exception())
+
+    async def drain(self) -> None:
+        """Aguarda as gravacoes pendentes (shutdown)."""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    def _encode(self, data: bytes) -> bytes:
+        if self.fmt != "webp":
+            return data
+        with Image.open(io.BytesIO(data)) as image:
+            buffer = io.BytesIO()
+            image.save(buffer, format="WEBP", quality=self.quality, method=4)
+            return buffer.getvalue()
+
+    def _store(self, data: bytes, path: str, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            # Mesma tela ja capturada: so renova a data para a retencao.
+            os.utime(path)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(self._encode(data))
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        self._maybe_prune(directory)
+
+    def _store_debug(
+        self, data: bytes, html: str, paths: Dict[str, str], directory: str
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        with open(paths["screenshot"], "wb") as f:
+            f.write(self._encode(data))
+        with open(paths["html"], "w", encoding="utf-8") as f:
+            f.write(html)
+
+    def _maybe_prune(self, directory: str) -> None:
+        now = time.monotonic()
+        last = self._last_prune.get(directory)
+        if last is not None and now - last < ARTIFACT_PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune[directory] = now
+        prune_directory(
+            directory,
+            max_age_seconds=self.retention_days * 86400,
+            max_files=self.retention_max_files,
+            max_bytes=self.retention_max_bytes,
+        )
+
+
+def prune_directory(
+    directory: str, *, max_age_seconds: float, max_files: int, max_bytes: int
+) -> int:
+    """Remove capturas antigas, depois as excedentes (mais antigas primeiro). Devolve quantas."""
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(ARTIFACT_EXTENSIONS):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return 0
+    entries.sort(reverse=True)
+    cutoff = time.time() - max_age_seconds if max_age_seconds > 0 else None
+    kept = kept_bytes = removed = 0
+    for mtime, size, path in entries:
+        expired = cutoff is not None and mtime < cutoff
+        too_many = max_files > 0 and kept >= max_files
+        too_big = max_bytes > 0 and kept_bytes + size > max_bytes
+        if expired or too_many or too_big:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            continue
+        kept += 1
+        kept_bytes += size
+    return removed
+
+
+artifact_service = ArtifactService()
@@ -6,13 +6,39 @@ import os
 import random
 import re
 import time
+import weakref
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Dict, Iterable, Optional, Tuple
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
 
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from playwright.async_api import async_playwright
 
+from . import http_api
+from .artifacts import artifact_service
+from .debug_capture import LookupCapture
+from .retry import RetryPolicy, RetryRule
+from .page_watch import (
+    CAPTCHA_SELECTORS,
+    ResponseCapture,
+    ResponseMonitor,
+    check_block,
+    response_capture,
+    response_monitor,
+    watch_result,
+)
+from .plan import (
+    BlockPlan,
+    MappingError,
+    MappingPlan,
+    ResultPlan,
+    ResponsePlan,
+    StepPlan,
+    compile_mapping,
+    normalize_text,
+)
+
 
 def _resolve_mappings_dir() -> str:
     # 1) Se o env estiver setado e a pasta existir, usar
@@ -42,6 +68,8 @@ _PRINTED_MAPPINGS_DIR = False
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "data"))
 ERRORS_DIR = os.path.normpath(os.path.join(DATA_DIR, "errors"))
+# Capturas de consultas bem-sucedidas (debug_capture sampled/full).
+DEBUG_DIR = os.path.normpath(os.path.join(DATA_DIR, "debug"))
 STORAGE_STATES_DIR = os.path.normpath(os.path.join(DATA_DIR, "storage_states"))
 
 os.makedirs(ERRORS_DIR, exist_ok=True)
@@ -57,6 +85,30 @@ DEFAULT_BLOCK_KEYWORDS = [
     for kw in os.getenv("BLOCK_KEYWORDS", "429,too many requests").split(",")
     if kw.strip()
 ]
+# Status HTTP do proprio portal tratados como bloqueio (page.on("response")).
+BLOCK_HTTP_STATUSES = [
+    int(code)
+    for code in os.getenv("BLOCK_HTTP_STATUSES", "429,403").split(",")
+    if code.strip()
+]
+# Politica de retentativa por classe de erro: JSON sobrepondo os padroes abaixo, ex.
+# {"timeout": {"max_attempts": 4, "base_delay": 1, "max_delay": 20}}.
+RETRY_POLICY = RetryPolicy.build(
+    {
+        "blocked": RetryRule(MAX_RETRIES, BLOCK_SLEEP_SECONDS, BLOCK_SLEEP_SECONDS * 4),
+        "timeout": RetryRule(3, 2.0, 30.0),
+        "navigation": RetryRule(3, 5.0, 60.0),
+        "crash": RetryRule(2, 5.0, 60.0),
+        "mapping": RetryRule(1, 0.0, 0.0),
+        "other": RetryRule(MAX_RETRIES, 1.25, 10.0),
+    },
+    os.getenv("RETRY_POLICY"),
+    jitter=float(os.getenv("RETRY_JITTER", "0.25")),
+)
+# Trechos de mensagem que identificam a classe quando o tipo da excecao nao basta.
+CRASH_ERROR_MARKERS = ("target closed", "has been closed", "crashed", "browser has disconnected")
+NAVIGATION_ERROR_MARKERS = ("net::err", "ns_error", "navigation", "endpoint respondeu http 5")
+MAPPING_ERROR_MARKERS = ("mapping ausente", "mapping invalido", "mapping incompleto")
 
 logger = logging.getLogger(__name__)
 
@@ -86,17 +138,45 @@ async def launch_chrome_real(headless: bool = False, slow_mo: int = 150):
 
 
 
+async def _cancel_tasks(tasks: Iterable["asyncio.Future"]) -> None:
+    """Cancela as tarefas ainda pendentes e consome seus resultados."""
+    tasks = [task for task in tasks if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _as_tuple(value: Any) -> Tuple[Any, ...]:
+    if not value:
+        return ()
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return (value,)
+
+
 class BlockedRequestError(Exception):
     """Raised when the remote website indicates an anti-bot block."""
 
 
-def normalize_text(value: str) -> str:
-    """Normaliza texto removendo espacos repetidos e padronizando para maiusculas."""
-    if not value:
-        return ""
-    cleaned = value.replace("\u00A0", " ")
-    cleaned = re.sub(r"\s+", " ", cleaned)
-    return cleaned.strip().upper()
+def classify_error(error: BaseException) -> str:
+    """Classe do erro para a politica de retentativa (ver drivers/retry.py)."""
+    if isinstance(error, BlockedRequestError):
+        return "blocked"
+    message = str(error).lower()
+    if any(marker in message for marker in MAPPING_ERROR_MARKERS):
+        return "mapping"
+    if any(marker in message for marker in CRASH_ERROR_MARKERS):
+        return "crash"
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, PlaywrightTimeoutError)):
+        return "timeout"
+    if http_api.httpx is not None and isinstance(error, http_api.httpx.TimeoutException):
+        return "timeout"
+    if http_api.httpx is not None and isinstance(error, http_api.httpx.TransportError):
+        return "navigation"
+    if any(marker in message for marker in NAVIGATION_ERROR_MARKERS):
+        return "navigation"
+    return "other"
 
 
 @dataclass
@@ -118,10 +198,20 @@ class BaseDriver:
     - .mapping  (dict carregado a partir de <MAPPINGS_DIR>/<OPERATOR>.json)
     - .consult(identifier, id_type) -> DriverResult
     """
+    # Drivers com fluxo proprio (Amil) nao executam os `steps` do mapping.
+    uses_mapping_steps = True
+
     def __init__(self, operator: str, supported_id_types: Optional[Tuple[str, ...]] = None):
         self.operator = operator.lower()
         self.name = self.operator  # <- FALTAVA. O pipeline usa driver.name
         self.mapping = None
+        self.plan: Optional[MappingPlan] = None
+        self.plan_error: Optional[str] = None
+        # Paginas ja preparadas (setup executado) para o plano atual, com reuse_page.
+        self._prepared_pages: "weakref.WeakKeyDictionary[Any, MappingPlan]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._routed_pages: "weakref.WeakSet[Any]" = weakref.WeakSet()
         self.supported_id_types: Tuple[str, ...] = tuple(
             supported_id_types or ("cpf",)
         )
@@ -140,6 +230,7 @@ class BaseDriver:
                 print(f"[{self.operator}] erro ao carregar mapping: {e}")
         else:
             print(f"[{self.operator}] mapping nao encontrado em {self.mapping_path}")
+        self._compile_plan()
 
     def _load_mapping(self):
         """Permite reload sem recriar a instancia."""
@@ -155,6 +246,27 @@ class BaseDriver:
         except Exception as e:
             self.mapping = None
             print(f"[{self.operator}] erro no reload do mapping: {e}")
+        self._compile_plan()
+
+    def _compile_plan(self) -> None:
+        """Compila o mapping carregado; erros ficam em plan_error e sao reportados ja aqui."""
+        self.plan = None
+        self.plan_error = None
+        if self.mapping is None:
+            return
+        try:
+            self.plan = compile_mapping(
+                self.mapping,
+                handlers=self._step_handlers(),
+                default_timeout_ms=TIMEOUT_SELECTOR_MS,
+                default_block_indicators=DEFAULT_BLOCK_KEYWORDS,
+                default_captcha_selectors=CAPTCHA_SELECTORS,
+                default_block_statuses=BLOCK_HTTP_STATUSES,
+                compile_steps=self.uses_mapping_steps,
+            )
+        except MappingError as e:
+            self.plan_error = str(e)
+            print(f"[{self.operator}] mapping invalido ({self.mapping_path}): {e}")
 
     def step(self, message: str) -> None:
         logger.debug(f"[{self.operator}] {message}")
@@ -192,74 +304,95 @@ class BaseDriver:
         identifier: str,
         id_type: str,
         page: Optional[Any] = None,
+        debug_capture: Optional[str] = None,
+        *,
+        attempt: int = 1,
+        defer_retries: bool = False,
     ) -> DriverResult:
+        """
+        `debug_capture` (off/on-error/sampled/full) vale para esta consulta; None usa o padrao.
+        Falhas sao classificadas (debug.error_class) e retentadas conforme RETRY_POLICY. Com
+        `defer_retries` faz uma unica tentativa (a de numero `attempt`) e marca
+        debug.retryable: quem chama reenfileira o identificador em vez de segurar a pagina.
+        """
         if id_type not in self.supported_id_types:
             raise ValueError(f"{self.operator} nao suporta identificador do tipo '{id_type}'")
 
         self.step(f"Iniciando consulta para {id_type.upper()} {identifier}")
+        capture = LookupCapture.for_level(debug_capture)
 
-        for attempt in range(MAX_RETRIES):
+        while True:
+            self.step(f"Tentativa {attempt} para {identifier}")
+            await asyncio.sleep(random.uniform(FETCH_MIN_DELAY, FETCH_MAX_DELAY))
             try:
-                self.step(f"Tentativa {attempt + 1}/{MAX_RETRIES} para {identifier}")
-                await asyncio.sleep(random.uniform(FETCH_MIN_DELAY, FETCH_MAX_DELAY))
                 self.step("Disparando fluxo principal do driver")
-                result = await self._perform(identifier, id_type, page=page)
-                if not result.identifier:
-                    result.identifier = identifier
-                if not result.id_type:
-                    result.id_type = id_type
+                result = await self._perform(identifier, id_type, page=page, capture=capture)
+            except Exception as exc:
+                self.log_exception(exc)
+                result = DriverResult(
+                    operator=self.operator,
+                    status="erro",
+                    plan="",
+                    message=str(exc),
+                    debug={"error": str(exc), "error_class": classify_error(exc)},
+                )
+                if isinstance(exc, BlockedRequestError):
+                    result.debug["block_detected"] = True
+            if not result.identifier:
+                result.identifier = identifier
+            if not result.id_type:
+                result.id_type = id_type
+
+            error_class = result.debug.get("error_class") if result.status == "erro" else None
+            if error_class is None:
                 self.step(
                     f"Resultado final: status={result.status} | plano={result.plan or '-'} | mensagem={result.message or '-'}"
                 )
                 return result
-            except BlockedRequestError as block:
-                self.log_exception(block)
+
+            retryable = RETRY_POLICY.should_retry(error_class, attempt)
+            result.debug["attempt"] = attempt
+            result.debug["retryable"] = retryable
+            if error_class == "blocked":
                 logger.warning(
-                    'Bloqueio detectado em %s: %s (tentativa %s/%s)',
+                    "Bloqueio detectado em %s: %s (tentativa %s)",
                     self.operator,
-                    block,
-                    attempt + 1,
-                    MAX_RETRIES,
+                    result.message,
+                    attempt,
                 )
-                await asyncio.sleep(BLOCK_SLEEP_SECONDS)
-            except Exception as exc:
-                self.log_exception(exc)
-                if attempt + 1 == MAX_RETRIES:
-                    self.step('Ultima tentativa esgotada, retornando erro para o pipeline')
-                    return DriverResult(
-                        operator=self.operator,
-                        status='erro',
-                        plan='',
-                        message=str(exc),
-                        identifier=identifier,
-                        id_type=id_type,
-                    )
-                await asyncio.sleep(1.25)
-
-        return DriverResult(
-            operator=self.operator,
-            status='erro',
-            message='falha apos retries',
-            identifier=identifier,
-            id_type=id_type,
-        )
+            if not retryable:
+                self.step(f"Tentativas esgotadas ({error_class}), retornando erro para o pipeline")
+                return result
+            if defer_retries:
+                return result
+            delay = RETRY_POLICY.delay(error_class, attempt)
+            self.step(f"Falha {error_class}; nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
 
     async def _perform(
         self,
         identifier: str,
         id_type: str,
         page: Optional[Any] = None,
+        capture: Optional[LookupCapture] = None,
     ) -> DriverResult:
         """
         Implementacao base:
-        - Se houver 'steps' no mapping, executa o fluxo declarativo.
+        - Com mode "api", consulta o endpoint JSON direto (sem navegador).
+        - Se houver passos no mapping (setup/per_identifier/steps), executa o fluxo declarativo.
         - Senao, tenta legado via selectors.cpf / selectors.submit.
         """
         if not self.mapping:
             raise Exception("mapping ausente para este driver")
+        if self.plan is None:
+            raise Exception(f"mapping invalido: {self.plan_error}")
 
-        if "steps" in self.mapping:
-            return await self._execute_steps(identifier, id_type, page=page)
+        if self.plan.mode == "api":
+            return await self._execute_api(identifier, id_type, capture=capture)
+
+        if self.plan.setup or self.plan.steps:
+            return await self._execute_steps(identifier, id_type, page=page, capture=capture)
 
         # Legado
         sel = (self.mapping or {}).get("selectors", {})
@@ -291,11 +424,27 @@ class BaseDriver:
             id_type=id_type,
         )
 
+    @property
+    def uses_browser(self) -> bool:
+        return self.plan is None or self.plan.mode != "api"
+
+    @asynccontextmanager
+    async def _lookup_session(self):
+        """Pagina persistente para o lote; no modo api nao abre navegador (pagina None)."""
+        if not self.uses_browser:
+            yield None
+            return
+        async with self._persistent_browser() as page:
+            yield page
+
+    def _storage_state_path(self) -> str:
+        return os.path.join(STORAGE_STATES_DIR, f"{self.operator}.json")
+
     @asynccontextmanager
     async def _persistent_browser(self):
         browser, context, page = await launch_chrome_real(headless=False, slow_mo=150)
 
-        storage_file = os.path.join(STORAGE_STATES_DIR, f"{self.operator}.json")
+        storage_file = self._storage_state_path()
         if os.path.exists(storage_file):
             await context.close()
             context = await browser.new_context(
@@ -337,63 +486,142 @@ class BaseDriver:
             if playwright is not None:
                 await playwright.stop()
 
+    async def _execute_api(
+        self, identifier: str, id_type: str, capture: Optional[LookupCapture] = None
+    ) -> DriverResult:
+        """
+        Requisicao direta pelo cliente HTTP compartilhado. Status de bloqueio levantam
+        BlockedRequestError e falhas de rede/HTTP sobem para o retry de `consult`.
+        """
+        mapping_plan = self.plan
+        api = mapping_plan.api
+        storage_file = self._storage_state_path() if api.storage_state else None
+        self.step(f"Consultando endpoint {api.method} {api.url}")
+        start = time.perf_counter()
+        response = await http_api.send(api, identifier, id_type, storage_file)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        run_debug: Dict[str, Any] = {
+            "mapping_path": self.mapping_path,
+            "mode": "api",
+            "api": {
+                "url": str(response.url),
+                "status_code": response.status_code,
+                "http_version": response.http_version,
+                "elapsed_ms": elapsed_ms,
+            },
+        }
+        capture = capture or LookupCapture.for_level()
+        if capture.on_success or (capture.on_error and response.status_code >= 400):
+            run_debug["api"]["body"] = response.text[:2000]
+        if response.status_code in mapping_plan.block.statuses:
+            raise BlockedRequestError(f"HTTP {response.status_code} em {response.url}")
+        if response.status_code >= 400:
+            raise Exception(f"endpoint respondeu HTTP {response.status_code}")
+        try:
+            payload = response.json()
+        except ValueError:
+            body = response.text.lower()
+            indicator = next((i for i in mapping_plan.block.indicators if i in body), None)
+            if indicator:
+                raise BlockedRequestError(f"Indicador de bloqueio na resposta: {indicator}")
+            raise Exception("endpoint nao devolveu JSON")
+
+        status, plan, message, parse_debug = api.result.decide(payload, mapping_plan.result)
+        run_debug.update(parse_debug)
+        self.step(f"Endpoint respondeu em {elapsed_ms} ms ({response.http_version})")
+        return DriverResult(
+            operator=self.operator,
+            status=status,
+            plan=plan,
+            message=message,
+            debug=run_debug,
+            identifier=identifier,
+            id_type=id_type,
+        )
+
     async def _execute_steps(
         self,
         identifier: str,
         id_type: str,
         page: Optional[Any] = None,
+        capture: Optional[LookupCapture] = None,
     ) -> DriverResult:
         if page is not None:
-            return await self._execute_steps_on_page(page, identifier, id_type)
+            return await self._execute_steps_on_page(page, identifier, id_type, capture)
 
         async with self._persistent_browser() as page_obj:
-            return await self._execute_steps_on_page(page_obj, identifier, id_type)
+            return await self._execute_steps_on_page(page_obj, identifier, id_type, capture)
 
     async def _execute_steps_on_page(
-        self, page: Any, identifier: str, id_type: str
+        self,
+        page: Any,
+        identifier: str,
+        id_type: str,
+        capture: Optional[LookupCapture] = None,
     ) -> DriverResult:
-        steps = self.mapping.get("steps", [])
-        parsing = self.mapping.get("result_parsing", {})
-        url = self.mapping.get("url")
+        mapping_plan = self.plan
+        capture = capture or LookupCapture.for_level()
+        await self._apply_resource_policy(page)
+        monitor = self._response_monitor(page)
+        if monitor is not None:
+            # Respostas de consultas anteriores na mesma pagina nao contam.
+            monitor.reset()
 
         run_debug: Dict[str, Any] = {
             "mapping_path": self.mapping_path,
+            "debug_capture": capture.level,
             "steps": [],
         }
 
         try:
-            if url:
-                self.step(f"Navegando para {url}")
-                await page.goto(url)
-                run_debug.setdefault("navigation", {}).update({"target": url})
-
-            for idx, step in enumerate(steps):
-                self.step(f"Executando passo {idx}: {step.get('action', 'desconhecido')}")
-                await self._run_step(page, step, identifier, run_debug, idx)
-
-            block_indicators = [
-                str(item).lower()
-                for item in self.mapping.get("block_indicators", [])
-                if str(item).strip()
-            ]
-            if not block_indicators:
-                block_indicators = list(DEFAULT_BLOCK_KEYWORDS)
-
-            if block_indicators:
-                self.step("Verificando indicadores de bloqueio")
-                html_snapshot = (await page.content()).lower()
-                if any(indicator in html_snapshot for indicator in block_indicators):
-                    run_debug.setdefault("block_detected", True)
-                    raise BlockedRequestError("indicativo de bloqueio detectado na pagina")
-
-            self.step("Verificando elemento de sucesso e extraindo resultado")
-            status, plan, message, parse_debug = await self._parse_result(page, parsing)
+            reused = (
+                mapping_plan.reuse_page and self._prepared_pages.get(page) is mapping_plan
+            )
+            run_debug["page_reused"] = reused
+            if not reused:
+                await self._run_setup(page, mapping_plan, identifier, run_debug)
+            xhr_capture = self._arm_response_capture(page, mapping_plan, identifier)
+
+            for step in mapping_plan.steps:
+                if step.action == "reset" and not reused:
+                    # Pagina recem preparada: nao ha consulta anterior para desfazer.
+                    continue
+                self.step(f"Executando passo {step.index}: {step.action}")
+                if step.action == "reset":
+                    try:
+                        await self._run_step(page, step, identifier, run_debug)
+                    except Exception as reset_error:
+                        self.step(f"Reset falhou ({reset_error}); refazendo o setup da pagina")
+                        run_debug["page_reused"] = False
+                        await self._run_setup(page, mapping_plan, identifier, run_debug)
+                        xhr_capture = self._arm_response_capture(
+                            page, mapping_plan, identifier
+                        )
+                    continue
+                await self._run_step(page, step, identifier, run_debug)
+
+            decided = None
+            if xhr_capture is not None:
+                decided = await self._parse_response(
+                    page, xhr_capture, mapping_plan.response, mapping_plan.result, run_debug
+                )
+            if decided is None:
+                self.step("Verificando elemento de sucesso e extraindo resultado")
+                decided = await self._parse_result(page, mapping_plan.result)
+            status, plan, message, parse_debug = decided
             run_debug.update(parse_debug)
         except Exception as error:
             self.log_exception(error)
-            screenshot_path = await self._capture_failure_artifact(page)
-            if screenshot_path:
-                run_debug.setdefault("artifacts", {})["screenshot"] = screenshot_path
+            self._disarm_response_capture(page)
+            # Estado da pagina desconhecido: a proxima consulta refaz o setup.
+            self._prepared_pages.pop(page, None)
+            if isinstance(error, BlockedRequestError):
+                run_debug.setdefault("block_detected", True)
+            run_debug["error_class"] = classify_error(error)
+            if capture.on_error:
+                screenshot_path = await self._capture_failure_artifact(page)
+                if screenshot_path:
+                    run_debug.setdefault("artifacts", {})["screenshot"] = screenshot_path
             run_debug.setdefault("error", str(error))
             return DriverResult(
                 operator=self.operator,
@@ -405,6 +633,11 @@ class BaseDriver:
                 id_type=id_type,
             )
 
+        self._disarm_response_capture(page)
+        if capture.on_success:
+            run_debug["artifacts"] = await self._capture_debug_artifacts(
+                page, identifier, capture.level
+            )
         self.step(
             f"Resultado final: status={status} | plano={plan or '-'} | mensagem={message or '-'}"
         )
@@ -418,22 +651,86 @@ class BaseDriver:
             id_type=id_type,
         )
 
+    async def _apply_resource_policy(self, page: Any) -> None:
+        """
+        Instala (uma vez por pagina) o page.route que aborta os recursos de `block_resources`.
+        O handler consulta o plano atual, entao um reload do mapping vale para a proxima
+        requisicao.
+        """
+        policy = self.plan.resources if self.plan is not None else None
+        if policy is None or not policy.enabled or page in self._routed_pages:
+            return
+
+        async def handle(route: Any) -> None:
+            request = route.request
+            current = self.plan.resources if self.plan is not None else None
+            try:
+                if current is not None and current.blocks(request.resource_type, request.url):
+                    await route.abort()
+                else:
+                    await route.continue_()
+            except Exception as exc:
+                # Pagina/contexto fechado no meio da requisicao.
+                logger.debug("[%s] falha ao rotear %s: %s", self.operator, request.url, exc)
+
+        await page.route("**/*", handle)
+        self._routed_pages.add(page)
+        self.step(
+            f"Bloqueando recursos: tipos={sorted(policy.types) or '-'} | "
+            f"padroes={'sim' if policy.pattern is not None else 'nao'}"
+        )
+
+    async def _run_setup(
+        self,
+        page: Any,
+        mapping_plan: MappingPlan,
+        identifier: str,
+        run_debug: Dict[str, Any],
+    ) -> None:
+        """Navegacao inicial e passos `setup`; com reuse_page a pagina fica marcada como pronta."""
+        self._prepared_pages.pop(page, None)
+        url = mapping_plan.url
+        if url:
+            self.step(f"Navegando para {url}")
+            await page.goto(url)
+            run_debug.setdefault("navigation", {}).update({"target": url})
+        for step in mapping_plan.setup:
+            self.step(f"Executando passo de setup {step.index}: {step.action}")
+            await self._run_step(page, step, identifier, run_debug)
+        if mapping_plan.reuse_page:
+            self._prepared_pages[page] = mapping_plan
+
+    STEP_ACTIONS = {
+        "navigate": "_step_navigate",
+        "fill": "_step_fill",
+        "click": "_step_click",
+        "keypress": "_step_keypress",
+        "wait_for": "_step_wait_for",
+        "wait_for_state": "_step_wait_for_state",
+        "sleep": "_step_sleep",
+        "reset": "_step_reset",
+        "wait_for_response": "_step_wait_for_response",
+    }
+
+    def _step_handlers(self) -> Dict[str, Callable[..., Awaitable[Optional[float]]]]:
+        return {action: getattr(self, name) for action, name in self.STEP_ACTIONS.items()}
+
     async def _run_step(
         self,
         page: Any,
-        step: Dict[str, Any],
+        step: StepPlan,
         identifier: str,
         run_debug: Dict[str, Any],
-        index: int,
     ) -> None:
-        action = step.get("action")
-        optional = bool(step.get("optional", False))
-        post_delay = float(step.get("delay", 0.0)) if step.get("delay") else 0.0
-        post_wait_selector = step.get("wait_selector")
-        timeout = step.get("timeout_ms", TIMEOUT_SELECTOR_MS)
+        action = step.action
+        optional = step.optional
+        post_delay = step.delay
+        post_wait_selector = step.wait_selector
+        timeout = step.timeout_ms
 
         step_log = {
-            "index": index,
+            "index": step.index,
+            "phase": step.phase,
             "action": action,
             "selector": step.get("selector"),
             "target": step.get("target"),
@@ -442,87 +739,10 @@ class BaseDriver:
             "optional": optional,
         }
 
-        wait_for_any = step.get("wait_for_any") or []
-        if isinstance(wait_for_any, str):
-            wait_for_any = [wait_for_any]
-
         try:
-            if action == "navigate":
-                target = step.get("target") or self.mapping.get("url")
-                if target:
-                    self.step(f"Navegando para {target}")
-                    await page.goto(target)
-                wait_for = step.get("wait_for")
-                if isinstance(wait_for, list):
-                    self.step("Aguardando um dos seletores de destino ficar visivel")
-                    matched = await self._wait_for_any(
-                        page, wait_for, timeout, state="visible"
-                    )
-                    step_log["matched_wait_for"] = matched
-                elif wait_for:
-                    self.step(f"Aguardando selector {wait_for}")
-                    await page.locator(wait_for).first.wait_for(
-                        state="visible", timeout=timeout
-                    )
-                    step_log["matched_wait_for"] = wait_for
-                if wait_for_any:
-                    self.step("Aguardando qualquer selector adicional configurado")
-                    matched = await self._wait_for_any(
-                        page, wait_for_any, timeout, state="visible"
-                    )
-                    step_log["matched_wait_for_any"] = matched
-            elif action == "fill":
-                selector = step.get("selector")
-                if not selector:
-                    raise ValueError("fill action requer 'selector'")
-                val = (step.get("value") or "").replace("{identifier}", identifier)
-                self.step(f"Preenchendo campo {selector} com valor {val}")
-                await page.fill(selector, val, timeout=timeout)
-                self.step("Campo preenchido com sucesso")
-            elif action == "click":
-                selector = step.get("selector")
-                if not selector:
-                    raise ValueError("click action requer 'selector'")
-                click_kwargs = {"timeout": timeout}
-                if step.get("force"):
-                    click_kwargs["force"] = True
-                if step.get("no_wait_after") is not None:
-                    click_kwargs["no_wait_after"] = bool(step.get("no_wait_after"))
-                self.step(f"Clicando no elemento {selector}")
-                await page.click(selector, **click_kwargs)
-            elif action == "keypress":
-                key = step.get("key", "Enter")
-                self.step(f"Pressionando tecla {key}")
-                await self.keypress(page, step.get("selector"), key=key, timeout=timeout)
-                self.step(f"Tecla {key} enviada")
-            elif action == "wait_for":
-                selector = step.get("selector")
-                if not selector:
-                    raise ValueError("wait_for action requer 'selector'")
-                if isinstance(selector, list):
-                    self.step("Aguardando qualquer selector configurado ficar disponivel")
-                    matched = await self._wait_for_any(
-                        page,
-                        selector,
-                        timeout,
-                        state=step.get("state", "visible"),
-                    )
-                    step_log["matched_wait_for"] = matched
-                else:
-                    self.step(f"Aguardando selector {selector}")
-                    await page.locator(selector).first.wait_for(
-                        state=step.get("state", "visible"), timeout=timeout
-                    )
-                    step_log["matched_wait_for"] = selector
-            elif action == "wait_for_state":
-                state = step.get("state", "load")
-                self.step(f"Aguardando estado de carregamento {state}")
-                await page.wait_for_load_state(state)
-            elif action == "sleep":
-                post_delay = float(step.get("seconds", 0.0))
-                self.step(f"Aguardando {post_delay} segundos antes de continuar")
-            else:
-                raise ValueError(f"acao desconhecida: {action}")
+            delay_override = await step.handler(page, step, identifier, step_log)
+            if delay_override is not None:
+                post_delay = delay_override
             step_log["status"] = "ok"
         except Exception as error:
             if optional:
@@ -538,7 +758,7 @@ class BaseDriver:
         finally:
             if post_wait_selector:
                 try:
-                    if isinstance(post_wait_selector, list):
+                    if isinstance(post_wait_selector, tuple):
                         self.step("Aguardando pos-acao por qualquer selector configurado")
                         matched = await self._wait_for_any(
                             page, post_wait_selector, timeout, state="visible"
@@ -560,6 +780,130 @@ class BaseDriver:
 
         run_debug.setdefault("steps", []).append(step_log)
 
+    async def _step_navigate(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        timeout = step.timeout_ms
+        target = step.get("target") or self.plan.url
+        if target:
+            self.step(f"Navegando para {target}")
+            await page.goto(target)
+        wait_for = step.get("wait_for")
+        if isinstance(wait_for, tuple):
+            self.step("Aguardando um dos seletores de destino ficar visivel")
+            matched = await self._wait_for_any(page, wait_for, timeout, state="visible")
+            step_log["matched_wait_for"] = matched
+        elif wait_for:
+            self.step(f"Aguardando selector {wait_for}")
+            await page.locator(wait_for).first.wait_for(state="visible", timeout=timeout)
+            step_log["matched_wait_for"] = wait_for
+        wait_for_any = step.get("wait_for_any") or ()
+        if isinstance(wait_for_any, str):
+            wait_for_any = (wait_for_any,)
+        if wait_for_any:
+            self.step("Aguardando qualquer selector adicional configurado")
+            matched = await self._wait_for_any(page, wait_for_any, timeout, state="visible")
+            step_log["matched_wait_for_any"] = matched
+
+    async def _step_fill(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        selector = step.get("selector")
+        val = (step.get("value") or "").replace("{identifier}", identifier)
+        self.step(f"Preenchendo campo {selector} com valor {val}")
+        await page.fill(selector, val, timeout=step.timeout_ms)
+        self.step("Campo preenchido com sucesso")
+
+    async def _step_click(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        selector = step.get("selector")
+        click_kwargs = {"timeout": step.timeout_ms}
+        if step.get("force"):
+            click_kwargs["force"] = True
+        if step.get("no_wait_after") is not None:
+            click_kwargs["no_wait_after"] = bool(step.get("no_wait_after"))
+        self.step(f"Clicando no elemento {selector}")
+        await page.click(selector, **click_kwargs)
+
+    async def _step_keypress(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        key = step.get("key", "Enter")
+        self.step(f"Pressionando tecla {key}")
+        await self.keypress(page, step.get("selector"), key=key, timeout=step.timeout_ms)
+        self.step(f"Tecla {key} enviada")
+
+    async def _step_wait_for(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        selector = step.get("selector")
+        state = step.get("state", "visible")
+        if isinstance(selector, tuple):
+            self.step("Aguardando qualquer selector configurado ficar disponivel")
+            matched = await self._wait_for_any(page, selector, step.timeout_ms, state=state)
+            step_log["matched_wait_for"] = matched
+        else:
+            self.step(f"Aguardando selector {selector}")
+            await page.locator(selector).first.wait_for(state=state, timeout=step.timeout_ms)
+            step_log["matched_wait_for"] = selector
+
+    async def _step_wait_for_state(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        state = step.get("state", "load")
+        self.step(f"Aguardando estado de carregamento {state}")
+        await page.wait_for_load_state(state)
+
+    async def _step_sleep(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> float:
+        seconds = float(step.get("seconds", 0.0))
+        self.step(f"Aguardando {seconds} segundos antes de continuar")
+        return seconds
+
+    async def _step_reset(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        """
+        Desfaz a consulta anterior numa pagina reaproveitada: fecha modais visiveis (`close`),
+        envia teclas (`keys`), limpa campos (`clear`) e espera o resultado antigo sumir
+        (`wait_hidden`). Falha aqui faz o chamador refazer o setup.
+        """
+        timeout = step.timeout_ms
+        for selector in _as_tuple(step.get("close")):
+            locator = page.locator(selector).first
+            if await locator.is_visible():
+                self.step(f"Fechando {selector}")
+                await locator.click(timeout=timeout)
+        for key in _as_tuple(step.get("keys")):
+            await page.keyboard.press(key)
+        for selector in _as_tuple(step.get("clear")):
+            self.step(f"Limpando campo {selector}")
+            await page.fill(selector, "", timeout=timeout)
+        hidden = _as_tuple(step.get("wait_hidden"))
+        if hidden:
+            await asyncio.gather(
+                *(
+                    page.locator(selector).first.wait_for(state="hidden", timeout=timeout)
+                    for selector in hidden
+                )
+            )
+
+    async def _step_wait_for_response(
+        self, page: Any, step: StepPlan, identifier: str, step_log: Dict[str, Any]
+    ) -> None:
+        """Bloqueia os passos seguintes ate a resposta de `response_parsing` chegar."""
+        capture = self._response_capture(page)
+        if capture is None:
+            raise RuntimeError("pagina sem suporte a captura de respostas")
+        self.step("Aguardando resposta do endpoint de resultado")
+        response = await self._until_blocked(
+            self._response_monitor(page), capture.wait(step.timeout_ms)
+        )
+        step_log["response_url"] = response.url
+        step_log["response_status"] = response.status
+
     async def keypress(
         self, page: Any, selector: Optional[str], key: str = "Enter", timeout: Optional[int] = None
     ) -> None:
@@ -575,83 +919,265 @@ class BaseDriver:
         timeout: int,
         state: str = "visible",
     ) -> str:
+        """
+        Aguarda todos os seletores ao mesmo tempo sob um unico prazo (`timeout`) e devolve o
+        primeiro que atingir `state`; os demais sao cancelados.
+        """
         selector_list = [candidate for candidate in selectors if candidate]
+        if not selector_list:
+            raise TimeoutError(f"Nenhum seletor valido informado: {selector_list}")
+
+        waiters = {
+            asyncio.ensure_future(
+                page.locator(candidate).first.wait_for(state=state, timeout=timeout)
+            ): candidate
+            for candidate in selector_list
+        }
+        deadline = time.monotonic() + (timeout / 1000.0)
+        pending = set(waiters)
         last_error: Optional[Exception] = None
-        for candidate in selector_list:
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        matched = waiters[task]
+                        self.step(f"Seletor {matched} atingiu o estado '{state}'")
+                        return matched
+                    last_error = task.exception()
+        finally:
+            await _cancel_tasks(pending)
+        raise TimeoutError(
+            f"Nenhum seletor em {selector_list} foi encontrado em {timeout}ms: {last_error}"
+        )
+
+    def _block_plan(self) -> BlockPlan:
+        if self.plan is not None:
+            return self.plan.block
+        return BlockPlan(
+            indicators=tuple(DEFAULT_BLOCK_KEYWORDS),
+            captcha_selectors=CAPTCHA_SELECTORS,
+            statuses=frozenset(BLOCK_HTTP_STATUSES),
+        )
+
+    def _response_monitor(self, page: Any) -> Optional[ResponseMonitor]:
+        """Monitor de status HTTP da pagina; None para objetos sem `page.on` (testes)."""
+        if not hasattr(page, "on"):
+            return None
+        return response_monitor(page, self._block_plan().statuses)
+
+    def _response_capture(self, page: Any) -> Optional[ResponseCapture]:
+        if not hasattr(page, "on"):
+            return None
+        return response_capture(page)
+
+    def _arm_response_capture(
+        self, page: Any, mapping_plan: MappingPlan, identifier: str
+    ) -> Optional[ResponseCapture]:
+        """Arma a captura antes dos passos por identificador (None sem response_parsing)."""
+        if mapping_plan.response is None:
+            return None
+        capture = self._response_capture(page)
+        if capture is not None:
+            capture.arm(mapping_plan.response, identifier)
+        return capture
+
+    def _disarm_response_capture(self, page: Any) -> None:
+        if self.plan is not None and self.plan.response is not None and hasattr(page, "on"):
+            response_capture(page).disarm()
+
+    async def _parse_response(
+        self,
+        page: Any,
+        capture: ResponseCapture,
+        response_plan: ResponsePlan,
+        parsing: ResultPlan,
+        run_debug: Dict[str, Any],
+    ) -> Optional[Tuple[str, str, str, Dict[str, Any]]]:
+        """
+        Decide pelo payload da resposta capturada. Devolve None (e o chamador cai para o
+        texto renderizado) quando nada casou no prazo ou o corpo nao e JSON.
+        """
+        response_debug: Dict[str, Any] = {"url_pattern": response_plan.pattern.pattern}
+        run_debug["response"] = response_debug
+        try:
+            response = await self._until_blocked(
+                self._response_monitor(page), capture.wait(response_plan.timeout_ms)
+            )
+        except asyncio.TimeoutError:
+            self.step("Nenhuma resposta do endpoint no prazo; lendo o resultado da pagina")
+            response_debug["fallback"] = "timeout"
+            return None
+        response_debug.update({"url": response.url, "status_code": response.status})
+        if response.status in self._block_plan().statuses:
+            raise BlockedRequestError(f"HTTP {response.status} em {response.url}")
+        if capture.payload is None:
             try:
-                await page.locator(candidate).first.wait_for(
-                    state=state, timeout=timeout
+                capture.payload = await response.json()
+            except Exception as exc:
+                self.step(f"Resposta do endpoint ilegivel ({exc}); lendo o resultado da pagina")
+                response_debug["fallback"] = "invalid_json"
+                return None
+        status, plan, message, payload_debug = response_plan.payload.decide(
+            capture.payload, parsing
+        )
+        self.step(f"Resultado decidido pela resposta {response.url}")
+        return status, plan, message, {
+            **payload_debug,
+            "decided_status": status,
+            "detection": "response",
+        }
+
+    async def _until_blocked(
+        self, monitor: Optional[ResponseMonitor], awaitable: Awaitable[Any]
+    ) -> Any:
+        """Aguarda `awaitable`, abortando assim que o portal responder com status de bloqueio."""
+        if monitor is None:
+            return await awaitable
+        if monitor.blocked:
+            raise BlockedRequestError(monitor.blocked)
+        task = asyncio.ensure_future(awaitable)
+        blocked = asyncio.ensure_future(monitor.event.wait())
+        try:
+            await asyncio.wait({task, blocked}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            await _cancel_tasks({task, blocked})
+        if monitor.blocked:
+            raise BlockedRequestError(monitor.blocked)
+        return task.result()
+
+    async def _poll_text(
+        self, page: Any, selector: str, deadline: float, poll_interval: float
+    ) -> str:
+        """Sonda o seletor ate ter texto nao vazio ou o prazo acabar ("" nesse caso)."""
+        locator = page.locator(selector).first
+        while time.monotonic() < deadline:
+            try:
+                await locator.wait_for(
+                    state="visible",
+                    timeout=min(1000, max(200, int(poll_interval * 1000))),
                 )
+            except Exception:
+                pass
+            try:
+                candidate = (await locator.inner_text()).strip()
+            except Exception:
+                candidate = ""
+            if candidate:
                 return candidate
-            except Exception as exc:
-                last_error = exc
-                continue
-        if last_error:
-            raise TimeoutError(
-                f"Nenhum seletor em {selector_list} foi encontrado: {last_error}"
-            )
-        raise TimeoutError(f"Nenhum seletor valido informado: {selector_list}")
+            await asyncio.sleep(poll_interval)
+        return ""
 
-    async def _parse_result(self, page: Any, parsing: Dict[str, Any]):
-        status_selectors = parsing.get("status_selectors") or (
-            parsing.get("status_selector_any")
-            or parsing.get("status_selector")
-        )
-        if isinstance(status_selectors, str):
-            status_selectors = [status_selectors]
+    async def _first_text(
+        self,
+        page: Any,
+        selectors: Iterable[str],
+        timeout: int,
+        poll_interval: float,
+    ) -> Tuple[Optional[str], str]:
+        """
+        Sonda todos os seletores em paralelo sob um unico prazo; o primeiro com texto vence
+        e os demais sao cancelados. Devolve (seletor, texto) ou (None, "").
+        """
+        deadline = time.monotonic() + (timeout / 1000.0)
+        probes = {
+            asyncio.ensure_future(
+                self._poll_text(page, selector, deadline, poll_interval)
+            ): selector
+            for selector in selectors
+            if selector
+        }
+        pending = set(probes)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    text = "" if task.exception() else task.result()
+                    if text:
+                        return probes[task], text
+        finally:
+            await _cancel_tasks(pending)
+        return None, ""
+
+    async def _parse_result(self, page: Any, parsing: ResultPlan):
+        status_selectors = parsing.status_selectors
+        status_timeout = parsing.status_timeout_ms
+        plan_selectors = parsing.plan_selectors
 
         if not status_selectors:
             return "erro", "", "status_selector ausente", {
                 "status_selector": None,
-                "status_timeout_ms": parsing.get("status_timeout_ms", 12000),
+                "status_timeout_ms": status_timeout,
                 "captured_text": "",
             }
 
-        status_timeout = parsing.get("status_timeout_ms", TIMEOUT_SELECTOR_MS)
-        poll_interval = max(
-            0.1, float(parsing.get("status_poll_interval_ms", 300)) / 1000.0
-        )
-        raw_text = ""
-        matched_selector: Optional[str] = None
+        block = self._block_plan()
+        monitor = self._response_monitor(page)
 
         self.step("Verificando seletores de status para identificar o resultado")
-        for selector in status_selectors:
-            self.step(f"Verificando seletor de status {selector}")
-            locator = page.locator(selector).first
-            deadline = time.monotonic() + (status_timeout / 1000.0)
-            candidate_text = ""
-
-            while time.monotonic() < deadline:
-                try:
-                    await locator.wait_for(
-                        state="visible",
-                        timeout=min(1000, max(200, int(poll_interval * 1000))),
-                    )
-                except Exception:
-                    pass
-                try:
-                    candidate = (await locator.inner_text()).strip()
-                except Exception:
-                    candidate = ""
-                if candidate:
-                    candidate_text = candidate
-                    break
-                await asyncio.sleep(poll_interval)
-
-            if candidate_text:
-                raw_text = candidate_text
-                matched_selector = selector
-                break
-
-        if not raw_text:
+        watched = None
+        if parsing.dom_watcher:
             try:
-                page_html = (await page.content()).lower()
-                if "captcha" in page_html or "bloque" in page_html:
-                    raise BlockedRequestError("bloqueio detectado (captcha)")
+                watched = await self._until_blocked(
+                    monitor,
+                    watch_result(
+                        page,
+                        status_selectors=status_selectors,
+                        plan_selectors=plan_selectors,
+                        block_indicators=block.indicators,
+                        captcha_selectors=block.captcha_selectors,
+                        timeout_ms=status_timeout,
+                    ),
+                )
             except BlockedRequestError:
                 raise
-            except Exception:
-                pass
+            except Exception as exc:
+                # Navegacao no meio da espera destroi o contexto; cai para a sondagem.
+                self.step(f"Observador de resultado indisponivel: {exc}")
+
+        watched_plan = ""
+        if watched is not None:
+            if watched.get("blocked"):
+                raise BlockedRequestError(
+                    f"indicativo de bloqueio detectado na pagina: {watched['blocked']}"
+                )
+            matched_selector = watched.get("selector")
+            raw_text = (watched.get("text") or "").strip()
+            watched_plan = (watched.get("plan_text") or "").strip()
+        else:
+            self.step("Verificando indicadores de bloqueio")
+            indicator = await check_block(
+                page,
+                block_indicators=block.indicators,
+                captcha_selectors=block.captcha_selectors,
+            )
+            if indicator:
+                raise BlockedRequestError(
+                    f"indicativo de bloqueio detectado na pagina: {indicator}"
+                )
+            matched_selector, raw_text = await self._until_blocked(
+                monitor,
+                self._first_text(page, status_selectors, status_timeout, parsing.poll_interval),
+            )
+            if not raw_text:
+                try:
+                    indicator = await check_block(
+                        page,
+                        block_indicators=block.indicators,
+                        captcha_selectors=block.captcha_selectors,
+                        nothing_found=True,
+                    )
+                except Exception:
+                    indicator = None
+                if indicator:
+                    raise BlockedRequestError(f"bloqueio detectado ({indicator})")
 
         if matched_selector:
             self.step(f"Texto de status encontrado no seletor {matched_selector}")
@@ -664,28 +1190,15 @@ class BaseDriver:
                 f"[{self.operator}] nenhum texto encontrado para {status_selectors}"
             )
 
-        normalized = normalize_text(raw_text)
-        positive = [normalize_text(s) for s in parsing.get("positive_keywords", [])]
-        negative = [normalize_text(s) for s in parsing.get("negative_keywords", [])]
-        errors = [normalize_text(s) for s in parsing.get("error_keywords", [])]
-
-        status = "indefinido"
-        if normalized and any(k and k in normalized for k in positive):
-            status = "ativo"
-        elif normalized and any(k and k in normalized for k in negative):
-            status = "inativo"
-        elif normalized and any(k and k in normalized for k in errors):
-            status = "erro"
+        status = parsing.classify(normalize_text(raw_text))
 
         message = raw_text[:300]
 
-        plan = ""
-        plan_selectors = parsing.get("plan_selectors") or parsing.get("plan_selector")
-        if isinstance(plan_selectors, str):
-            plan_selectors = [plan_selectors]
-        plan_text = ""
+        plan = watched_plan[:300]
+        plan_text = watched_plan
         last_error: Optional[Exception] = None
-        if plan_selectors:
+        # Com o observador, o plano ja veio no mesmo snapshot do status.
+        if plan_selectors and watched is None:
             for selector in plan_selectors:
                 try:
                     self.step(f"Capturando informacoes de plano no seletor {selector}")
@@ -702,10 +1215,7 @@ class BaseDriver:
                     last_error = err
                     continue
             else:
-                if (
-                    not parsing.get("plan_optional", False)
-                    and last_error is not None
-                ):
+                if not parsing.plan_optional and last_error is not None:
                     self.log_exception(last_error)
                     print(
                         f"[{self.operator}] falha ao capturar plano em '{plan_selectors}': {last_error}"
@@ -719,12 +1229,13 @@ class BaseDriver:
             plan = message
 
         debug_info = {
-            "status_selector": matched_selector or status_selectors,
+            "status_selector": matched_selector or list(status_selectors),
             "status_timeout_ms": status_timeout,
             "captured_text": raw_text[:500],
-            "plan_selector": plan_selectors,
+            "plan_selector": list(plan_selectors),
             "plan_text": plan_text[:500] if plan_text else "",
             "decided_status": status,
+            "detection": "watcher" if watched is not None else "polling",
         }
 
         self.step(
@@ -732,19 +1243,35 @@ class BaseDriver:
         )
         return status, plan, message, debug_info
 
+    async def _capture_debug_artifacts(
+        self, page: Any, identifier: str, label: str
+    ) -> Dict[str, str]:
+        """
+        Screenshot e HTML de uma consulta concluida (debug_capture sampled/full) pelo servico
+        de artefatos; os arquivos sao gravados em segundo plano.
+        """
+        if page is None:
+            return {}
+        ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        try:
+            return await artifact_service.capture_debug(
+                page, os.path.join(DEBUG_DIR, self.operator), f"{ts}_{identifier}_{label}"
+            )
+        except Exception as exc:
+            print(f"[{self.operator}] falha ao salvar captura de depuracao: {exc}")
+            return {}
+
     async def _capture_failure_artifact(self, page: Any) -> Optional[str]:
+        """
+        Screenshot de falha pelo servico de artefatos: limitado por operador, JPEG/WebP com
+        dimensoes maximas e gravado em segundo plano. None quando descartado pelo limite.
+        """
         if page is None:
             return None
         try:
-            operator_dir = os.path.join(ERRORS_DIR, self.operator)
-            os.makedirs(operator_dir, exist_ok=True)
-            ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-            path = os.path.join(operator_dir, f"{ts}.png")
-            await page.screenshot(path=path, full_page=True)
-            return os.path.normpath(path)
+            return await artifact_service.capture(
+                page, os.path.join(ERRORS_DIR, self.operator), self.operator
+            )
         except Exception as exc:
             print(f"[{self.operator}] falha ao salvar screenshot de erro: {exc}")
             return None
-
-
-
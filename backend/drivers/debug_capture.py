@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Niveis de captura de depuracao (screenshot, HTML, texto da pagina) por consulta:
+- off: nada, nem em erro;
+- on-error: so quando a consulta falha (padrao);
+- sampled: falhas e uma amostra das consultas bem-sucedidas (DEBUG_SAMPLE_RATE);
+- full: toda consulta, para investigar um job especifico.
+"""
+import os
+import random
+from dataclasses import dataclass
+from typing import Optional
+
+DEBUG_LEVELS = ("off", "on-error", "sampled", "full")
+# Nivel usado quando o job nao informa debug_capture.
+DEBUG_CAPTURE = os.getenv("DEBUG_CAPTURE", "on-error")
+# Fracao das consultas bem-sucedidas capturadas no nivel "sampled".
+DEBUG_SAMPLE_RATE = float(os.getenv("DEBUG_SAMPLE_RATE", "0.05"))
+
+
+def parse_level(value: Optional[str]) -> str:
+    """Valida o nivel (aceita on_error); None/vazio usa DEBUG_CAPTURE."""
+    if value is None or not str(value).strip():
+        value = DEBUG_CAPTURE
+    level = str(value).strip().lower().replace("_", "-")
+    if level not in DEBUG_LEVELS:
+        raise ValueError(f"debug_capture invalido: {value} (use {', '.join(DEBUG_LEVELS)})")
+    return level
+
+
+@dataclass(frozen=True)
+class LookupCapture:
+    """Decisao de captura de uma consulta; a amostragem e sorteada uma vez, na criacao."""
+
+    level: str
+    sampled: bool = False
+
+    @classmethod
+    def for_level(
+        cls, level: Optional[str] = None, sample_rate: float = DEBUG_SAMPLE_RATE
+    ) -> "LookupCapture":
+        level = parse_level(level)
+        return cls(level=level, sampled=level == "sampled" and random.random() < sample_rate)
+
+    @property
+    def on_error(self) -> bool:
+        return self.level != "off"
+
+    @property
+    def on_success(self) -> bool:
+        return self.level == "full" or self.sampled
@@ -2,14 +2,17 @@ import asyncio
 import logging
 import os
 import time
-from collections import defaultdict
-from typing import Awaitable, Callable, Dict, List, Optional, Iterable
+from collections import defaultdict, deque
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Iterable,
+    Tuple,
+)
 
 from .amil import AmilDriver
 from .bradesco import BradescoDriver
 from .seguros_unimed import SegurosUnimedDriver
 from .unimed import UnimedDriver
-from .base import BaseDriver, DriverResult
+from .base import RETRY_POLICY, BaseDriver, DriverResult
 from utils.metrics import record_metric
 
 logger = logging.getLogger("saude_fetch.driver_manager")
@@ -21,6 +24,7 @@ except ImportError:  # pragma: no cover
 
 MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "3"))
 PER_OPERATOR_CONCURRENCY = int(os.getenv("PER_OPERATOR_CONCURRENCY", "1"))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "200"))
 
 default_lock_factory = lambda: asyncio.Semaphore(PER_OPERATOR_CONCURRENCY)
 
@@ -28,6 +32,73 @@ _global_sem = asyncio.Semaphore(MAX_CONCURRENCY)
 _operator_locks: Dict[str, asyncio.Semaphore] = defaultdict(default_lock_factory)
 
 
+class _WorkItem(NamedTuple):
+    identifier: str
+    id_type: str
+    attempt: int = 1
+    # time.monotonic() a partir do qual o item pode ser consultado (retentativas adiadas).
+    ready_at: float = 0.0
+
+
+class _OperatorFeed:
+    """
+    Fila de identificadores pendentes de um driver. Retentativas voltam para o fim da fila com
+    `ready_at`; itens ainda em espera sao pulados (sem perder a posicao) e um bloqueio pausa o
+    operador inteiro.
+    """
+
+    def __init__(self) -> None:
+        self.items: Deque[_WorkItem] = deque()
+        self.available = asyncio.Event()
+        self.paused_until = 0.0
+        self.closed = False
+        # Item em consulta e motivo da falha do worker (sessao/navegador), se houver.
+        self.current: Optional[_WorkItem] = None
+        self.error: Optional[str] = None
+        self.source_done = False
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, item: _WorkItem) -> None:
+        self.items.append(item)
+        self.available.set()
+
+    def finish(self) -> None:
+        """A fonte terminou: `get` devolve None quando a fila (e as retentativas) esvaziar."""
+        self.source_done = True
+        self.available.set()
+
+    def take_all(self) -> List[_WorkItem]:
+        """Esvazia a fila (itens ainda nao consultados, inclusive retentativas adiadas)."""
+        items = list(self.items)
+        self.items.clear()
+        return items
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def get(self) -> Optional[_WorkItem]:
+        while True:
+            now = time.monotonic()
+            wait: Optional[float] = None
+            if now < self.paused_until:
+                wait = self.paused_until - now
+            elif self.items:
+                for index, item in enumerate(self.items):
+                    if item.ready_at <= now:
+                        del self.items[index]
+                        return item
+                wait = min(item.ready_at for item in self.items) - now
+            elif self.source_done:
+                return None
+            self.available.clear()
+            try:
+                await asyncio.wait_for(self.available.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+
 class DriverManager:
     def __init__(self) -> None:
         # Instantiate driver objects (assumes drivers implement required async methods)
@@ -46,12 +117,6 @@ class DriverManager:
                 "seguros_unimed": SegurosUnimedDriver(),
             }
 
-        # semaphores
-        self._global_sem = asyncio.Semaphore(MAX_CONCURRENCY)
-        self._per_operator_sem: Dict[str, asyncio.Semaphore] = {
-            name: asyncio.Semaphore(PER_OPERATOR_CONCURRENCY) for name in self._drivers.keys()
-        }
-
     # basic accessors
     def get(self, operator: str) -> BaseDriver:
         op = (operator or "").strip().lower()
@@ -70,71 +135,184 @@ class DriverManager:
         return self._drivers
 
     def reload(self) -> None:
-        for driver in self._drivers:
+        for driver in self._drivers.values():
             if hasattr(driver, "_load_mapping"):
                 driver._load_mapping()
 
-    async def run_batch(
+    async def run_stream(
         self,
-        identifiers: List[str],
-        id_type: str,
+        source: AsyncIterator[Tuple[str, str]],
         *,
         cache: Optional["Cache"] = None,
         db: Optional[object] = None,
         progress_callback: Optional[
             Callable[[str, BaseDriver, DriverResult, bool], Awaitable[None]]
         ] = None,
-    ) -> List[DriverResult]:
-        """Executa uma lista de identificadores em todos os drivers compatíveis."""
-        if not identifiers:
-            return []
-
-        results: List[DriverResult] = []
-        active_drivers = [
-            driver
-            for driver in self._drivers.values()
-            if id_type in getattr(driver, "supported_id_types", ("cpf",))
-        ]
-
-        for name, driver in self._drivers.items():
-            if driver not in active_drivers:
-                continue
-            logger.info(
-                f"🚀 Iniciando driver {driver.operator} com {len(identifiers)} CPFs"
-            )
-            print(
-                f"[{driver.operator}] iniciando consultas em lote ({len(identifiers)} itens)"
+        debug_capture: Optional[str] = None,
+        queue_size: int = STREAM_QUEUE_SIZE,
+    ) -> None:
+        """
+        Consome pares (identificador, tipo) de `source` enquanto ele ainda esta sendo produzido.
+        Cada driver compativel tem sua fila e seu worker, todos iniciados de imediato; o semaforo
+        global (MAX_CONCURRENCY) limita consultas simultaneas, nao operadores, entao cada
+        identificador e finalizado enquanto a fonte ainda e lida. A leitura da fonte pausa
+        quando a fila de algum driver atinge `queue_size`.
+        """
+        feeds: Dict[str, _OperatorFeed] = {}
+        workers: List[asyncio.Task] = []
+        changed = asyncio.Condition()
+
+        def backlogged() -> bool:
+            return any(
+                not feed.closed and len(feed) >= queue_size
+                for feed in feeds.values()
             )
+
+        async def dequeued() -> None:
+            async with changed:
+                changed.notify_all()
+
+        async def worker(driver: BaseDriver, feed: _OperatorFeed) -> None:
             try:
-                batch_results = await self._run_driver_batch(
+                async with _operator_locks[driver.name]:
+                    async with driver._lookup_session() as page:
+                        await self._drain_feed(
+                            driver,
+                            page,
+                            feed,
+                            cache=cache,
+                            db=db,
+                            progress_callback=progress_callback,
+                            debug_capture=debug_capture,
+                            on_dequeue=dequeued,
+                        )
+            except Exception as exc:
+                logger.error(f"⚠️ Erro no {driver.operator}: {exc}")
+                print(f"[{driver.operator}] erro no navegador persistente: {exc}")
+                feed.error = str(exc)
+            finally:
+                feed.closed = True
+                async with changed:
+                    changed.notify_all()
+            if feed.error is not None:
+                # Sem isso a linha do operador sumiria do export e o identificador seria
+                # finalizado como se todos tivessem respondido.
+                pending = feed.take_all()
+                if feed.current is not None:
+                    pending.insert(0, feed.current)
+                for item in pending:
+                    await self._fail_item(driver, item, feed.error, progress_callback)
+
+        try:
+            async for identifier, id_type in source:
+                for name, driver in self._drivers.items():
+                    if id_type not in getattr(driver, "supported_id_types", ("cpf",)):
+                        continue
+                    feed = feeds.get(name)
+                    if feed is None:
+                        feed = feeds[name] = _OperatorFeed()
+                        logger.info(f"🚀 Iniciando driver {driver.operator} em modo streaming")
+                        workers.append(asyncio.create_task(worker(driver, feed)))
+                    if not feed.closed:
+                        feed.put(_WorkItem(identifier, id_type))
+                    else:
+                        await self._fail_item(
+                            driver,
+                            _WorkItem(identifier, id_type),
+                            feed.error or "operador encerrado",
+                            progress_callback,
+                        )
+                if backlogged():
+                    async with changed:
+                        await changed.wait_for(lambda: not backlogged())
+        finally:
+            for feed in feeds.values():
+                feed.finish()
+            if workers:
+                await asyncio.gather(*workers)
+
+    async def _drain_feed(
+        self,
+        driver: BaseDriver,
+        page: Any,
+        feed: _OperatorFeed,
+        *,
+        cache: Optional["Cache"] = None,
+        db: Optional[object] = None,
+        progress_callback: Optional[
+            Callable[[str, BaseDriver, DriverResult, bool], Awaitable[None]]
+        ] = None,
+        debug_capture: Optional[str] = None,
+        on_dequeue: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        """
+        Consome a fila do operador na mesma pagina, ocupando uma vaga do semaforo global so
+        durante cada consulta. Falhas retentaveis nao seguram a pagina: voltam para o fim da
+        fila com o backoff da RETRY_POLICY (bloqueio pausa o operador).
+        """
+        while True:
+            item = await feed.get()
+            if on_dequeue is not None:
+                await on_dequeue()
+            if item is None:
+                return
+            feed.current = item
+            async with _global_sem:
+                result = await self._consult_one(
                     driver,
-                    identifiers,
-                    id_type,
+                    page,
+                    item.identifier,
+                    item.id_type,
                     cache=cache,
                     db=db,
                     progress_callback=progress_callback,
+                    debug_capture=debug_capture,
+                    attempt=item.attempt,
                 )
-                results.extend(batch_results)
-            except Exception as exc:
-                logger.error(f"⚠️ Erro no {driver.operator}: {exc}")
-                print(f"[DEBUG] ⚠️ {driver.operator} falhou: {exc}")
-                print(f"[{driver.operator}] falha no lote: {exc}")
-                for identifier in identifiers:
-                    results.append(
-                        DriverResult(
-                            operator=driver.operator,
-                            status="erro",
-                            message=f"falha no lote: {exc}",
-                            identifier=identifier,
-                            id_type=id_type,
-                        )
-                    )
-        return results
+            if self._is_retryable(result):
+                error_class = result.debug.get("error_class", "other")
+                delay = RETRY_POLICY.delay(error_class, item.attempt)
+                if error_class == "blocked":
+                    feed.pause(delay)
+                logger.info(
+                    f"🔁 {driver.operator}: {item.identifier} adiado {delay:.1f}s ({error_class}, tentativa {item.attempt})"
+                )
+                feed.put(
+                    item._replace(attempt=item.attempt + 1, ready_at=time.monotonic() + delay)
+                )
+            feed.current = None
+
+    async def _fail_item(
+        self,
+        driver: BaseDriver,
+        item: _WorkItem,
+        error: str,
+        progress_callback: Optional[
+            Callable[[str, BaseDriver, DriverResult, bool], Awaitable[None]]
+        ],
+    ) -> None:
+        """Resultado `erro` de um identificador que o operador com falha nao vai consultar."""
+        if not progress_callback:
+            return
+        result = DriverResult(
+            operator=driver.operator,
+            status="erro",
+            plan="",
+            message=f"falha no lote: {error}",
+            debug={"exception": error, "reason": "operator_failed"},
+            identifier=item.identifier,
+            id_type=item.id_type,
+        )
+        try:
+            await progress_callback(item.identifier, driver, result, False)
+        except Exception as exc:
+            logger.error(f"⚠️ Erro ao registrar falha de {driver.operator}: {exc}")
 
-    async def _run_driver_batch(
+    async def _consult_one(
         self,
         driver: BaseDriver,
-        identifiers: List[str],
+        page: Any,
+        identifier: str,
         id_type: str,
         *,
         cache: Optional["Cache"] = None,
@@ -142,115 +320,110 @@ class DriverManager:
         progress_callback: Optional[
             Callable[[str, BaseDriver, DriverResult, bool], Awaitable[None]]
         ] = None,
-    ) -> List[DriverResult]:
-        results: List[DriverResult] = []
-        try:
-            async with _global_sem, _operator_locks[driver.name]:
-                async with driver._persistent_browser() as page:
-                    for identifier in identifiers:
-                        cached_result: Optional[DriverResult] = None
-                        if cache is not None:
-                            try:
-                                cached_data = await cache.get(driver.name, identifier)
-                            except Exception:
-                                cached_data = None
-                            if cached_data and self._is_valid_cached_data(cached_data):
-                                cached_result = DriverResult(
-                                    operator=driver.operator,
-                                    status=cached_data.get("status", "erro"),
-                                    plan=cached_data.get("plan", ""),
-                                    message=cached_data.get("message", ""),
-                                    captured_at=cached_data.get("captured_at", ""),
-                                    debug=cached_data.get("debug", {}),
-                                    identifier=identifier,
-                                    id_type=id_type,
-                        )
+        debug_capture: Optional[str] = None,
+        attempt: int = 1,
+    ) -> DriverResult:
+        """
+        Uma tentativa para o identificador. Resultado com debug.retryable e intermediario: so
+        registra a metrica; cache e progress_callback ficam para o resultado final.
+        """
+        cached_result: Optional[DriverResult] = None
+        if cache is not None and attempt == 1:
+            try:
+                cached_data = await cache.get(driver.name, identifier)
+            except Exception:
+                cached_data = None
+            if cached_data and self._is_valid_cached_data(cached_data):
+                cached_result = DriverResult(
+                    operator=driver.operator,
+                    status=cached_data.get("status", "erro"),
+                    plan=cached_data.get("plan", ""),
+                    message=cached_data.get("message", ""),
+                    captured_at=cached_data.get("captured_at", ""),
+                    debug=cached_data.get("debug", {}),
+                    identifier=identifier,
+                    id_type=id_type,
+                )
 
-                        if cached_result is not None:
-                            logger.info(
-                                f"✅ {driver.operator} retornou (cache): {cached_result}"
-                            )
-                            print(
-                                f"[DEBUG] {driver.operator} retorno (cache) -> {cached_result}"
-                            )
-                            results.append(cached_result)
-                            if db is not None:
-                                await record_metric(
-                                    db,
-                                    driver.name,
-                                    identifier,
-                                    cached_result.status not in {"erro", "invalid"},
-                                    duration=0.0,
-                                    cached=True,
-                                )
-                            if progress_callback:
-                                await progress_callback(
-                                    identifier, driver, cached_result, True
-                                )
-                            continue
-
-                        logger.info(
-                            f"🧩 Executando {driver.operator} para {identifier}"
-                        )
-                        print(
-                            f"[DEBUG] {driver.operator}: processando {identifier}"
-                        )
-                        start = time.perf_counter()
-                        try:
-                            result = await driver.consult(
-                                identifier, id_type, page=page
-                            )
-                        except Exception as exc:
-                            logger.error(f"⚠️ Erro no {driver.operator}: {exc}")
-                            print(f"[DEBUG] ⚠️ {driver.operator} falhou: {exc}")
-                            result = DriverResult(
-                                operator=driver.operator,
-                                status="erro",
-                                plan="",
-                                message=str(exc),
-                                debug={"exception": str(exc)},
-                                identifier=identifier,
-                                id_type=id_type,
-                            )
-                        duration = time.perf_counter() - start
-                        results.append(result)
-                        logger.info(f"✅ {driver.operator} retornou: {result}")
-                        print(f"[DEBUG] {driver.operator} retorno -> {result}")
-
-                        if cache is not None and self._should_cache_result(result):
-                            try:
-                                await cache.set(
-                                    driver.name,
-                                    identifier,
-                                    {
-                                        "status": result.status,
-                                        "plan": result.plan,
-                                        "message": result.message,
-                                        "captured_at": result.captured_at,
-                                        "debug": result.debug,
-                                        "id_type": result.id_type,
-                                    },
-                                )
-                            except Exception:
-                                pass
-
-                        if db is not None:
-                            await record_metric(
-                                db,
-                                driver.name,
-                                identifier,
-                                result.status not in {"erro", "invalid"},
-                                duration=duration,
-                                cached=False,
-                            )
-
-                        if progress_callback:
-                            await progress_callback(identifier, driver, result, False)
+        if cached_result is not None:
+            logger.info(f"✅ {driver.operator} retornou (cache): {cached_result}")
+            print(f"[DEBUG] {driver.operator} retorno (cache) -> {cached_result}")
+            if db is not None:
+                await record_metric(
+                    db,
+                    driver.name,
+                    identifier,
+                    cached_result.status not in {"erro", "invalid"},
+                    duration=0.0,
+                    cached=True,
+                )
+            if progress_callback:
+                await progress_callback(identifier, driver, cached_result, True)
+            return cached_result
+
+        logger.info(f"🧩 Executando {driver.operator} para {identifier}")
+        print(f"[DEBUG] {driver.operator}: processando {identifier}")
+        start = time.perf_counter()
+        try:
+            result = await driver.consult(
+                identifier,
+                id_type,
+                page=page,
+                debug_capture=debug_capture,
+                attempt=attempt,
+                defer_retries=True,
+            )
         except Exception as exc:
             logger.error(f"⚠️ Erro no {driver.operator}: {exc}")
             print(f"[DEBUG] ⚠️ {driver.operator} falhou: {exc}")
-            print(f"[{driver.operator}] erro no navegador persistente: {exc}")
-        return results
+            result = DriverResult(
+                operator=driver.operator,
+                status="erro",
+                plan="",
+                message=str(exc),
+                debug={"exception": str(exc)},
+                identifier=identifier,
+                id_type=id_type,
+            )
+        duration = time.perf_counter() - start
+        logger.info(f"✅ {driver.operator} retornou: {result}")
+        print(f"[DEBUG] {driver.operator} retorno -> {result}")
+        final = not self._is_retryable(result)
+
+        if final and cache is not None and self._should_cache_result(result):
+            try:
+                await cache.set(
+                    driver.name,
+                    identifier,
+                    {
+                        "status": result.status,
+                        "plan": result.plan,
+                        "message": result.message,
+                        "captured_at": result.captured_at,
+                        "debug": result.debug,
+                        "id_type": result.id_type,
+                    },
+                )
+            except Exception:
+                pass
+
+        if db is not None:
+            await record_metric(
+                db,
+                driver.name,
+                identifier,
+                result.status not in {"erro", "invalid"},
+                duration=duration,
+                cached=False,
+            )
+
+        if final and progress_callback:
+            await progress_callback(identifier, driver, result, False)
+        return result
+
+    @staticmethod
+    def _is_retryable(result: DriverResult) -> bool:
+        return isinstance(result.debug, dict) and bool(result.debug.get("retryable"))
 
     @staticmethod
     def _is_valid_cached_data(data: Dict[str, object]) -> bool:
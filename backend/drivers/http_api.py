@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Modo `api` dos mappings: consulta direta ao endpoint JSON que alimenta a busca do portal.
+- um unico cliente HTTP assincrono por processo (pool de conexoes, HTTP/2 quando o pacote
+  `h2` esta instalado), reaproveitado por todos os drivers;
+- cookies opcionais lidos do storage state salvo pelo navegador persistente do operador;
+- status/plano/mensagem extraidos do payload por `PayloadPlan` (caminhos JSON do mapping).
+"""
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .plan import ApiPlan
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "20"))
+API_MAX_KEEPALIVE = int(os.getenv("API_MAX_KEEPALIVE", "10"))
+API_HTTP2 = os.getenv("API_HTTP2", "true").strip().lower() in {"1", "true", "yes", "on"}
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_client: Optional["httpx.AsyncClient"] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+# Cookies do storage state por arquivo, invalidados pelo mtime.
+_cookie_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+
+def shared_client() -> "httpx.AsyncClient":
+    """Cliente do processo; recriado apenas se o event loop mudar (scripts de teste)."""
+    global _client, _client_loop
+    if httpx is None:
+        raise RuntimeError("httpx nao instalado: mapping com mode 'api' indisponivel")
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            http2=API_HTTP2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_MAX_KEEPALIVE,
+            ),
+            follow_redirects=True,
+        )
+        _client_loop = loop
+        if API_HTTP2 and not HTTP2_AVAILABLE:
+            logger.info("pacote h2 ausente: consultas via api seguem em HTTP/1.1")
+    return _client
+
+
+async def close_shared_client() -> None:
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+def storage_state_cookies(path: str) -> List[Dict[str, Any]]:
+    """Cookies do storage state do Playwright (lista vazia se o arquivo nao existir)."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return []
+    cached = _cookie_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cookies = json.load(f).get("cookies") or []
+    except (OSError, ValueError, AttributeError) as exc:
+        logger.debug("storage state ilegivel em %s: %s", path, exc)
+        cookies = []
+    _cookie_cache[path] = (mtime, cookies)
+    return cookies
+
+
+def cookie_header(cookies: List[Dict[str, Any]], url: str) -> str:
+    """Monta o header Cookie com os cookies validos para o host, caminho e esquema da URL."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    path = parts.path or "/"
+    now = time.time()
+    pairs = []
+    for cookie in cookies:
+        domain = str(cookie.get("domain") or "").lower().lstrip(".")
+        if not domain or not (host == domain or host.endswith("." + domain)):
+            continue
+        if not path.startswith(cookie.get("path") or "/"):
+            continue
+        if cookie.get("secure") and parts.scheme != "https":
+            continue
+        expires = cookie.get("expires", -1)
+        if isinstance(expires, (int, float)) and 0 < expires < now:
+            continue
+        pairs.append(f"{cookie.get('name')}={cookie.get('value', '')}")
+    return "; ".join(pairs)
+
+
+def render(value: Any, identifier: str, id_type: str) -> Any:
+    """Substitui os placeholders em strings aninhadas (str.replace: corpos JSON tem chaves)."""
+    if isinstance(value, str):
+        return value.replace("{identifier}", identifier).replace("{id_type}", id_type)
+    if isinstance(value, (list, tuple)):
+        return [render(item, identifier, id_type) for item in value]
+    if hasattr(value, "items"):
+        return {key: render(item, identifier, id_type) for key, item in value.items()}
+    return value
+
+
+async def send(
+    api: ApiPlan,
+    identifier: str,
+    id_type: str,
+    storage_file: Optional[str] = None,
+) -> "httpx.Response":
+    client = shared_client()
+    url = render(api.url, identifier, id_type)
+    headers = render(api.headers, identifier, id_type)
+    if storage_file:
+        cookies = cookie_header(storage_state_cookies(storage_file), url)
+        if cookies:
+            headers["Cookie"] = cookies
+    kwargs: Dict[str, Any] = {
+        "params": render(api.params, identifier, id_type) or None,
+        "headers": headers,
+        "timeout": api.timeout_ms / 1000.0,
+    }
+    if api.json_body is not None:
+        kwargs["json"] = render(api.json_body, identifier, id_type)
+    elif api.form is not None:
+        kwargs["data"] = render(api.form, identifier, id_type)
+    return await client.request(api.method, url, **kwargs)
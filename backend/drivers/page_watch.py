@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+Deteccao no navegador, sem serializar o DOM para o Python:
+- observador injetado na pagina que espera o resultado com um MutationObserver e devolve
+  texto, seletor e checagem de bloqueio numa unica chamada `evaluate`;
+- checagem pontual de bloqueio (texto visivel, titulo, seletores de captcha);
+- monitor de status HTTP (429/403) via `page.on("response")`;
+- captura da resposta XHR/fetch que traz o resultado (`response_parsing` do mapping).
+"""
+import asyncio
+import logging
+import weakref
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Elementos tipicos de desafio anti-bot, checados quando nenhum texto aparece.
+CAPTCHA_SELECTORS = (
+    "iframe[src*='captcha' i]",
+    "iframe[title*='captcha' i]",
+    "div.g-recaptcha",
+    "div.hcaptcha-box",
+    "div[aria-label*='captcha' i]",
+)
+# Mesmas palavras que o fallback por page.content() procurava quando nao havia texto.
+CAPTCHA_KEYWORDS = ("captcha", "bloque")
+# Respostas consideradas na monitoracao de status HTTP (assets e beacons ficam de fora).
+MONITORED_RESOURCE_TYPES = frozenset({"document", "xhr", "fetch"})
+
+WATCHER_JS = """
+(() => {
+  if (window.__saudeFetch) return;
+
+  const isVisible = (el) =>
+    !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length));
+  const textOf = (el) => String(el.innerText || el.textContent || '').trim();
+  const squash = (value) => value.replace(/\\s+/g, ' ').trim();
+
+  const firstWithText = (elements) => {
+    for (const el of elements) {
+      if (!isVisible(el)) continue;
+      const text = textOf(el);
+      if (text) return text;
+    }
+    return '';
+  };
+
+  const textMatcher = (body) => {
+    const regex = body.match(/^\\/([\\s\\S]*)\\/([a-z]*)$/);
+    if (regex) {
+      const rx = new RegExp(regex[1], regex[2].replace('g', ''));
+      return (text) => rx.test(squash(text));
+    }
+    const quoted = body.match(/^(["'])([\\s\\S]*)\\1$/);
+    if (quoted) return (text) => squash(text) === quoted[2];
+    const needle = squash(body).toLowerCase();
+    return (text) => squash(text).toLowerCase().includes(needle);
+  };
+
+  // Subconjunto dos seletores do Playwright: text=, xpath= e CSS puro. O resto lanca erro
+  // e o driver volta para a sondagem via locator.
+  const compile = (selector) => {
+    if (selector.startsWith('text=')) {
+      const test = textMatcher(selector.slice(5).trim());
+      return () => {
+        const root = document.body || document.documentElement;
+        const walker = document.createTreeWalker(root, NodeFilter.SHOW_TEXT);
+        for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+          if (!node.nodeValue.trim() || !test(node.nodeValue)) continue;
+          const text = firstWithText([node.parentElement].filter(Boolean));
+          if (text) return text;
+        }
+        return '';
+      };
+    }
+    if (/^(xpath=|\\/\\/|\\(\\/\\/)/.test(selector)) {
+      const expr = selector.startsWith('xpath=') ? selector.slice(6) : selector;
+      const snapshot = () =>
+        document.evaluate(expr, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+      snapshot();
+      return () => {
+        const result = snapshot();
+        const nodes = [];
+        for (let i = 0; i < result.snapshotLength; i += 1) {
+          const node = result.snapshotItem(i);
+          if (node.nodeType === Node.ELEMENT_NODE) nodes.push(node);
+        }
+        return firstWithText(nodes);
+      };
+    }
+    const css = selector.startsWith('css=') ? selector.slice(4) : selector;
+    document.querySelector(css);
+    return () => firstWithText(document.querySelectorAll(css));
+  };
+
+  const blockCheck = (cfg, nothingFound) => {
+    const body = String((document.body && document.body.innerText) || '').toLowerCase();
+    const title = String(document.title || '').toLowerCase();
+    for (const indicator of cfg.block || []) {
+      if (body.includes(indicator) || title.includes(indicator)) return indicator;
+    }
+    if (nothingFound) {
+      for (const keyword of cfg.captcha_keywords || []) {
+        if (body.includes(keyword)) return keyword;
+      }
+      for (const selector of cfg.captcha_selectors || []) {
+        try {
+          if (isVisible(document.querySelector(selector))) return 'captcha: ' + selector;
+        } catch (err) {
+          // seletor invalido no navegador: ignorado
+        }
+      }
+    }
+    return null;
+  };
+
+  const watch = (cfg) => new Promise((resolve) => {
+    const groups = { status: [], plan: [] };
+    const unsupported = [];
+    for (const key of Object.keys(groups)) {
+      for (const selector of cfg[key] || []) {
+        try {
+          groups[key].push([selector, compile(selector)]);
+        } catch (err) {
+          unsupported.push(selector);
+        }
+      }
+    }
+    if (unsupported.length) {
+      resolve({ unsupported });
+      return;
+    }
+
+    const probe = (entries) => {
+      for (const [selector, find] of entries) {
+        const text = find();
+        if (text) return { selector, text };
+      }
+      return null;
+    };
+    let observer = null;
+    let timer = null;
+    let scheduled = false;
+    let finished = false;
+    const finish = (payload) => {
+      if (finished) return;
+      finished = true;
+      if (observer) observer.disconnect();
+      if (timer) clearTimeout(timer);
+      resolve(payload);
+    };
+    const settle = (timedOut) => {
+      const status = probe(groups.status);
+      const plan = probe(groups.plan);
+      if (!status && !plan && !timedOut) return;
+      finish({
+        selector: status ? status.selector : null,
+        text: status ? status.text : '',
+        plan_selector: plan ? plan.selector : null,
+        plan_text: plan ? plan.text : '',
+        blocked: blockCheck(cfg, !status && !plan),
+        timed_out: timedOut,
+      });
+    };
+
+    const blocked = blockCheck(cfg, false);
+    if (blocked) {
+      finish({ selector: null, text: '', blocked, timed_out: false });
+      return;
+    }
+    settle(false);
+    if (finished) return;
+    observer = new MutationObserver(() => {
+      if (scheduled) return;
+      scheduled = true;
+      setTimeout(() => {
+        scheduled = false;
+        settle(false);
+      }, cfg.throttle_ms || 0);
+    });
+    observer.observe(document.documentElement, {
+      subtree: true,
+      childList: true,
+      characterData: true,
+      attributes: true,
+    });
+    timer = setTimeout(() => settle(true), cfg.timeout_ms);
+  });
+
+  window.__saudeFetch = { watch, blocked: blockCheck };
+})();
+"""
+
+_WATCH_CALL = "cfg => window.__saudeFetch ? window.__saudeFetch.watch(cfg) : null"
+_BLOCK_CALL = (
+    "([cfg, nothingFound]) => window.__saudeFetch"
+    " ? {blocked: window.__saudeFetch.blocked(cfg, nothingFound)} : null"
+)
+
+_installed_pages: "weakref.WeakSet[Any]" = weakref.WeakSet()
+_monitors: "weakref.WeakKeyDictionary[Any, ResponseMonitor]" = weakref.WeakKeyDictionary()
+_captures: "weakref.WeakKeyDictionary[Any, ResponseCapture]" = weakref.WeakKeyDictionary()
+
+
+async def install_watcher(page: Any) -> None:
+    """Registra o observador para documentos futuros da pagina (uma vez por pagina)."""
+    if page in _installed_pages:
+        return
+    await page.add_init_script(script=WATCHER_JS)
+    _installed_pages.add(page)
+
+
+async def _evaluate(page: Any, call: str, arg: Any) -> Any:
+    await install_watcher(page)
+    result = await page.evaluate(call, arg)
+    if result is None:
+        # Documento carregado antes do init script: injeta no documento atual.
+        await page.evaluate(WATCHER_JS)
+        result = await page.evaluate(call, arg)
+    return result
+
+
+def _block_cfg(
+    block_indicators: Iterable[str], captcha_selectors: Iterable[str]
+) -> Dict[str, Any]:
+    return {
+        "block": [str(item).lower() for item in block_indicators],
+        "captcha_keywords": list(CAPTCHA_KEYWORDS),
+        "captcha_selectors": list(captcha_selectors),
+    }
+
+
+async def watch_result(
+    page: Any,
+    *,
+    status_selectors: Iterable[str],
+    plan_selectors: Iterable[str],
+    block_indicators: Iterable[str],
+    captcha_selectors: Iterable[str] = CAPTCHA_SELECTORS,
+    timeout_ms: int,
+    throttle_ms: int = 50,
+) -> Optional[Dict[str, Any]]:
+    """
+    Aguarda texto em algum seletor de status/plano. Devolve o payload do observador ou None
+    quando algum seletor nao e suportado no navegador (o chamador deve sondar via locator).
+    """
+    cfg = {
+        "status": [s for s in status_selectors if s],
+        "plan": [s for s in plan_selectors if s],
+        "timeout_ms": int(timeout_ms),
+        "throttle_ms": int(throttle_ms),
+        **_block_cfg(block_indicators, captcha_selectors),
+    }
+    result = await _evaluate(page, _WATCH_CALL, cfg)
+    if not result or result.get("unsupported"):
+        if result:
+            logger.debug("seletores sem suporte no observador: %s", result["unsupported"])
+        return None
+    return result
+
+
+async def check_block(
+    page: Any,
+    *,
+    block_indicators: Iterable[str],
+    captcha_selectors: Iterable[str] = CAPTCHA_SELECTORS,
+    nothing_found: bool = False,
+) -> Optional[str]:
+    """
+    Checagem pontual no navegador (texto visivel, titulo e, sem resultado, seletores de
+    captcha). Devolve o indicador encontrado; o HTML nao trafega pelo CDP.
+    """
+    cfg = _block_cfg(block_indicators, captcha_selectors)
+    result = await _evaluate(page, _BLOCK_CALL, [cfg, nothing_found])
+    return (result or {}).get("blocked")
+
+
+def _host(url: str) -> str:
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class ResponseMonitor:
+    """
+    Acompanha `page.on("response")` e marca bloqueio quando o proprio portal (mesmo host da
+    pagina ou subdominio) responde com um dos status configurados, tipicamente 429/403.
+    """
+
+    def __init__(self, page: Any, statuses: Iterable[int]) -> None:
+        self._page = weakref.ref(page)
+        self.statuses = frozenset(int(status) for status in statuses)
+        self.blocked: Optional[str] = None
+        self.event = asyncio.Event()
+
+    def reset(self) -> None:
+        self.blocked = None
+        self.event.clear()
+
+    def on_response(self, response: Any) -> None:
+        if self.blocked or response.status not in self.statuses:
+            return
+        try:
+            resource_type = response.request.resource_type
+        except Exception:
+            resource_type = ""
+        if resource_type not in MONITORED_RESOURCE_TYPES:
+            return
+        page = self._page()
+        page_host = _host(getattr(page, "url", "") or "") if page is not None else ""
+        response_host = _host(response.url)
+        if page_host and not (
+            response_host == page_host or response_host.endswith("." + page_host)
+        ):
+            return
+        self.blocked = f"HTTP {response.status} em {response.url}"
+        self.event.set()
+
+
+def response_monitor(page: Any, statuses: Iterable[int]) -> ResponseMonitor:
+    """Monitor da pagina, registrado no primeiro uso."""
+    monitor = _monitors.get(page)
+    if monitor is None:
+        monitor = ResponseMonitor(page, statuses)
+        page.on("response", monitor.on_response)
+        _monitors[page] = monitor
+    else:
+        monitor.statuses = frozenset(int(status) for status in statuses)
+    return monitor
+
+
+class ResponseCapture:
+    """
+    Guarda a primeira resposta que casar com o `ResponsePlan` desde o ultimo `arm`. Fica
+    armada durante os passos por identificador, entao a resposta nao se perde mesmo chegando
+    antes do passo `wait_for_response`.
+    """
+
+    def __init__(self) -> None:
+        self.plan: Any = None
+        self.identifier = ""
+        self.response: Any = None
+        self.payload: Any = None
+        self.event = asyncio.Event()
+
+    def arm(self, plan: Any, identifier: str) -> None:
+        self.plan = plan
+        self.identifier = identifier
+        self.response = None
+        self.payload = None
+        self.event.clear()
+
+    def disarm(self) -> None:
+        self.plan = None
+
+    def on_response(self, response: Any) -> None:
+        plan = self.plan
+        if plan is None or self.response is not None:
+            return
+        try:
+            request = response.request
+            if not plan.matches(response.url, request.method):
+                return
+            if plan.match_identifier and self.identifier not in response.url:
+                if self.identifier not in (request.post_data or ""):
+                    return
+        except Exception:
+            return
+        self.response = response
+        self.event.set()
+
+    async def wait(self, timeout_ms: int) -> Any:
+        """Resposta capturada; TimeoutError se nada casar no prazo."""
+        if self.response is None:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout_ms / 1000.0)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(f"nenhuma resposta casou em {timeout_ms}ms")
+        return self.response
+
+
+def response_capture(page: Any) -> ResponseCapture:
+    """Captura da pagina, registrada no primeiro uso."""
+    capture = _captures.get(page)
+    if capture is None:
+        capture = ResponseCapture()
+        page.on("response", capture.on_response)
+        _captures[page] = capture
+    return capture
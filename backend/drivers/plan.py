@@ -0,0 +1,628 @@
+# -*- coding: utf-8 -*-
+"""
+Compilacao dos mappings JSON em planos imutaveis: feita uma vez no carregamento, para que
+erros de mapping aparecam cedo e a consulta de cada identificador nao refaca normalizacoes.
+"""
+import fnmatch
+import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Pattern,
+    Tuple,
+    Union,
+)
+
+STATUS_POLL_INTERVAL_DEFAULT_MS = 300
+
+# Acoes que exigem `selector` no passo.
+SELECTOR_ACTIONS = ("fill", "click", "wait_for")
+# Operacoes aceitas pela acao `reset` (executadas nesta ordem).
+RESET_OPERATIONS = ("close", "keys", "clear", "wait_hidden")
+# Acoes que dependem de `response_parsing` no mapping.
+RESPONSE_ACTIONS = ("wait_for_response",)
+# Modos de consulta: DOM via Playwright ou requisicao direta ao endpoint JSON.
+LOOKUP_MODES = ("browser", "api")
+# Status aceitos em `api.result.empty` (nenhum valor no caminho de status).
+RESULT_STATUSES = ("ativo", "inativo", "indefinido", "erro")
+HTTP_METHODS = ("GET", "POST", "PUT", "PATCH")
+# Tipos de recurso do Playwright que `block_resources.types` aceita ("document" nunca).
+BLOCKABLE_RESOURCE_TYPES = frozenset(
+    {
+        "stylesheet",
+        "image",
+        "media",
+        "font",
+        "script",
+        "texttrack",
+        "xhr",
+        "fetch",
+        "eventsource",
+        "websocket",
+        "manifest",
+        "other",
+    }
+)
+
+
+class MappingError(ValueError):
+    """Raised when a mapping file cannot be compiled into a plan."""
+
+
+def normalize_text(value: str) -> str:
+    """Normaliza texto removendo espacos repetidos e padronizando para maiusculas."""
+    if not value:
+        return ""
+    cleaned = value.replace("\u00A0", " ")
+    cleaned = re.sub(r"\s+", " ", cleaned)
+    return cleaned.strip().upper()
+
+
+@dataclass(frozen=True)
+class KeywordMatcher:
+    """Palavras-chave ja normalizadas e uma unica regex alternando todas elas."""
+
+    keywords: Tuple[str, ...]
+    pattern: Optional[Pattern[str]]
+
+    @classmethod
+    def build(cls, raw: Iterable[Any]) -> "KeywordMatcher":
+        keywords = tuple(dict.fromkeys(k for k in (normalize_text(str(r)) for r in raw) if k))
+        if not keywords:
+            return cls(keywords=(), pattern=None)
+        # Mais longas primeiro: a alternancia para no primeiro ramo que casar.
+        ordered = sorted(keywords, key=len, reverse=True)
+        return cls(keywords=keywords, pattern=re.compile("|".join(map(re.escape, ordered))))
+
+    def matches(self, normalized: str) -> bool:
+        return bool(normalized and self.pattern is not None and self.pattern.search(normalized))
+
+
+@dataclass(frozen=True)
+class StepPlan:
+    index: int
+    action: str
+    handler: Callable[..., Any]
+    options: Mapping[str, Any]
+    optional: bool
+    timeout_ms: int
+    delay: float
+    wait_selector: Union[str, Tuple[str, ...], None]
+    phase: str = "per_identifier"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.options.get(key, default)
+
+
+@dataclass(frozen=True)
+class ResultPlan:
+    status_selectors: Tuple[str, ...]
+    plan_selectors: Tuple[str, ...]
+    status_timeout_ms: int
+    poll_interval: float
+    plan_optional: bool
+    dom_watcher: bool
+    positive: KeywordMatcher
+    negative: KeywordMatcher
+    errors: KeywordMatcher
+
+    def classify(self, normalized: str) -> str:
+        if self.positive.matches(normalized):
+            return "ativo"
+        if self.negative.matches(normalized):
+            return "inativo"
+        if self.errors.matches(normalized):
+            return "erro"
+        return "indefinido"
+
+
+@dataclass(frozen=True)
+class BlockPlan:
+    indicators: Tuple[str, ...]
+    captcha_selectors: Tuple[str, ...]
+    statuses: FrozenSet[int]
+
+
+@dataclass(frozen=True)
+class ResourcePolicy:
+    """Requisicoes abortadas via page.route: por tipo de recurso ou por padrao de URL."""
+
+    types: FrozenSet[str]
+    pattern: Optional[Pattern[str]]
+    allow: Optional[Pattern[str]]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.types) or self.pattern is not None
+
+    def blocks(self, resource_type: str, url: str) -> bool:
+        if self.allow is not None and self.allow.match(url):
+            return False
+        if resource_type in self.types:
+            return True
+        return self.pattern is not None and self.pattern.match(url) is not None
+
+
+# Caminho JSON compilado: chave (str), indice (int) ou curinga (None).
+JsonPath = Tuple[Union[str, int, None], ...]
+
+_JSON_PATH_TOKEN = re.compile(
+    r"""\.(?P<key>[A-Za-z_$][\w$-]*)|\.(?P<dot_star>\*)|\[(?P<index>-?\d+)\]"""
+    r"""|\[(?P<star>\*)\]|\[(?P<q>['"])(?P<quoted>(?:(?!(?P=q)).)*)(?P=q)\]"""
+)
+
+
+def compile_json_path(expr: Any, field: str) -> Optional[JsonPath]:
+    """
+    Subconjunto de JSONPath: `$.a.b`, `$['chave com espaco']`, `$.lista[0]`, `$.lista[*].x`.
+    O `$` inicial e opcional.
+    """
+    if expr is None or expr == "":
+        return None
+    if not isinstance(expr, str):
+        raise MappingError(f"{field} deve ser uma string JSONPath")
+    text = expr.strip()
+    if text.startswith("$"):
+        text = text[1:]
+    if text and text[0] not in ".[":
+        text = "." + text
+    tokens: List[Union[str, int, None]] = []
+    pos = 0
+    while pos < len(text):
+        match = _JSON_PATH_TOKEN.match(text, pos)
+        if match is None:
+            raise MappingError(f"{field}: JSONPath nao suportado: {expr!r}")
+        if match.group("key") is not None:
+            tokens.append(match.group("key"))
+        elif match.group("quoted") is not None:
+            tokens.append(match.group("quoted"))
+        elif match.group("index") is not None:
+            tokens.append(int(match.group("index")))
+        else:
+            tokens.append(None)
+        pos = match.end()
+    return tuple(tokens)
+
+
+def extract_json(data: Any, path: JsonPath) -> List[Any]:
+    """Valores do payload no caminho; curingas expandem listas e objetos."""
+    current = [data]
+    for token in path:
+        found: List[Any] = []
+        for node in current:
+            if token is None:
+                if isinstance(node, list):
+                    found.extend(node)
+                elif isinstance(node, dict):
+                    found.extend(node.values())
+            elif isinstance(token, int):
+                if isinstance(node, list) and -len(node) <= token < len(node):
+                    found.append(node[token])
+            elif isinstance(node, dict) and token in node:
+                found.append(node[token])
+        current = found
+    return current
+
+
+def _payload_texts(values: List[Any]) -> List[str]:
+    texts = []
+    for value in values:
+        if value is None or isinstance(value, (dict, list)):
+            continue
+        text = str(value).strip()
+        if text:
+            texts.append(text)
+    return list(dict.fromkeys(texts))
+
+
+@dataclass(frozen=True)
+class PayloadPlan:
+    """Caminhos JSON de status, plano e mensagem num payload de resposta."""
+
+    status_path: Optional[JsonPath]
+    plan_path: Optional[JsonPath]
+    message_path: Optional[JsonPath]
+    empty_status: str
+
+    def _texts(self, payload: Any, path: Optional[JsonPath]) -> List[str]:
+        return _payload_texts(extract_json(payload, path)) if path is not None else []
+
+    def decide(
+        self, payload: Any, parsing: ResultPlan
+    ) -> Tuple[str, str, str, Dict[str, Any]]:
+        """
+        Status pelos valores em `status`: booleanos valem ativo/inativo, textos passam pelas
+        palavras-chave do result_parsing. Sem valor de status, um plano encontrado indica
+        ativo; sem nada, vale `empty`.
+        """
+        status_values = (
+            extract_json(payload, self.status_path) if self.status_path is not None else []
+        )
+        flags = [value for value in status_values if isinstance(value, bool)]
+        status_texts = _payload_texts(
+            [value for value in status_values if not isinstance(value, bool)]
+        )
+        plan_texts = self._texts(payload, self.plan_path)
+        message_texts = self._texts(payload, self.message_path)
+
+        status_text = " | ".join(status_texts)
+        if status_texts:
+            status = parsing.classify(normalize_text(status_text))
+        elif flags:
+            status = "ativo" if any(flags) else "inativo"
+        elif plan_texts:
+            status = "ativo"
+        else:
+            status = self.empty_status
+
+        plan = " | ".join(plan_texts)[:300]
+        message = (" | ".join(message_texts) or status_text)[:300]
+        debug = {
+            "status_values": status_texts or flags,
+            "plan_values": plan_texts,
+        }
+        return status, plan, message, debug
+
+
+@dataclass(frozen=True)
+class ApiPlan:
+    """
+    Requisicao direta ao endpoint do portal. `{identifier}`/`{id_type}` sao substituidos em
+    url, params, headers e corpo; `result` aponta status, plano e mensagem no JSON.
+    """
+
+    method: str
+    url: str
+    headers: Mapping[str, str]
+    params: Mapping[str, Any]
+    json_body: Any
+    form: Optional[Mapping[str, Any]]
+    timeout_ms: int
+    storage_state: bool
+    result: PayloadPlan
+
+
+@dataclass(frozen=True)
+class ResponsePlan:
+    """
+    Resposta XHR/fetch capturada no navegador de onde sai o resultado, no lugar do texto
+    renderizado. Com `match_identifier`, a URL ou o corpo da requisicao precisa conter o
+    identificador (descarta respostas atrasadas da consulta anterior).
+    """
+
+    pattern: Pattern[str]
+    method: Optional[str]
+    match_identifier: bool
+    timeout_ms: int
+    payload: PayloadPlan
+
+    def matches(self, url: str, method: str) -> bool:
+        if self.method is not None and method.upper() != self.method:
+            return False
+        return self.pattern.match(url) is not None
+
+
+@dataclass(frozen=True)
+class MappingPlan:
+    """
+    `setup` roda uma vez por pagina quando `reuse_page` esta ligado (senao a cada consulta);
+    `steps` sao os passos por identificador.
+    """
+
+    url: Optional[str]
+    setup: Tuple[StepPlan, ...]
+    steps: Tuple[StepPlan, ...]
+    reuse_page: bool
+    result: ResultPlan
+    block: BlockPlan
+    resources: ResourcePolicy
+    mode: str = "browser"
+    api: Optional[ApiPlan] = None
+    response: Optional[ResponsePlan] = None
+
+
+def _selector_list(value: Any, field: str) -> Tuple[str, ...]:
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise MappingError(f"{field} deve ser string ou lista de strings")
+    return tuple(item for item in value if item.strip())
+
+
+def _keyword_list(parsing: Mapping[str, Any], field: str) -> KeywordMatcher:
+    value = parsing.get(field) or []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        raise MappingError(f"result_parsing.{field} deve ser uma lista")
+    return KeywordMatcher.build(value)
+
+
+def _number(value: Any, field: str, cast: Callable[[Any], Any]) -> Any:
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise MappingError(f"{field} invalido: {value!r}")
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def compile_step(
+    index: int,
+    step: Any,
+    handlers: Mapping[str, Callable[..., Any]],
+    default_timeout_ms: int,
+    phase: str = "per_identifier",
+) -> StepPlan:
+    if not isinstance(step, dict):
+        raise MappingError(f"passo {index}: esperado objeto, recebido {type(step).__name__}")
+    action = step.get("action")
+    handler = handlers.get(action) if isinstance(action, str) else None
+    if handler is None:
+        raise MappingError(f"passo {index}: acao desconhecida: {action}")
+    if action in SELECTOR_ACTIONS and not step.get("selector"):
+        raise MappingError(f"passo {index}: {action} action requer 'selector'")
+    if action == "reset":
+        if not any(step.get(op) for op in RESET_OPERATIONS):
+            raise MappingError(
+                f"passo {index}: reset requer ao menos um de {', '.join(RESET_OPERATIONS)}"
+            )
+        for op in ("close", "clear", "wait_hidden"):
+            _selector_list(step.get(op), f"passo {index}: reset.{op}")
+    wait_selector = step.get("wait_selector")
+    if isinstance(wait_selector, list):
+        wait_selector = _selector_list(wait_selector, f"passo {index}: wait_selector")
+    return StepPlan(
+        index=index,
+        action=action,
+        handler=handler,
+        options=_freeze(step),
+        optional=bool(step.get("optional", False)),
+        timeout_ms=_number(
+            step.get("timeout_ms", default_timeout_ms), f"passo {index}: timeout_ms", int
+        ),
+        delay=_number(step.get("delay") or 0.0, f"passo {index}: delay", float),
+        wait_selector=wait_selector or None,
+        phase=phase,
+    )
+
+
+def compile_result(parsing: Any, default_timeout_ms: int) -> ResultPlan:
+    if not isinstance(parsing, dict):
+        raise MappingError("result_parsing deve ser um objeto")
+    status_selectors = _selector_list(
+        parsing.get("status_selectors")
+        or parsing.get("status_selector_any")
+        or parsing.get("status_selector"),
+        "result_parsing.status_selectors",
+    )
+    plan_selectors = _selector_list(
+        parsing.get("plan_selectors") or parsing.get("plan_selector"),
+        "result_parsing.plan_selectors",
+    )
+    poll_ms = _number(
+        parsing.get("status_poll_interval_ms", STATUS_POLL_INTERVAL_DEFAULT_MS),
+        "result_parsing.status_poll_interval_ms",
+        float,
+    )
+    return ResultPlan(
+        status_selectors=status_selectors,
+        plan_selectors=plan_selectors,
+        status_timeout_ms=_number(
+            parsing.get("status_timeout_ms", default_timeout_ms),
+            "result_parsing.status_timeout_ms",
+            int,
+        ),
+        poll_interval=max(0.1, poll_ms / 1000.0),
+        plan_optional=bool(parsing.get("plan_optional", False)),
+        dom_watcher=bool(parsing.get("dom_watcher", True)),
+        positive=_keyword_list(parsing, "positive_keywords"),
+        negative=_keyword_list(parsing, "negative_keywords"),
+        errors=_keyword_list(parsing, "error_keywords"),
+    )
+
+
+def compile_block(
+    mapping: Mapping[str, Any],
+    default_indicators: Iterable[str],
+    default_captcha_selectors: Iterable[str],
+    default_statuses: Iterable[int],
+) -> BlockPlan:
+    indicators = tuple(
+        str(item).lower() for item in mapping.get("block_indicators", []) if str(item).strip()
+    )
+    guard = (mapping.get("guards") or {}).get("captcha") or {}
+    captcha_selectors = _selector_list(guard.get("selectors"), "guards.captcha.selectors")
+    raw_statuses = mapping.get("block_statuses")
+    if raw_statuses is None:
+        raw_statuses = list(default_statuses)
+    if not isinstance(raw_statuses, list):
+        raise MappingError("block_statuses deve ser uma lista de status HTTP")
+    return BlockPlan(
+        indicators=indicators or tuple(default_indicators),
+        captcha_selectors=tuple(
+            dict.fromkeys(captcha_selectors + tuple(default_captcha_selectors))
+        ),
+        statuses=frozenset(_number(code, "block_statuses", int) for code in raw_statuses),
+    )
+
+
+def _url_matcher(patterns: Any, field: str) -> Optional[Pattern[str]]:
+    """Globs (`*` casa qualquer coisa) ou regex com prefixo `re:`, numa unica regex."""
+    parts = []
+    for pattern in _selector_list(patterns, field):
+        if pattern.startswith("re:"):
+            parts.append(f".*?(?:{pattern[3:]})")
+        else:
+            parts.append(fnmatch.translate(pattern))
+    if not parts:
+        return None
+    try:
+        return re.compile("|".join(f"(?:{part})" for part in parts), re.IGNORECASE)
+    except re.error as exc:
+        raise MappingError(f"{field}: regex invalida: {exc}")
+
+
+def compile_resources(mapping: Mapping[str, Any]) -> ResourcePolicy:
+    raw = mapping.get("block_resources") or {}
+    if not isinstance(raw, dict):
+        raise MappingError("block_resources deve ser um objeto")
+    types = frozenset(_selector_list(raw.get("types"), "block_resources.types"))
+    unknown = sorted(types - BLOCKABLE_RESOURCE_TYPES)
+    if unknown:
+        raise MappingError(f"block_resources.types invalidos: {', '.join(unknown)}")
+    return ResourcePolicy(
+        types=types,
+        pattern=_url_matcher(raw.get("url_patterns"), "block_resources.url_patterns"),
+        allow=_url_matcher(raw.get("allow_patterns"), "block_resources.allow_patterns"),
+    )
+
+
+def compile_payload(raw: Any, field: str) -> PayloadPlan:
+    raw = raw or {}
+    if not isinstance(raw, dict):
+        raise MappingError(f"{field} deve ser um objeto")
+    status_path = compile_json_path(raw.get("status"), f"{field}.status")
+    plan_path = compile_json_path(raw.get("plan"), f"{field}.plan")
+    if status_path is None and plan_path is None:
+        raise MappingError(f"{field} requer ao menos 'status' ou 'plan'")
+    empty_status = str(raw.get("empty", "indefinido")).lower()
+    if empty_status not in RESULT_STATUSES:
+        raise MappingError(f"{field}.empty invalido: {empty_status}")
+    return PayloadPlan(
+        status_path=status_path,
+        plan_path=plan_path,
+        message_path=compile_json_path(raw.get("message"), f"{field}.message"),
+        empty_status=empty_status,
+    )
+
+
+def compile_api(raw: Any, default_timeout_ms: int) -> ApiPlan:
+    if not isinstance(raw, dict):
+        raise MappingError("api deve ser um objeto")
+    url = raw.get("url")
+    if not isinstance(url, str) or not url.strip():
+        raise MappingError("api.url e obrigatorio")
+    method = str(raw.get("method", "GET")).upper()
+    if method not in HTTP_METHODS:
+        raise MappingError(f"api.method invalido: {method}")
+    for field in ("headers", "params", "form"):
+        if raw.get(field) is not None and not isinstance(raw.get(field), dict):
+            raise MappingError(f"api.{field} deve ser um objeto")
+    if raw.get("json") is not None and raw.get("form") is not None:
+        raise MappingError("use 'api.json' ou 'api.form', nao ambos")
+    result = compile_payload(raw.get("result"), "api.result")
+    return ApiPlan(
+        method=method,
+        url=url.strip(),
+        headers=_freeze({str(k): str(v) for k, v in (raw.get("headers") or {}).items()}),
+        params=_freeze(raw.get("params") or {}),
+        json_body=_freeze(raw.get("json")),
+        form=_freeze(raw["form"]) if raw.get("form") is not None else None,
+        timeout_ms=_number(raw.get("timeout_ms", default_timeout_ms), "api.timeout_ms", int),
+        storage_state=bool(raw.get("storage_state", False)),
+        result=result,
+    )
+
+
+def compile_response(raw: Any, default_timeout_ms: int) -> ResponsePlan:
+    if not isinstance(raw, dict):
+        raise MappingError("response_parsing deve ser um objeto")
+    pattern = _url_matcher(raw.get("url_pattern"), "response_parsing.url_pattern")
+    if pattern is None:
+        raise MappingError("response_parsing.url_pattern e obrigatorio")
+    method = raw.get("method")
+    if method is not None and str(method).upper() not in HTTP_METHODS:
+        raise MappingError(f"response_parsing.method invalido: {method}")
+    return ResponsePlan(
+        pattern=pattern,
+        method=str(method).upper() if method is not None else None,
+        match_identifier=bool(raw.get("match_identifier", False)),
+        timeout_ms=_number(
+            raw.get("timeout_ms", default_timeout_ms), "response_parsing.timeout_ms", int
+        ),
+        payload=compile_payload(raw, "response_parsing"),
+    )
+
+
+def compile_mapping(
+    mapping: Any,
+    *,
+    handlers: Mapping[str, Callable[..., Any]],
+    default_timeout_ms: int,
+    default_block_indicators: Iterable[str],
+    default_captcha_selectors: Iterable[str] = (),
+    default_block_statuses: Iterable[int] = (),
+    compile_steps: bool = True,
+) -> MappingPlan:
+    """
+    Valida e congela o mapping. `handlers` resolve cada `action` para o metodo do driver;
+    drivers com fluxo proprio passam `compile_steps=False` e so usam result_parsing.
+    Passos: `setup` + `per_identifier` (ou a lista legada `steps`, toda por identificador).
+    Com `"mode": "api"` a consulta vai direto ao endpoint descrito em `api`, sem navegador;
+    `response_parsing` decide o resultado pela resposta XHR capturada no navegador.
+    """
+    if not isinstance(mapping, dict):
+        raise MappingError("mapping deve ser um objeto JSON")
+    mode = str(mapping.get("mode", "browser")).lower()
+    if mode not in LOOKUP_MODES:
+        raise MappingError(f"mode invalido: {mode}")
+    if mode == "api" and "api" not in mapping:
+        raise MappingError("mode 'api' requer o objeto 'api'")
+    if "steps" in mapping and "per_identifier" in mapping:
+        raise MappingError("use 'steps' ou 'per_identifier', nao ambos")
+    phases = {}
+    for phase in ("setup", "per_identifier"):
+        raw_steps = mapping.get(phase)
+        if raw_steps is None and phase == "per_identifier":
+            raw_steps = mapping.get("steps")
+        raw_steps = (raw_steps or []) if compile_steps else []
+        if not isinstance(raw_steps, list):
+            raise MappingError(f"{phase} deve ser uma lista")
+        phases[phase] = tuple(
+            compile_step(index, step, handlers, default_timeout_ms, phase)
+            for index, step in enumerate(raw_steps)
+        )
+    response = (
+        compile_response(mapping["response_parsing"], default_timeout_ms)
+        if mapping.get("response_parsing") is not None
+        else None
+    )
+    if response is None:
+        for step in phases["setup"] + phases["per_identifier"]:
+            if step.action in RESPONSE_ACTIONS:
+                raise MappingError(f"passo {step.index}: {step.action} requer response_parsing")
+    navigate = mapping.get("navigate") or {}
+    return MappingPlan(
+        url=mapping.get("url"),
+        setup=phases["setup"],
+        steps=phases["per_identifier"],
+        reuse_page=bool(navigate.get("reuse_page", False)),
+        result=compile_result(mapping.get("result_parsing", {}), default_timeout_ms),
+        block=compile_block(
+            mapping,
+            default_block_indicators,
+            default_captcha_selectors,
+            default_block_statuses,
+        ),
+        resources=compile_resources(mapping),
+        mode=mode,
+        api=compile_api(mapping["api"], default_timeout_ms) if "api" in mapping else None,
+        response=response,
+    )
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Politica de retentativa por classe de erro (blocked, timeout, navigation, crash, mapping,
+other): numero de tentativas e backoff exponencial com jitter. O DriverManager usa a mesma
+politica para adiar o identificador para o fim da fila do operador em vez de segurar a pagina.
+"""
+import json
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional
+
+ERROR_CLASSES = ("blocked", "timeout", "navigation", "crash", "mapping", "other")
+
+
+@dataclass(frozen=True)
+class RetryRule:
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    rules: Mapping[str, RetryRule]
+    jitter: float = 0.25
+
+    def rule(self, error_class: str) -> RetryRule:
+        return self.rules.get(error_class) or self.rules["other"]
+
+    def should_retry(self, error_class: str, attempt: int) -> bool:
+        """`attempt` e a tentativa que acabou de falhar (1 = primeira)."""
+        return attempt < self.rule(error_class).max_attempts
+
+    def delay(self, error_class: str, attempt: int) -> float:
+        """base * 2^(attempt-1), limitado a max_delay, com jitter de +-`jitter`."""
+        rule = self.rule(error_class)
+        delay = min(rule.max_delay, rule.base_delay * (2 ** max(0, attempt - 1)))
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0.0, delay)
+
+    @classmethod
+    def build(
+        cls,
+        defaults: Mapping[str, RetryRule],
+        overrides: Optional[str] = None,
+        jitter: float = 0.25,
+    ) -> "RetryPolicy":
+        """
+        `overrides` e JSON por classe, ex.: {"timeout": {"max_attempts": 4, "base_delay": 1}};
+        campos ausentes mantem o padrao.
+        """
+        rules: Dict[str, RetryRule] = dict(defaults)
+        raw: Any = json.loads(overrides) if overrides and overrides.strip() else {}
+        if not isinstance(raw, dict):
+            raise ValueError("RETRY_POLICY deve ser um objeto JSON")
+        for error_class, values in raw.items():
+            if error_class not in ERROR_CLASSES or not isinstance(values, dict):
+                raise ValueError(f"RETRY_POLICY invalido para {error_class!r}")
+            current = rules.get(error_class) or rules["other"]
+            rules[error_class] = RetryRule(
+                max_attempts=max(1, int(values.get("max_attempts", current.max_attempts))),
+                base_delay=float(values.get("base_delay", current.base_delay)),
+                max_delay=float(values.get("max_delay", current.max_delay)),
+            )
+        return cls(rules=rules, jitter=max(0.0, min(1.0, jitter)))
@@ -1,6 +1,16 @@
 from typing import Any, Dict, Tuple
 
-from .base import BaseDriver, normalize_text
+from .base import BaseDriver, BlockedRequestError, normalize_text
+from .page_watch import watch_result
+from .plan import ResultPlan
+
+_HAS_UNIMED = "contains(translate(normalize-space(string(.)), 'unimed', 'UNIMED'), 'UNIMED')"
+_NOT_CODE = "not(self::script or self::style or self::noscript)"
+# Elemento com o texto sem filho que tambem o contenha (o mais interno; scripts nao contam).
+UNIMED_TEXT_XPATH = (
+    f"xpath=//body//*[{_NOT_CODE} and {_HAS_UNIMED}"
+    f" and not(*[{_NOT_CODE} and {_HAS_UNIMED}])]"
+)
 
 
 class UnimedDriver(BaseDriver):
@@ -9,7 +19,7 @@ class UnimedDriver(BaseDriver):
         super().__init__("unimed", supported_id_types=("cpf",))
 
     async def _parse_result(
-        self, page: Any, parsing: Dict[str, Any]
+        self, page: Any, parsing: ResultPlan
     ) -> Tuple[str, str, str, Dict[str, Any]]:
         status, plan, message, debug = await super()._parse_result(page, parsing)
 
@@ -17,7 +27,7 @@ class UnimedDriver(BaseDriver):
         if not needs_probe:
             return status, plan, message, debug
 
-        probe_timeout = parsing.get("status_timeout_ms") or 0
+        probe_timeout = parsing.status_timeout_ms or 0
         fallback_text = await self._scan_for_unimed(page, probe_timeout)
         if fallback_text:
             normalized = normalize_text(fallback_text)
@@ -29,31 +39,37 @@ class UnimedDriver(BaseDriver):
         return status, plan, message, debug
 
     async def _scan_for_unimed(self, page: Any, timeout_ms: int) -> str:
+        """
+        Primeiro elemento visivel mais interno cujo texto contem UNIMED, numa unica chamada ao
+        observador injetado (MutationObserver), em vez de sondar elemento a elemento.
+        """
         if timeout_ms <= 0:
             timeout_ms = 20000
-        poll_interval = 0.2
-        attempts = max(1, int((timeout_ms / 1000) / poll_interval))
-        locator_str = (
-            "xpath=//*[contains(translate(normalize-space(string(.)), 'unimed', 'UNIMED'),'UNIMED')]"
-        )
-        locator = page.locator(locator_str)
-        for _ in range(attempts):
-            try:
-                count = await locator.count()
-            except Exception:
-                count = 0
-            for idx in range(count):
-                element = locator.nth(idx)
-                try:
-                    if await element.is_visible():
-                        box = await element.bounding_box()
-                        if not box:
-                            continue
-                        text = (await element.inner_text()).strip()
-                        if text:
-                            print(f"[unimed] elemento encontrado: {text[:200]}")
-                            return text
-                except Exception:
-                    continue
-            await page.wait_for_timeout(int(poll_interval * 1000))
-        return ""
+        block = self._block_plan()
+        try:
+            watched = await self._until_blocked(
+                self._response_monitor(page),
+                watch_result(
+                    page,
+                    status_selectors=[UNIMED_TEXT_XPATH],
+                    plan_selectors=[],
+                    block_indicators=block.indicators,
+                    captcha_selectors=block.captcha_selectors,
+                    timeout_ms=timeout_ms,
+                ),
+            )
+        except BlockedRequestError:
+            raise
+        except Exception as exc:
+            self.step(f"Varredura por UNIMED indisponivel: {exc}")
+            return ""
+        if not watched:
+            return ""
+        if watched.get("blocked"):
+            raise BlockedRequestError(
+                f"indicativo de bloqueio detectado na pagina: {watched['blocked']}"
+            )
+        text = (watched.get("text") or "").strip()
+        if text:
+            print(f"[unimed] elemento encontrado: {text[:200]}")
+        return text
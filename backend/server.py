@@ -1,26 +1,27 @@
+import asyncio
 import json
 import os
+import time
 import uuid
 import logging
-import io
 import sys
 from collections import defaultdict
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+import numpy as np
 import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment
 
 if sys.platform == "win32":
-    import asyncio
-
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 LIVE_DEBUG_ENABLED = os.getenv("LIVE_DEBUG", "false").lower() == "true"
@@ -35,9 +36,40 @@ if LIVE_DEBUG_ENABLED:
 
 from drivers.driver_manager import manager as driver_manager
 from drivers.base import BaseDriver, DriverResult, launch_chrome_real
+from drivers.artifacts import artifact_service
+from drivers.debug_capture import parse_level as parse_debug_level
+from drivers.http_api import close_shared_client
 from utils.logger import JobLogger
 from utils.auth import create_access_token, verify_token, check_credentials, AuthError
-from utils.validators import validate_cpf_cnpj
+from utils.ingestion import (
+    aiter_identifier_chunks,
+    aiter_value_chunks,
+    read_identifier_values,
+)
+from utils.uploads import (
+    UploadTooLargeError,
+    read_json_identifiers,
+    read_ndjson_identifiers,
+    save_upload,
+)
+from utils.validators import (
+    classify_identifiers,
+    non_blank_mask,
+    normalize_identifiers,
+    recover_leading_zeros,
+    validate_cpf_cnpj_array,
+)
+from utils.exports import (
+    PARQUET_AVAILABLE,
+    PartialExporter,
+    iter_csv,
+    iter_json,
+    iter_ndjson,
+    iter_parquet,
+    mongo_projection,
+    parse_fields,
+    partial_export_paths,
+)
 from db.cache import Cache
 from bson import ObjectId
 
@@ -76,6 +108,11 @@ EXPORT_DIR = os.path.join(BASE_DIR, "data", "exports")
 LOGS_DIR = os.path.join(BASE_DIR, "data", "logs")
 ERRORS_DIR = os.path.join(BASE_DIR, "data", "errors")
 LAST_RUN_LOG = os.path.join(LOGS_DIR, "last_run.log")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "512")) * 1024 * 1024
+LAST_RUN_LOG_SUMMARY_ONLY = os.getenv("LAST_RUN_LOG_SUMMARY_ONLY", "false").lower() == "true"
+# 0 = sem limite de entradas detalhadas.
+LAST_RUN_LOG_MAX_DETAILS = int(os.getenv("LAST_RUN_LOG_MAX_DETAILS", "2000"))
 
 if CNPJ_PIPELINE_ENABLED:
     CNPJ_EXPORT_PATH: Optional[str] = os.path.join(EXPORT_DIR, "sulamerica_cnpj.xlsx")
@@ -99,6 +136,18 @@ mongo_db: Optional[AsyncIOMotorDatabase] = None
 MONGO_URL = os.environ.get("MONGO_URL")
 MONGO_DB_NAME = os.environ.get("MONGO_DB_NAME", "saude_fetch")
 
+# Colunas do XLSX consolidado (na ordem do cabecalho) e campos que ele le de cada resultado.
+XLSX_OPERATOR_COLUMNS = ("amil", "bradesco", "unimed", "seguros_unimed")
+XLSX_SOURCE_COLUMNS = ["input", "type", "operator", "status", "plan"]
+
+RESULT_STREAM_FORMATS = ("json", "ndjson", "csv", "parquet")
+RESULTS_BATCH_SIZE = int(os.getenv("RESULTS_BATCH_SIZE", "500"))
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", "10000"))
+PARTIAL_XLSX_INTERVAL_SECONDS = float(os.getenv("PARTIAL_XLSX_INTERVAL_SECONDS", "30"))
+# Resultados gravados em job_results durante o job: lote de ate RESULTS_BATCH_SIZE documentos
+# ou a cada RESULTS_FLUSH_SECONDS, o que vier antes.
+RESULTS_FLUSH_SECONDS = float(os.getenv("RESULTS_FLUSH_SECONDS", "5"))
+
 
 # --- MODELOS ---
 class JobOut(BaseModel):
@@ -136,6 +185,8 @@ async def get_db():
         await client.admin.command("ping")
         mongo_client = client
         mongo_db = client[MONGO_DB_NAME]
+        # Paginacao de /results percorre (job_id, _id) em ordem.
+        await mongo_db.job_results.create_index([("job_id", 1), ("_id", 1)])
     return mongo_db
 
 
@@ -150,22 +201,13 @@ async def _find_job_doc(db: AsyncIOMotorDatabase, job_id: str) -> Optional[Dict[
     return await db.jobs.find_one({"_id": oid})
 
 
-async def _find_job_doc(db: AsyncIOMotorDatabase, job_id: str) -> Optional[Dict[str, Any]]:
-    doc = await db.jobs.find_one({"_id": job_id})
-    if doc:
-        return doc
-    try:
-        oid = ObjectId(job_id)
-    except Exception:
-        return None
-    return await db.jobs.find_one({"_id": oid})
-
-
 @app.on_event("shutdown")
 async def shutdown_event():
     global mongo_client
     if mongo_client:
         mongo_client.close()
+    await close_shared_client()
+    await artifact_service.drain()
 
 
 # --- AUTH ---
@@ -267,13 +309,49 @@ async def download_job_log(job_id: str, user: str = Depends(require_auth)):
 
 
 @app.get("/api/jobs/{job_id}/results")
-async def download_job_results(job_id: str, format: str = "json", user: str = Depends(require_auth)):
+async def download_job_results(
+    job_id: str,
+    format: str = "json",
+    fields: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    partial: bool = False,
+    user: str = Depends(require_auth),
+):
+    """
+    Resultados do job em json, ndjson, csv, parquet ou xlsx.
+    - json devolve `{"items": [...], "next_after": <id ou null>}` (antes era uma lista simples);
+      `next_after` vem preenchido quando `limit` encheu a pagina e vai em `after` na proxima;
+    - cada linha traz `id` (cursor) e as colunas de `fields` (padrao: todas menos debug),
+      sem `job_id`;
+    - `partial=true` serve o CSV/XLSX parcial de um job ainda em andamento.
+    """
     db = await get_db()
     doc = await _find_job_doc(db, job_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    if format.lower() == "xlsx":
+    fmt = format.lower()
+    if partial:
+        # Parciais so existem durante o job (ou apos falha); senao cai no export final.
+        partial_csv, partial_xlsx = partial_export_paths(EXPORT_DIR, job_id)
+        if fmt == "xlsx" and os.path.exists(partial_xlsx):
+            return FileResponse(
+                partial_xlsx,
+                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                filename=f"{job_id}.partial.xlsx",
+            )
+        if fmt == "csv" and os.path.exists(partial_csv):
+            return FileResponse(
+                partial_csv, media_type="text/csv", filename=f"{job_id}.partial.csv"
+            )
+        if fmt in ("csv", "xlsx") and doc.get("status") != "completed":
+            raise HTTPException(
+                status_code=404,
+                detail=f"Partial {fmt.upper()} not available yet: no identifier finished so far",
+            )
+
+    if fmt == "xlsx":
         xlsx_path = doc.get("xlsx_path") or os.path.join(EXPORT_DIR, f"{job_id}.xlsx")
         if not os.path.exists(xlsx_path):
             raise HTTPException(status_code=404, detail="XLSX not found")
@@ -283,63 +361,78 @@ async def download_job_results(job_id: str, format: str = "json", user: str = De
             filename=f"{job_id}.xlsx",
         )
 
-    cursor = db.job_results.find({"job_id": job_id})
-    items = []
-    async for row in cursor:
-        row.pop("_id", None)
-        items.append(row)
+    if fmt not in RESULT_STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    if fmt == "parquet" and not PARQUET_AVAILABLE:
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    try:
+        selected_fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit is not None and limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+
+    query: Dict[str, Any] = {"job_id": job_id}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except Exception:
+            raise HTTPException(status_code=400, detail="invalid cursor")
 
-    if not items:
+    if await db.job_results.find_one({"job_id": job_id}, projection={"_id": 1}) is None:
         raise HTTPException(status_code=404, detail="Results not found")
 
-    return {"items": items}
-
-
-@app.get("/api/jobs/{job_id}/log")
-async def download_job_log(job_id: str, user: str = Depends(require_auth)):
-    db = await get_db()
-    doc = await _find_job_doc(db, job_id)
-    path = None
-    if doc:
-        path = doc.get("job_log_path")
-    if not path:
-        path = os.path.join(LOGS_DIR, f"{job_id}.log")
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail="Log not found")
-    return FileResponse(path, media_type="text/plain", filename=f"{job_id}.log")
-
-
-@app.get("/api/jobs/{job_id}/results")
-async def download_job_results(job_id: str, format: str = "json", user: str = Depends(require_auth)):
-    db = await get_db()
-    doc = await _find_job_doc(db, job_id)
-    if not doc:
-        raise HTTPException(status_code=404, detail="Job not found")
+    cursor = db.job_results.find(
+        query,
+        projection=mongo_projection(selected_fields),
+        sort=[("_id", 1)],
+        limit=limit or 0,
+        batch_size=RESULTS_BATCH_SIZE,
+    )
 
-    if format.lower() == "xlsx":
-        xlsx_path = doc.get("xlsx_path") or os.path.join(EXPORT_DIR, f"{job_id}.xlsx")
-        if not os.path.exists(xlsx_path):
-            raise HTTPException(status_code=404, detail="XLSX not found")
-        return FileResponse(
-            xlsx_path,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=f"{job_id}.xlsx",
+    if fmt == "ndjson":
+        return StreamingResponse(
+            iter_ndjson(cursor, selected_fields),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{job_id}.ndjson"'},
         )
+    if fmt == "csv":
+        return StreamingResponse(
+            iter_csv(cursor, selected_fields),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{job_id}.csv"'},
+        )
+    if fmt == "parquet":
+        return StreamingResponse(
+            iter_parquet(cursor, selected_fields, PARQUET_ROW_GROUP_SIZE),
+            media_type="application/vnd.apache.parquet",
+            headers={"Content-Disposition": f'attachment; filename="{job_id}.parquet"'},
+        )
+    return StreamingResponse(
+        iter_json(cursor, selected_fields, limit),
+        media_type="application/json",
+    )
 
-    cursor = db.job_results.find({"job_id": job_id})
-    items = []
-    async for row in cursor:
-        row.pop("_id", None)
-        items.append(row)
-
-    if not items:
-        raise HTTPException(status_code=404, detail="Results not found")
 
-    return {"items": items}
+async def _store_upload(file: UploadFile, stored_path: str):
+    try:
+        return await save_upload(file, stored_path, max_bytes=MAX_UPLOAD_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
 
 @app.post("/api/jobs", response_model=JobOut)
-async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(...), user: str = Depends(require_auth)):
+async def create_job(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    debug_capture: Optional[str] = None,
+    user: str = Depends(require_auth),
+):
+    """`debug_capture` (off, on-error, sampled, full) sobrescreve DEBUG_CAPTURE neste job."""
+    try:
+        debug_level = parse_debug_level(debug_capture)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
         filename = file.filename or "upload"
         ext = os.path.splitext(filename)[1].lower()
@@ -350,11 +443,15 @@ async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(
         job_id = str(uuid.uuid4())
         created_at = datetime.utcnow().isoformat()
 
+        stored_name = f"{job_id}{ext}"
+        stored_path = os.path.join(UPLOAD_DIR, stored_name)
+        file_size, file_sha256 = await _store_upload(file, stored_path)
+
         doc = {
             "_id": job_id,
             "filename": filename,
             "type": "cpf",
-            "status": "pending",
+            "status": "processing",
             "total": 0,
             "success": 0,
             "error": 0,
@@ -363,20 +460,17 @@ async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(
             "completed_at": None,
             "export_path": None,
             "xlsx_path": None,
-            "file_path": None,
+            "file_path": stored_path,
+            "file_size": file_size,
+            "file_sha256": file_sha256,
+            "debug_capture": debug_level,
             "error_message": None,
         }
         await db.jobs.insert_one(doc)
 
-        stored_name = f"{job_id}{ext}"
-        stored_path = os.path.join(UPLOAD_DIR, stored_name)
-        with open(stored_path, "wb") as out:
-            chunk = await file.read()
-            out.write(chunk)
-
-        await db.jobs.update_one({"_id": job_id}, {"$set": {"status": "processing", "file_path": stored_path}})
-
-        background_tasks.add_task(process_job, job_id, stored_path, "cpf")
+        background_tasks.add_task(
+            process_job, job_id, stored_path, "cpf", debug_capture=debug_level
+        )
 
         return JobOut(
             id=job_id,
@@ -391,12 +485,91 @@ async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(
             processed=0,
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
 
+@app.post("/api/jobs/batch", response_model=JobOut)
+async def create_batch_job(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    type: str = "cpf",
+    debug_capture: Optional[str] = None,
+    user: str = Depends(require_auth),
+):
+    """
+    Cria um job a partir de identificadores enviados no corpo, sem arquivo:
+    array JSON (application/json) ou um identificador por linha (application/x-ndjson).
+    """
+    forced_type = type.lower()
+    if forced_type not in ("cpf", "cnpj", "auto"):
+        raise HTTPException(status_code=400, detail="type must be cpf, cnpj or auto")
+    try:
+        debug_level = parse_debug_level(debug_capture)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    reader = read_ndjson_identifiers if content_type in NDJSON_CONTENT_TYPES else read_json_identifiers
+    try:
+        identifiers = await reader(request.stream(), max_bytes=MAX_UPLOAD_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not identifiers:
+        raise HTTPException(status_code=400, detail="Nenhum identificador informado.")
+
+    db = await get_db()
+    job_id = str(uuid.uuid4())
+    created_at = datetime.utcnow().isoformat()
+    filename = "api_batch.ndjson" if content_type in NDJSON_CONTENT_TYPES else "api_batch.json"
+    doc = {
+        "_id": job_id,
+        "filename": filename,
+        "type": forced_type,
+        "status": "processing",
+        "total": len(identifiers),
+        "success": 0,
+        "error": 0,
+        "processed": 0,
+        "created_at": created_at,
+        "completed_at": None,
+        "export_path": None,
+        "xlsx_path": None,
+        "file_path": None,
+        "debug_capture": debug_level,
+        "error_message": None,
+    }
+    await db.jobs.insert_one(doc)
+
+    background_tasks.add_task(
+        process_job,
+        job_id,
+        None,
+        forced_type,
+        identifiers=identifiers,
+        debug_capture=debug_level,
+    )
+
+    return JobOut(
+        id=job_id,
+        filename=filename,
+        type=forced_type,
+        status="processing",
+        total=len(identifiers),
+        success=0,
+        error=0,
+        created_at=created_at,
+        completed_at=None,
+        processed=0,
+    )
+
+
 @app.post("/api/manual/amil/start")
 async def start_amil_manual(user: str = Depends(require_auth)):
     """
@@ -471,29 +644,21 @@ async def manual_amil_upload(
                 detail="Unsupported file type. Upload CSV or Excel.",
             )
 
-        content = await file.read()
-        if not content:
-            raise HTTPException(status_code=400, detail="Arquivo vazio.")
-
-        import pandas as pd
-
-        if ext == ".csv":
-            df = pd.read_csv(io.BytesIO(content), dtype=str)
-        else:
-            df = pd.read_excel(io.BytesIO(content), dtype=str)
-
-        raw_identifiers = to_rows(df, forced_type="cpf")
-        cleaned = [
-            clean_identifier(x) for x in raw_identifiers if str(x).strip()
-        ]
-
-        valid: List[str] = []
-        invalid: List[str] = []
-        for ident in cleaned:
-            if validate_cpf_cnpj(ident) and len(ident) == 11:
-                valid.append(ident)
-            else:
-                invalid.append(ident)
+        stored_path = os.path.join(UPLOAD_DIR, f"manual_{uuid.uuid4()}{ext}")
+        try:
+            file_size, _ = await _store_upload(file, stored_path)
+            if not file_size:
+                raise HTTPException(status_code=400, detail="Arquivo vazio.")
+            values = await asyncio.to_thread(read_identifier_values, stored_path)
+        finally:
+            if os.path.exists(stored_path):
+                os.remove(stored_path)
+
+        raw = np.asarray(values, dtype=str)
+        cleaned = recover_leading_zeros(normalize_identifiers(raw[non_blank_mask(raw)]))
+        is_cpf = validate_cpf_cnpj_array(cleaned) & (classify_identifiers(cleaned) == "cpf")
+        valid: List[str] = cleaned[is_cpf].tolist()
+        invalid: List[str] = cleaned[~is_cpf].tolist()
 
         return {"total": len(cleaned), "valid": valid, "invalid": invalid}
     except HTTPException:
@@ -616,10 +781,12 @@ def clean_identifier(s: str) -> str:
     return "".join(ch for ch in str(s) if ch.isdigit())
 
 
-def format_cpf(cpf_digits: str) -> str:
-    if len(cpf_digits) != 11:
-        return cpf_digits
-    return f"{cpf_digits[0:3]}.{cpf_digits[3:6]}.{cpf_digits[6:9]}-{cpf_digits[9:11]}"
+def format_cpf_series(cpf_digits: pd.Series) -> pd.Series:
+    formatted = (
+        cpf_digits.str[0:3] + "." + cpf_digits.str[3:6] + "."
+        + cpf_digits.str[6:9] + "-" + cpf_digits.str[9:11]
+    )
+    return formatted.where(cpf_digits.str.len() == 11, cpf_digits)
 
 
 def format_cnpj(cnpj_digits: str) -> str:
@@ -631,24 +798,6 @@ def format_cnpj(cnpj_digits: str) -> str:
     )
 
 
-def detect_type(identifier: str) -> str:
-    if len(identifier) == 11:
-        return "cpf"
-    if len(identifier) == 14:
-        return "cnpj"
-    return "unknown"
-
-
-def to_rows(df: pd.DataFrame, forced_type: str) -> List[str]:
-    if df.empty:
-        return []
-    for col in df.columns.tolist():
-        series = df[col].dropna().astype(str)
-        if not series.empty:
-            return [clean_identifier(x) for x in series.tolist() if str(x).strip()]
-    return []
-
-
 def append_cnpj_log(record: Dict[str, Any]) -> None:
     if not CNPJ_PIPELINE_ENABLED or not CNPJ_LOG_FILE:
         return
@@ -682,57 +831,73 @@ def build_cnpj_xlsx(rows: List[Dict[str, Any]], out_path: Optional[str]) -> None
     wb.save(out_path)
 
 
-async def process_job(job_id: str, path: str, forced_type: str = "auto"):
+async def process_job(
+    job_id: str,
+    path: Optional[str],
+    forced_type: str = "auto",
+    *,
+    identifiers: Optional[List[str]] = None,
+    debug_capture: Optional[str] = None,
+):
     db = await get_db()
     cache = Cache(db)
-    cache = Cache(db)
     job_logger = JobLogger(job_id, LOGS_DIR)
     job_started_at = datetime.utcnow().isoformat()
+    # So o que o last_run.log vai escrever fica em memoria; o resto vai direto para job_results.
     detailed_entries: List[Dict[str, Any]] = []
+    detail_count = 0
+    pending_docs: List[Dict[str, Any]] = []
+    # -inf: os primeiros resultados ja ficam visiveis em /results.
+    last_results_flush = float("-inf")
+
+    async def flush_results(force: bool = False) -> None:
+        nonlocal last_results_flush
+        if not pending_docs:
+            return
+        if (
+            not force
+            and len(pending_docs) < RESULTS_BATCH_SIZE
+            and time.monotonic() - last_results_flush < RESULTS_FLUSH_SECONDS
+        ):
+            return
+        batch = list(pending_docs)
+        pending_docs.clear()
+        last_results_flush = time.monotonic()
+        await db.job_results.insert_many(batch)
+
     await db.job_results.delete_many({"job_id": job_id})
-    job_logger.info("job_started", job_id=job_id, file_path=path, forced_type=forced_type)
-    logger.info(f"[LIVE] Status atual do job: {job_id} - started")
-    job_started_at = datetime.utcnow().isoformat()
-    detailed_entries: List[Dict[str, Any]] = []
-    await db.job_results.delete_many({"job_id": job_id})
-    job_logger.info("job_started", job_id=job_id, file_path=path, forced_type=forced_type)
+    job_logger.info(
+        "job_started",
+        job_id=job_id,
+        file_path=path,
+        forced_type=forced_type,
+        debug_capture=debug_capture,
+    )
     logger.info(f"[LIVE] Status atual do job: {job_id} - started")
+    exporter: Optional[PartialExporter] = None
     try:
-        ext = os.path.splitext(path)[1].lower()
-        if ext == ".csv":
-            df = pd.read_csv(path, dtype=str)
-        else:
-            df = pd.read_excel(path, dtype=str)
-
-        raw_identifiers = to_rows(df, forced_type)
-        identifiers = [clean_identifier(x) for x in raw_identifiers if str(x).strip()]
-        total = len(identifiers)
-
-        await db.jobs.update_one(
-            {"_id": job_id},
-            {"$set": {"total": total, "processed": 0, "success": 0, "error": 0}},
+        exporter = PartialExporter(
+            job_id, EXPORT_DIR, build_xlsx_from_results, PARTIAL_XLSX_INTERVAL_SECONDS
         )
-
-        results: List[Dict[str, Any]] = []
+        total = 0
         success = 0
         error = 0
         processed = 0
         drivers = driver_manager.drivers
-        job_logger.info("identifiers_loaded", total=total)
 
-        invalid_identifiers: List[str] = []
-        grouped: Dict[str, List[str]] = defaultdict(list)
-        for ident in identifiers:
-            if not validate_cpf_cnpj(ident):
-                invalid_identifiers.append(ident)
-                continue
-            itype = detect_type(ident) if forced_type == "auto" else forced_type
-            if itype not in ("cpf", "cnpj"):
-                invalid_identifiers.append(ident)
-                continue
-            grouped[itype].append(ident)
+        def record_entry(detail_entry: Dict[str, Any]) -> None:
+            nonlocal detail_count
+            pending_docs.append({**detail_entry, "job_id": job_id})
+            detail_count += 1
+            if not LAST_RUN_LOG_SUMMARY_ONLY and (
+                not LAST_RUN_LOG_MAX_DETAILS or len(detailed_entries) < LAST_RUN_LOG_MAX_DETAILS
+            ):
+                detailed_entries.append(detail_entry)
+            exporter.add(detail_entry)
 
         async def update_job_progress():
+            exporter.flush()
+            await flush_results()
             await db.jobs.update_one(
                 {"_id": job_id},
                 {
@@ -745,24 +910,6 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
                 },
             )
 
-        for ident in invalid_identifiers:
-            detail_entry = {
-                "input": ident,
-                "type": "invalid",
-                "operator": "",
-                "status": "invalid",
-                "plan": "",
-                "message": "identificador inválido",
-                "captured_at": datetime.utcnow().isoformat(),
-                "debug": {"reason": "invalid_identifier"},
-            }
-            results.append(detail_entry)
-            detailed_entries.append(detail_entry)
-            error += 1
-            processed += 1
-            job_logger.error("identifier_invalid", identifier=ident, id_type="invalid")
-            await update_job_progress()
-
         identifier_meta: Dict[str, Dict[str, Any]] = {}
         results_buffer: Dict[str, List[DriverResult]] = defaultdict(list)
 
@@ -771,18 +918,18 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
             meta = identifier_meta.pop(identifier, {"id_type": forced_type, "expected": 0})
             entries = results_buffer.pop(identifier, [])
             if not entries:
-                detail_entry = {
-                    "input": identifier,
-                    "type": meta.get("id_type", forced_type),
-                    "operator": "",
-                    "status": "erro",
-                    "plan": "",
-                    "message": "sem resultado",
-                    "captured_at": datetime.utcnow().isoformat(),
-                    "debug": {"reason": "no_result"},
-                }
-                results.append(detail_entry)
-                detailed_entries.append(detail_entry)
+                record_entry(
+                    {
+                        "input": identifier,
+                        "type": meta.get("id_type", forced_type),
+                        "operator": "",
+                        "status": "erro",
+                        "plan": "",
+                        "message": "sem resultado",
+                        "captured_at": datetime.utcnow().isoformat(),
+                        "debug": {"reason": "no_result"},
+                    }
+                )
                 error += 1
                 processed += 1
                 job_logger.error(
@@ -803,128 +950,19 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
             processed += 1
 
             for entry in entries:
-                detail_entry = {
-                    "input": identifier,
-                    "type": meta.get("id_type", forced_type),
-                    "operator": entry.operator,
-                    "status": entry.status,
-                    "plan": entry.plan,
-                    "message": entry.message,
-                    "captured_at": entry.captured_at,
-                    "debug": entry.debug,
-                }
-                results.append(detail_entry)
-                detailed_entries.append(detail_entry)
-
-            await update_job_progress()
-            job_logger.info(
-                "identifier_processed",
-                identifier=identifier,
-                id_type=meta.get("id_type", forced_type),
-                drivers=len(entries),
-                success=has_success,
-            )
-
-        async def handle_progress(
-            identifier: str, driver: BaseDriver, result: DriverResult, from_cache: bool
-        ) -> None:
-            meta = identifier_meta.get(identifier)
-            if not meta:
-                return
-            debug_info = dict(result.debug or {})
-            if from_cache:
-                debug_info["cache_hit"] = True
-            result.debug = debug_info
-            job_logger.info(
-                "driver_result",
-                identifier=identifier,
-                id_type=meta.get("id_type", forced_type),
-                driver=driver.name,
-                status=result.status,
-                plan=result.plan,
-                message=result.message,
-                cached=from_cache,
-                debug=debug_info,
-            )
-            results_buffer[identifier].append(result)
-            if len(results_buffer[identifier]) >= meta.get("expected", 0):
-                await finalize_identifier(identifier)
-
-        for id_type, identifiers in grouped.items():
-            if not identifiers:
-                continue
-            active_drivers = [
-                drv
-                for drv in drivers
-                if id_type in getattr(drv, "supported_id_types", ("cpf",))
-            ]
-            if not active_drivers:
-                for ident in identifiers:
-                    detail_entry = {
-                        "input": ident,
-                        "type": id_type,
-                        "operator": "",
-                        "status": "erro",
-                        "plan": "",
-                        "message": "nenhum driver suporta este tipo",
-                        "captured_at": datetime.utcnow().isoformat(),
-                        "debug": {"reason": "unsupported_id_type"},
+                record_entry(
+                    {
+                        "input": identifier,
+                        "type": meta.get("id_type", forced_type),
+                        "operator": entry.operator,
+                        "status": entry.status,
+                        "plan": entry.plan,
+                        "message": entry.message,
+                        "captured_at": entry.captured_at,
+                        "debug": entry.debug,
                     }
-                    results.append(detail_entry)
-                    detailed_entries.append(detail_entry)
-                    error += 1
-                    processed += 1
-                    job_logger.error(
-                        "identifier_unsupported",
-                        identifier=ident,
-                        id_type=id_type,
-                    )
-                    await update_job_progress()
-                continue
-
-            for drv in active_drivers:
-                driver_name = getattr(drv, "operator", getattr(drv, "name", "unknown"))
-                logger.info(
-                    f"🚀 Iniciando driver {driver_name} com {len(identifiers)} CPFs"
-                )
-                print(
-                    f"[DEBUG] Rodando driver: {driver_name} - {len(identifiers)} CPFs"
                 )
 
-            expected = len(active_drivers)
-            for ident in identifiers:
-                identifier_meta[ident] = {"expected": expected, "id_type": id_type}
-
-            await driver_manager.run_batch(
-                identifiers,
-                id_type,
-                cache=cache,
-                db=db,
-                progress_callback=handle_progress,
-            )
-
-            for ident in list(identifiers):
-                if ident in identifier_meta:
-                    await finalize_identifier(ident)
-
-        if results_buffer:
-            for ident in list(results_buffer.keys()):
-                await finalize_identifier(ident)
-
-            for entry in entries:
-                detail_entry = {
-                    "input": identifier,
-                    "type": meta.get("id_type", forced_type),
-                    "operator": entry.operator,
-                    "status": entry.status,
-                    "plan": entry.plan,
-                    "message": entry.message,
-                    "captured_at": entry.captured_at,
-                    "debug": entry.debug,
-                }
-                results.append(detail_entry)
-                detailed_entries.append(detail_entry)
-
             await update_job_progress()
             job_logger.info(
                 "identifier_processed",
@@ -959,116 +997,103 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
             if len(results_buffer[identifier]) >= meta.get("expected", 0):
                 await finalize_identifier(identifier)
 
-        for id_type, identifiers in grouped.items():
-            if not identifiers:
-                continue
-            active_drivers = [
+        def drivers_for(id_type: str) -> List[BaseDriver]:
+            return [
                 drv
-                for drv in drivers
+                for drv in drivers.values()
                 if id_type in getattr(drv, "supported_id_types", ("cpf",))
             ]
-            if not active_drivers:
-                for ident in identifiers:
-                    detail_entry = {
-                        "input": ident,
-                        "type": id_type,
-                        "operator": "",
-                        "status": "erro",
-                        "plan": "",
-                        "message": "nenhum driver suporta este tipo",
-                        "captured_at": datetime.utcnow().isoformat(),
-                        "debug": {"reason": "unsupported_id_type"},
-                    }
-                    results.append(detail_entry)
-                    detailed_entries.append(detail_entry)
-                    error += 1
-                    processed += 1
-                    job_logger.error(
-                        "identifier_unsupported",
-                        identifier=ident,
-                        id_type=id_type,
-                    )
-                    await update_job_progress()
-                continue
-
-            for drv in active_drivers:
-                driver_name = getattr(drv, "operator", getattr(drv, "name", "unknown"))
-                logger.info(
-                    f"🚀 Iniciando driver {driver_name} com {len(identifiers)} CPFs"
-                )
-                print(
-                    f"[DEBUG] Rodando driver: {driver_name} - {len(identifiers)} CPFs"
-                )
 
-            expected = len(active_drivers)
-            for ident in identifiers:
-                identifier_meta[ident] = {"expected": expected, "id_type": id_type}
+        async def ingest() -> AsyncIterator[Tuple[str, str]]:
+            # Cada bloco lido do arquivo ja alimenta as filas dos drivers.
+            nonlocal total, error, processed
+            if identifiers is not None:
+                chunks = aiter_value_chunks(identifiers)
+            else:
+                chunks = aiter_identifier_chunks(path)
+            async for chunk in chunks:
+                raw = np.asarray(chunk, dtype=str)
+                normalized = normalize_identifiers(raw[non_blank_mask(raw)])
+                cleaned = recover_leading_zeros(normalized)
+                recovered = int((cleaned != normalized).sum())
+                if recovered:
+                    job_logger.info("identifiers_zero_padded", count=recovered)
+                detected = classify_identifiers(cleaned)
+                valid = validate_cpf_cnpj_array(cleaned)
+                types = detected if forced_type == "auto" else np.full(len(cleaned), forced_type)
+                total += len(cleaned)
+                for ident, is_valid, itype, length_type in zip(
+                    cleaned.tolist(), valid.tolist(), types.tolist(), detected.tolist()
+                ):
+                    if not is_valid or itype not in ("cpf", "cnpj"):
+                        # Tamanho certo mas DV errado nunca vai bater em nenhum portal.
+                        reason = (
+                            "invalid_check_digits" if length_type != "unknown" else "invalid_identifier"
+                        )
+                        record_entry(
+                            {
+                                "input": ident,
+                                "type": "invalid",
+                                "operator": "",
+                                "status": "invalid",
+                                "plan": "",
+                                "message": "identificador inválido",
+                                "captured_at": datetime.utcnow().isoformat(),
+                                "debug": {"reason": reason},
+                            }
+                        )
+                        error += 1
+                        processed += 1
+                        job_logger.error("identifier_invalid", identifier=ident, id_type="invalid")
+                        continue
+                    expected = len(drivers_for(itype))
+                    if not expected:
+                        record_entry(
+                            {
+                                "input": ident,
+                                "type": itype,
+                                "operator": "",
+                                "status": "erro",
+                                "plan": "",
+                                "message": "nenhum driver suporta este tipo",
+                                "captured_at": datetime.utcnow().isoformat(),
+                                "debug": {"reason": "unsupported_id_type"},
+                            }
+                        )
+                        error += 1
+                        processed += 1
+                        job_logger.error("identifier_unsupported", identifier=ident, id_type=itype)
+                        continue
+                    identifier_meta[ident] = {"expected": expected, "id_type": itype}
+                    yield ident, itype
+                job_logger.info("identifiers_chunk_loaded", count=len(cleaned), total=total)
+                await update_job_progress()
 
-            await driver_manager.run_batch(
-                identifiers,
-                id_type,
-                cache=cache,
-                db=db,
-                progress_callback=handle_progress,
-            )
+        await driver_manager.run_stream(
+            ingest(),
+            cache=cache,
+            db=db,
+            progress_callback=handle_progress,
+            debug_capture=debug_capture,
+        )
+        job_logger.info("identifiers_loaded", total=total)
 
-            for ident in list(identifiers):
-                if ident in identifier_meta:
-                    await finalize_identifier(ident)
+        for ident in list(identifier_meta.keys()):
+            await finalize_identifier(ident)
 
         if results_buffer:
             for ident in list(results_buffer.keys()):
                 await finalize_identifier(ident)
 
-        out_df = pd.DataFrame(results)
+        await flush_results(force=True)
+        out_df = await load_xlsx_source(db, job_id)
         xlsx_path = os.path.join(EXPORT_DIR, f"{job_id}.xlsx")
-        build_xlsx_from_results(out_df, xlsx_path)
-
-        if results:
-            docs = []
-            for row in results:
-                doc = dict(row)
-                doc["job_id"] = job_id
-                docs.append(doc)
-            if docs:
-                await db.job_results.insert_many(docs)
-
-        job_finished_at = datetime.utcnow().isoformat()
-
-        write_last_run_log(
-            job_id,
-            total,
-            success,
-            error,
-            None,
-            xlsx_path,
-            details=detailed_entries,
-            started_at=job_started_at,
-            finished_at=job_finished_at,
-            job_type=forced_type,
-            job_log_path=job_logger.path,
-        )
-
-        job_logger.info(
-            "job_completed",
-            total=total,
-            success=success,
-            error=error,
-            xlsx_path=xlsx_path,
-        )
-        logger.info(f"[LIVE] Status atual do job: {job_id} - completed")
-        if results:
-            docs = []
-            for row in results:
-                doc = dict(row)
-                doc["job_id"] = job_id
-                docs.append(doc)
-            if docs:
-                await db.job_results.insert_many(docs)
+        await asyncio.to_thread(build_xlsx_from_results, out_df, xlsx_path)
 
         job_finished_at = datetime.utcnow().isoformat()
 
-        write_last_run_log(
+        await asyncio.to_thread(
+            write_last_run_log,
             job_id,
             total,
             success,
@@ -1076,6 +1101,7 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
             None,
             xlsx_path,
             details=detailed_entries,
+            detail_count=detail_count,
             started_at=job_started_at,
             finished_at=job_finished_at,
             job_type=forced_type,
@@ -1106,52 +1132,20 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
                 }
             },
         )
-        await db.jobs.update_one(
-            {"_id": job_id},
-            {
-                "$set": {
-                    "status": "completed",
-                    "total": total,
-                    "success": success,
-                    "error": error,
-                    "processed": processed,
-                    "completed_at": datetime.utcnow().isoformat(),
-                    "xlsx_path": xlsx_path,
-                    "job_log_path": job_logger.path,
-                }
-            },
-        )
+        # O XLSX final substitui os parciais.
+        await exporter.finish(discard=True)
     except Exception as e:
         job_logger.error("job_failed", error=str(e))
         logger.info(f"[LIVE] Status atual do job: {job_id} - failed")
-        write_last_run_log(
-            job_id,
-            0,
-            0,
-            0,
-            None,
-            None,
-            error_message=str(e),
-            details=detailed_entries,
-            started_at=job_started_at,
-            finished_at=datetime.utcnow().isoformat(),
-            job_type=forced_type,
-            job_log_path=job_logger.path,
-        )
-        await db.jobs.update_one(
-            {"_id": job_id},
-            {
-                "$set": {
-                    "status": "failed",
-                    "error_message": str(e),
-                    "completed_at": datetime.utcnow().isoformat(),
-                    "job_log_path": job_logger.path,
-                }
-            },
-        )
-        job_logger.error("job_failed", error=str(e))
-        logger.info(f"[LIVE] Status atual do job: {job_id} - failed")
-        write_last_run_log(
+        # Mantem o que ja foi consultado disponivel via partial=true e em job_results.
+        if exporter is not None:
+            await exporter.finish(discard=False)
+        try:
+            await flush_results(force=True)
+        except Exception as flush_error:
+            job_logger.error("job_results_flush_failed", error=str(flush_error))
+        await asyncio.to_thread(
+            write_last_run_log,
             job_id,
             0,
             0,
@@ -1160,6 +1154,7 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
             None,
             error_message=str(e),
             details=detailed_entries,
+            detail_count=detail_count,
             started_at=job_started_at,
             finished_at=datetime.utcnow().isoformat(),
             job_type=forced_type,
@@ -1178,36 +1173,121 @@ async def process_job(job_id: str, path: str, forced_type: str = "auto"):
         )
 
 
+def pivot_cpf_results(df: pd.DataFrame) -> pd.DataFrame:
+    """Uma linha por CPF (ordem de chegada), uma coluna por operadora; plano ou status."""
+    columns = ["cpf", *XLSX_OPERATOR_COLUMNS]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    cpf_rows = df[df["type"] == "cpf"]
+    plan = cpf_rows["plan"].fillna("").astype(str)
+    frame = pd.DataFrame(
+        {
+            "cpf": format_cpf_series(cpf_rows["input"].fillna("").astype(str)),
+            "operator": cpf_rows["operator"].fillna("").astype(str).str.lower(),
+            "value": plan.where(plan != "", cpf_rows["status"].fillna("").astype(str)),
+        }
+    )
+    frame = frame[frame["cpf"] != ""]
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+    order = frame["cpf"].unique()
+    table = (
+        frame.drop_duplicates(["cpf", "operator"], keep="last")
+        .pivot(index="cpf", columns="operator", values="value")
+        .reindex(index=order, columns=list(XLSX_OPERATOR_COLUMNS))
+        .fillna("")
+    )
+    table.index.name = "cpf"
+    return table.reset_index()
+
+
+async def load_xlsx_source(db, job_id: str) -> pd.DataFrame:
+    """Colunas do XLSX consolidado lidas de job_results (ordem de chegada), sem debug/mensagem."""
+    columns: Dict[str, List[Any]] = {name: [] for name in XLSX_SOURCE_COLUMNS}
+    cursor = db.job_results.find(
+        {"job_id": job_id},
+        projection={name: 1 for name in XLSX_SOURCE_COLUMNS},
+        sort=[("_id", 1)],
+        batch_size=RESULTS_BATCH_SIZE,
+    )
+    async for doc in cursor:
+        for name in XLSX_SOURCE_COLUMNS:
+            value = doc.get(name)
+            columns[name].append("" if value is None else value)
+    return pd.DataFrame(columns, columns=XLSX_SOURCE_COLUMNS)
+
+
 def build_xlsx_from_results(df: pd.DataFrame, out_path: str):
     header = ["CPF", "amil", "bradesco", "unimed", "unimed seguros"]
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Consulta CPF"
-    ws.append(header)
-    by_cpf = {}
-    for _, row in df.iterrows():
-        if row.get("type") != "cpf":
-            continue
-        cpf_digits = str(row.get("input", ""))
-        cpf_fmt = format_cpf(cpf_digits)
-        op = str(row.get("operator", "")).lower()
-        plan = str(row.get("plan", ""))
-        status = str(row.get("status", ""))
-        val = plan if plan else status
-        if not cpf_fmt:
-            continue
-        if cpf_fmt not in by_cpf:
-            by_cpf[cpf_fmt] = {}
-        by_cpf[cpf_fmt][op] = val
-    for cpf_fmt, ops in by_cpf.items():
-        row = [cpf_fmt, ops.get("amil", ""), ops.get("bradesco", ""), ops.get("unimed", ""), ops.get("seguros_unimed", "")]
-        ws.append(row)
-    for cell in ws["A"]:
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Consulta CPF")
+    alignment = Alignment(horizontal="left")
+
+    def text_cell(value: str) -> WriteOnlyCell:
+        cell = WriteOnlyCell(ws, value=value)
         cell.number_format = "@"
-        cell.alignment = Alignment(horizontal="left")
+        cell.alignment = alignment
+        return cell
+
+    ws.append([text_cell(header[0]), *header[1:]])
+    for cpf_fmt, *values in pivot_cpf_results(df).itertuples(index=False, name=None):
+        ws.append([text_cell(cpf_fmt), *values])
     wb.save(out_path)
 
 
+def _iter_detail_lines(entry: Dict[str, Any]) -> Iterator[str]:
+    inp = entry.get("input", "")
+    ident_type = entry.get("type", "")
+    operator = entry.get("operator", "")
+    status = entry.get("status", "")
+    plan = entry.get("plan", "")
+    message = entry.get("message", "") or ""
+    yield f"- input: {inp} ({ident_type})"
+    yield f"  operator: {operator} | status: {status} | plan: {plan}"
+    if message:
+        yield f"  message: {message}"
+
+    debug = entry.get("debug") or {}
+    if not isinstance(debug, dict) or not debug:
+        return
+    reason = debug.get("reason")
+    if reason:
+        yield f"  reason: {reason}"
+    captured = debug.get("captured_text")
+    if captured:
+        yield f"  captured_text: {captured[:300]}"
+    status_selector = debug.get("status_selector")
+    if status_selector:
+        yield f"  status_selector: {status_selector}"
+    plan_selector = debug.get("plan_selector")
+    if plan_selector:
+        yield f"  plan_selector: {plan_selector}"
+    plan_text = debug.get("plan_text")
+    if plan_text:
+        yield f"  plan_text: {plan_text[:300]}"
+    decided_status = debug.get("decided_status")
+    if decided_status and decided_status != status:
+        yield f"  decided_status: {decided_status}"
+    error_detail = debug.get("error")
+    if error_detail:
+        yield f"  debug_error: {error_detail}"
+    artifacts = debug.get("artifacts")
+    if isinstance(artifacts, dict):
+        for key, value in artifacts.items():
+            yield f"  artifact_{key}: {value}"
+    steps = debug.get("steps")
+    if isinstance(steps, list) and steps:
+        yield "  steps:"
+        for step in steps:
+            idx = step.get("index")
+            action = step.get("action")
+            selector = step.get("selector") or step.get("target") or ""
+            step_status = step.get("status")
+            yield f"    - #{idx} {action or ''} {selector} status={step_status}"
+            if step.get("error"):
+                yield f"      error: {step['error']}"
+
+
 def write_last_run_log(
     job_id: str,
     total: int,
@@ -1218,145 +1298,52 @@ def write_last_run_log(
     *,
     error_message: Optional[str] = None,
     details: Optional[List[Dict[str, Any]]] = None,
+    detail_count: Optional[int] = None,
     started_at: Optional[str] = None,
     finished_at: Optional[str] = None,
     job_type: str = "auto",
     job_log_path: Optional[str] = None,
+    summary_only: bool = LAST_RUN_LOG_SUMMARY_ONLY,
+    max_details: int = LAST_RUN_LOG_MAX_DETAILS,
 ) -> None:
-    lines = [
+    """
+    Grava last_run.log linha a linha. Bloqueante: chamar via asyncio.to_thread.
+    `detail_count` e o total de entradas do job quando `details` traz so as primeiras.
+    """
+    header = [
         f"job_id: {job_id}",
         f"job_type: {job_type}",
         f"started_at: {started_at or ''}",
         f"finished_at: {finished_at or ''}",
-        f"job_type: {job_type}",
-        f"started_at: {started_at or ''}",
-        f"finished_at: {finished_at or ''}",
         f"total: {total}",
         f"success: {success}",
         f"error: {error}",
     ]
     if csv_path:
-        lines.append(f"csv: {csv_path}")
+        header.append(f"csv: {csv_path}")
     if xlsx_path:
-        lines.append(f"xlsx: {xlsx_path}")
-    if job_log_path:
-        lines.append(f"job_log: {job_log_path}")
+        header.append(f"xlsx: {xlsx_path}")
     if job_log_path:
-        lines.append(f"job_log: {job_log_path}")
+        header.append(f"job_log: {job_log_path}")
     if error_message:
-        lines.append(f"error_message: {error_message}")
-
-    if details:
-        lines.append("--- details ---")
-        for entry in details:
-            inp = entry.get("input", "")
-            ident_type = entry.get("type", "")
-            operator = entry.get("operator", "")
-            status = entry.get("status", "")
-            plan = entry.get("plan", "")
-            message = entry.get("message", "") or ""
-            lines.append(f"- input: {inp} ({ident_type})")
-            lines.append(f"  operator: {operator} | status: {status} | plan: {plan}")
-            if message:
-                lines.append(f"  message: {message}")
-
-            debug = entry.get("debug") or {}
-            if isinstance(debug, dict) and debug:
-                reason = debug.get("reason")
-                if reason:
-                    lines.append(f"  reason: {reason}")
-                captured = debug.get("captured_text")
-                if captured:
-                    lines.append(f"  captured_text: {captured[:300]}")
-                status_selector = debug.get("status_selector")
-                if status_selector:
-                    lines.append(f"  status_selector: {status_selector}")
-                plan_selector = debug.get("plan_selector")
-                if plan_selector:
-                    lines.append(f"  plan_selector: {plan_selector}")
-                plan_text = debug.get("plan_text")
-                if plan_text:
-                    lines.append(f"  plan_text: {plan_text[:300]}")
-                decided_status = debug.get("decided_status")
-                if decided_status and decided_status != status:
-                    lines.append(f"  decided_status: {decided_status}")
-                error_detail = debug.get("error")
-                if error_detail:
-                    lines.append(f"  debug_error: {error_detail}")
-                artifacts = debug.get("artifacts")
-                if isinstance(artifacts, dict):
-                    for key, value in artifacts.items():
-                        lines.append(f"  artifact_{key}: {value}")
-                steps = debug.get("steps")
-                if isinstance(steps, list) and steps:
-                    lines.append("  steps:")
-                    for step in steps:
-                        idx = step.get("index")
-                        action = step.get("action")
-                        selector = step.get("selector") or step.get("target") or ""
-                        step_status = step.get("status")
-                        lines.append(
-                            f"    - #{idx} {action or ''} {selector} status={step_status}"
-                        )
-                        if step.get("error"):
-                            lines.append(f"      error: {step['error']}")
-
-
-    if details:
-        lines.append("--- details ---")
-        for entry in details:
-            inp = entry.get("input", "")
-            ident_type = entry.get("type", "")
-            operator = entry.get("operator", "")
-            status = entry.get("status", "")
-            plan = entry.get("plan", "")
-            message = entry.get("message", "") or ""
-            lines.append(f"- input: {inp} ({ident_type})")
-            lines.append(f"  operator: {operator} | status: {status} | plan: {plan}")
-            if message:
-                lines.append(f"  message: {message}")
-
-            debug = entry.get("debug") or {}
-            if isinstance(debug, dict) and debug:
-                reason = debug.get("reason")
-                if reason:
-                    lines.append(f"  reason: {reason}")
-                captured = debug.get("captured_text")
-                if captured:
-                    lines.append(f"  captured_text: {captured[:300]}")
-                status_selector = debug.get("status_selector")
-                if status_selector:
-                    lines.append(f"  status_selector: {status_selector}")
-                plan_selector = debug.get("plan_selector")
-                if plan_selector:
-                    lines.append(f"  plan_selector: {plan_selector}")
-                plan_text = debug.get("plan_text")
-                if plan_text:
-                    lines.append(f"  plan_text: {plan_text[:300]}")
-                decided_status = debug.get("decided_status")
-                if decided_status and decided_status != status:
-                    lines.append(f"  decided_status: {decided_status}")
-                error_detail = debug.get("error")
-                if error_detail:
-                    lines.append(f"  debug_error: {error_detail}")
-                artifacts = debug.get("artifacts")
-                if isinstance(artifacts, dict):
-                    for key, value in artifacts.items():
-                        lines.append(f"  artifact_{key}: {value}")
-                steps = debug.get("steps")
-                if isinstance(steps, list) and steps:
-                    lines.append("  steps:")
-                    for step in steps:
-                        idx = step.get("index")
-                        action = step.get("action")
-                        selector = step.get("selector") or step.get("target") or ""
-                        step_status = step.get("status")
-                        lines.append(
-                            f"    - #{idx} {action or ''} {selector} status={step_status}"
-                        )
-                        if step.get("error"):
-                            lines.append(f"      error: {step['error']}")
+        header.append(f"error_message: {error_message}")
 
     os.makedirs(LOGS_DIR, exist_ok=True)
     with open(LAST_RUN_LOG, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines) + "\n")
+        f.write("\n".join(header) + "\n")
+        if summary_only or not details:
+            return
+        f.write("--- details ---\n")
+        written = 0
+        for entry in details:
+            if max_details and written >= max_details:
+                break
+            for line in _iter_detail_lines(entry):
+                f.write(line + "\n")
+            written += 1
+        omitted = (len(details) if detail_count is None else detail_count) - written
+        if omitted > 0:
+            f.write(
+                f"... {omitted} entradas omitidas "
+                f"(LAST_RUN_LOG_MAX_DETAILS={max_details}); ver job_log\n"
+            )
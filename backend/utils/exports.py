@@ -0,0 +1,319 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None  # type: ignore
+    pq = None  # type: ignore
+
+PARQUET_AVAILABLE = pa is not None
+
+logger = logging.getLogger("saude_fetch.exports")
+
+RESULT_FIELDS = (
+    "id",
+    "input",
+    "type",
+    "operator",
+    "status",
+    "plan",
+    "message",
+    "captured_at",
+    "debug",
+)
+# debug carrega passos, textos capturados e artefatos; so sai quando pedido.
+DEFAULT_RESULT_FIELDS = tuple(f for f in RESULT_FIELDS if f != "debug")
+
+STREAM_FLUSH_BYTES = 64 * 1024
+
+PARTIAL_CSV_FIELDS = ("input", "type", "operator", "status", "plan", "message", "captured_at")
+
+# Colunas de baixa cardinalidade: gravadas como dicionario no Parquet.
+PARQUET_DICTIONARY_FIELDS = ("type", "operator", "status")
+
+
+def parse_fields(raw: Optional[str]) -> List[str]:
+    """Converte o parametro `fields=` (lista separada por virgula) em colunas validas."""
+    if not raw or not raw.strip():
+        return list(DEFAULT_RESULT_FIELDS)
+    requested: List[str] = []
+    for name in raw.split(","):
+        name = name.strip()
+        if name and name not in requested:
+            requested.append(name)
+    if "*" in requested:
+        return list(RESULT_FIELDS)
+    unknown = [name for name in requested if name not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def mongo_projection(fields: Sequence[str]) -> Dict[str, int]:
+    projection = {name: 1 for name in fields if name != "id"}
+    # _id sempre volta: e o cursor de paginacao (`after`).
+    projection["_id"] = 1
+    return projection
+
+
+def project_row(doc: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {}
+    for name in fields:
+        if name == "id":
+            row["id"] = str(doc.get("_id", ""))
+        elif name == "debug":
+            row["debug"] = doc.get("debug") or {}
+        else:
+            value = doc.get(name)
+            row[name] = "" if value is None else value
+    return row
+
+
+def _csv_value(value: Any) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+async def iter_json(
+    cursor: Any, fields: Sequence[str], limit: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """Serializa `{"items": [...], "next_after": ...}` sem montar a lista em memoria."""
+    buffer = io.StringIO()
+    buffer.write('{"items": [')
+    count = 0
+    last_id: Optional[str] = None
+    async for doc in cursor:
+        if count:
+            buffer.write(", ")
+        buffer.write(json.dumps(project_row(doc, fields), ensure_ascii=False, default=str))
+        count += 1
+        last_id = str(doc.get("_id", ""))
+        if buffer.tell() >= STREAM_FLUSH_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+    next_after = last_id if limit and count >= limit else None
+    buffer.write(f'], "next_after": {json.dumps(next_after)}}}')
+    yield buffer.getvalue().encode("utf-8")
+
+
+async def iter_ndjson(cursor: Any, fields: Sequence[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    async for doc in cursor:
+        buffer.write(json.dumps(project_row(doc, fields), ensure_ascii=False, default=str))
+        buffer.write("\n")
+        if buffer.tell() >= STREAM_FLUSH_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def iter_csv(cursor: Any, fields: Sequence[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    async for doc in cursor:
+        row = project_row(doc, fields)
+        writer.writerow([_csv_value(row[name]) for name in fields])
+        if buffer.tell() >= STREAM_FLUSH_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Destino do ParquetWriter que acumula bytes ate serem drenados para a resposta."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        # O writer usa a posicao absoluta nos offsets do footer.
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_schema(fields: Sequence[str]) -> "pa.Schema":
+    columns = []
+    for name in fields:
+        if name in PARQUET_DICTIONARY_FIELDS:
+            column_type = pa.dictionary(pa.int32(), pa.string())
+        elif name == "captured_at":
+            column_type = pa.timestamp("us")
+        else:
+            column_type = pa.string()
+        columns.append(pa.field(name, column_type))
+    return pa.schema(columns)
+
+
+def _parquet_value(name: str, value: Any) -> Any:
+    if name == "captured_at":
+        try:
+            return datetime.fromisoformat(str(value)) if value else None
+        except ValueError:
+            return None
+    return _csv_value(value)
+
+
+async def iter_parquet(
+    cursor: Any, fields: Sequence[str], row_group_size: int
+) -> AsyncIterator[bytes]:
+    """Grava um row group a cada `row_group_size` documentos e devolve os bytes produzidos."""
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("pyarrow nao instalado")
+    schema = _parquet_schema(fields)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(
+        sink,
+        schema,
+        compression="zstd",
+        use_dictionary=[name for name in fields if name in PARQUET_DICTIONARY_FIELDS],
+    )
+    columns: Dict[str, List[Any]] = {name: [] for name in fields}
+    pending = 0
+
+    def write_row_group(batch: Dict[str, List[Any]]) -> None:
+        # Montagem dos arrays, dicionario e zstd: em thread, fora do event loop.
+        arrays = []
+        for column in schema:
+            values = batch[column.name]
+            if pa.types.is_dictionary(column.type):
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=column.type))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    try:
+        async for doc in cursor:
+            row = project_row(doc, fields)
+            for name in fields:
+                columns[name].append(_parquet_value(name, row[name]))
+            pending += 1
+            if pending >= row_group_size:
+                batch, columns = columns, {name: [] for name in fields}
+                pending = 0
+                await asyncio.to_thread(write_row_group, batch)
+                yield sink.drain()
+        if pending:
+            await asyncio.to_thread(write_row_group, columns)
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def partial_export_paths(export_dir: str, job_id: str) -> Tuple[str, str]:
+    """Caminhos (csv, xlsx) dos exports parciais de um job em andamento."""
+    return (
+        os.path.join(export_dir, f"{job_id}.partial.csv"),
+        os.path.join(export_dir, f"{job_id}.partial.xlsx"),
+    )
+
+
+class PartialExporter:
+    """
+    Exports parciais de um job em andamento:
+    - CSV incremental, uma linha por resultado finalizado;
+    - snapshot XLSX regenerado a partir do CSV em thread, no maximo a cada `snapshot_interval`.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        export_dir: str,
+        build_xlsx: Callable[[pd.DataFrame, str], None],
+        snapshot_interval: float,
+    ) -> None:
+        self.csv_path, self.xlsx_path = partial_export_paths(export_dir, job_id)
+        self._build_xlsx = build_xlsx
+        self._snapshot_interval = snapshot_interval
+        self._rows = 0
+        self._snapshot_rows = 0
+        # -inf: o primeiro identificador finalizado ja gera um snapshot.
+        self._last_snapshot = float("-inf")
+        self._snapshot_task: Optional[asyncio.Future] = None
+        os.makedirs(export_dir, exist_ok=True)
+        self._file = open(self.csv_path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(PARTIAL_CSV_FIELDS)
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        self._writer.writerow(
+            [_csv_value(entry.get(name) or "") for name in PARTIAL_CSV_FIELDS]
+        )
+        self._rows += 1
+
+    def flush(self) -> None:
+        """Publica as linhas pendentes no CSV e agenda um snapshot XLSX se estiver na hora."""
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self._rows == self._snapshot_rows:
+            return
+        if self._snapshot_task is not None and not self._snapshot_task.done():
+            return
+        if time.monotonic() - self._last_snapshot < self._snapshot_interval:
+            return
+        self._last_snapshot = time.monotonic()
+        self._snapshot_rows = self._rows
+        self._snapshot_task = asyncio.ensure_future(
+            asyncio.to_thread(self._write_snapshot, self._rows)
+        )
+
+    def _write_snapshot(self, nrows: int) -> None:
+        # nrows limita a leitura ao que ja estava gravado quando o snapshot foi agendado.
+        try:
+            df = pd.read_csv(self.csv_path, dtype=str, keep_default_na=False, nrows=nrows)
+            tmp_path = f"{self.xlsx_path}.tmp"
+            self._build_xlsx(df, tmp_path)
+            os.replace(tmp_path, self.xlsx_path)
+        except Exception as exc:
+            logger.warning("falha ao gerar snapshot parcial %s: %s", self.xlsx_path, exc)
+
+    async def finish(self, discard: bool) -> None:
+        """Fecha o CSV; remove os parciais ou grava um ultimo snapshot com tudo."""
+        if not self._file.closed:
+            self._file.close()
+        if self._snapshot_task is not None:
+            await self._snapshot_task
+        if discard:
+            for path in (self.csv_path, self.xlsx_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as exc:
+                    logger.warning("falha ao remover export parcial %s: %s", path, exc)
+        elif self._rows != self._snapshot_rows:
+            self._snapshot_rows = self._rows
+            await asyncio.to_thread(self._write_snapshot, self._rows)
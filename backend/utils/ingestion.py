@@ -0,0 +1,213 @@
+import asyncio
+import math
+import os
+from itertools import chain, islice
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from utils.validators import normalize_identifiers
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # pragma: no cover
+    CalamineWorkbook = None  # type: ignore
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "5000"))
+# auto: calamine quando instalado, senao openpyxl read-only.
+SPREADSHEET_READER = os.getenv("SPREADSHEET_READER", "auto").strip().lower()
+# Linhas amostradas para escolher a coluna de identificadores.
+COLUMN_SAMPLE_ROWS = int(os.getenv("COLUMN_SAMPLE_ROWS", "200"))
+
+RowIterator = Iterator[Sequence[Any]]
+
+
+def _is_blank(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    return not str(value).strip()
+
+
+def _cell_to_str(value: Any) -> str:
+    # Mesma conversao do pd.read_excel(dtype=str): float inteiro vira int (sem ".0").
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+# --- Deteccao da coluna de identificadores ---
+
+
+def score_identifier_column(values: Sequence[Any]) -> float:
+    """
+    Pontua uma coluna pela densidade de digitos: cada celula com 9 a 14 digitos (CPF/CNPJ,
+    inclusive sem zeros a esquerda) soma a fracao de digitos do texto. Nomes, datas e codigos
+    curtos ficam perto de zero.
+    """
+    texts = [_cell_to_str(value).strip() for value in values if not _is_blank(value)]
+    if not texts:
+        return 0.0
+    raw = np.asarray(texts, dtype=str)
+    digits = np.char.str_len(normalize_identifiers(raw))
+    density = digits / np.char.str_len(raw)
+    plausible = (digits >= 9) & (digits <= 14)
+    return float((density * plausible).sum())
+
+
+def detect_identifier_column(columns: Sequence[Sequence[Any]]) -> Optional[int]:
+    """
+    Indice da coluna com maior pontuacao; empate fica com a mais a esquerda. Sem nenhuma
+    coluna pontuando, volta ao comportamento antigo (primeira coluna nao vazia).
+    """
+    scores = [score_identifier_column(values) for values in columns]
+    if scores and max(scores) > 0:
+        return scores.index(max(scores))
+    return next(
+        (idx for idx, values in enumerate(columns) if any(not _is_blank(v) for v in values)),
+        None,
+    )
+
+
+def _columns_of(rows: Sequence[Sequence[Any]]) -> List[List[Any]]:
+    width = max((len(row) for row in rows), default=0)
+    return [[row[idx] if idx < len(row) else None for row in rows] for idx in range(width)]
+
+
+# --- Leitores de planilha (linhas cruas, cabecalho incluso) ---
+
+
+def _openpyxl_rows(path: str) -> RowIterator:
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _calamine_rows(path: str) -> RowIterator:
+    wb = CalamineWorkbook.from_path(path)
+    try:
+        yield from wb.get_sheet_by_index(0).iter_rows()
+    finally:
+        wb.close()
+
+
+SPREADSHEET_READERS: Dict[str, Callable[[str], RowIterator]] = {
+    "calamine": _calamine_rows,
+    "openpyxl": _openpyxl_rows,
+}
+
+
+def spreadsheet_reader(ext: str) -> Optional[Callable[[str], RowIterator]]:
+    """
+    Leitor em streaming para a extensao; None quando so o pandas atende (.xls sem calamine).
+    """
+    name = SPREADSHEET_READER
+    if name == "auto":
+        name = "calamine" if CalamineWorkbook is not None else "openpyxl"
+    if name not in SPREADSHEET_READERS:
+        raise ValueError(f"SPREADSHEET_READER invalido: {SPREADSHEET_READER}")
+    if name == "calamine" and CalamineWorkbook is None:
+        raise RuntimeError("python-calamine nao instalado")
+    if ext == ".xls" and name == "openpyxl":
+        return None
+    return SPREADSHEET_READERS[name]
+
+
+def iter_spreadsheet_values(
+    path: str,
+    reader: Callable[[str], RowIterator],
+    chunk_size: int = INGEST_CHUNK_SIZE,
+) -> Iterator[List[str]]:
+    """
+    Percorre a primeira planilha linha a linha; a primeira linha e cabecalho. A coluna e
+    escolhida pela amostra inicial e so ela e convertida dali em diante.
+    """
+    rows = reader(path)
+    try:
+        next(rows, None)
+        column: Optional[int] = None
+        sample: List[Sequence[Any]] = []
+        while column is None:
+            sample = list(islice(rows, COLUMN_SAMPLE_ROWS))
+            if not sample:
+                return
+            # Amostra toda vazia: nada a aproveitar, tenta o proximo bloco.
+            column = detect_identifier_column(_columns_of(sample))
+        batch: List[str] = []
+        for row in chain(sample, rows):
+            value = row[column] if column < len(row) else None
+            if _is_blank(value):
+                continue
+            batch.append(_cell_to_str(value))
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        rows.close()
+
+
+def iter_csv_values(path: str, chunk_size: int = INGEST_CHUNK_SIZE) -> Iterator[List[str]]:
+    """Escolhe a coluna numa amostra e le em blocos apenas ela (usecols)."""
+    sample = pd.read_csv(path, dtype=str, nrows=COLUMN_SAMPLE_ROWS)
+    column = detect_identifier_column([sample[col].tolist() for col in sample.columns])
+    if column is None:
+        return
+    for chunk in pd.read_csv(path, dtype=str, usecols=[column], chunksize=chunk_size):
+        values = chunk.iloc[:, 0].dropna().astype(str).tolist()
+        if values:
+            yield values
+
+
+def iter_excel_values(path: str, chunk_size: int = INGEST_CHUNK_SIZE) -> Iterator[List[str]]:
+    """Formato legado (.xls) sem calamine: carrega via pandas e fatia."""
+    df = pd.read_excel(path, dtype=str)
+    column = detect_identifier_column(
+        [df[col].head(COLUMN_SAMPLE_ROWS).tolist() for col in df.columns]
+    )
+    if column is None:
+        return
+    values = df.iloc[:, column].dropna().astype(str).tolist()
+    for start in range(0, len(values), chunk_size):
+        yield values[start:start + chunk_size]
+
+
+def iter_identifier_chunks(path: str, chunk_size: int = INGEST_CHUNK_SIZE) -> Iterator[List[str]]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return iter_csv_values(path, chunk_size)
+    reader = spreadsheet_reader(ext)
+    if reader is None:
+        return iter_excel_values(path, chunk_size)
+    return iter_spreadsheet_values(path, reader, chunk_size)
+
+
+def read_identifier_values(path: str) -> List[str]:
+    """Todos os valores da coluna de identificadores (para rotas que respondem de uma vez)."""
+    return [value for chunk in iter_identifier_chunks(path) for value in chunk]
+
+
+async def aiter_identifier_chunks(
+    path: str, chunk_size: int = INGEST_CHUNK_SIZE
+) -> AsyncIterator[List[str]]:
+    """Versao assincrona: cada bloco e lido em thread, sem travar o event loop."""
+    iterator = iter_identifier_chunks(path, chunk_size)
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def aiter_value_chunks(
+    values: Sequence[str], chunk_size: int = INGEST_CHUNK_SIZE
+) -> AsyncIterator[List[str]]:
+    """Mesmo contrato de aiter_identifier_chunks para identificadores ja em memoria (API batch)."""
+    for start in range(0, len(values), chunk_size):
+        yield list(values[start:start + chunk_size])
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, AsyncIterator, List, Tuple
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+async def save_upload(
+    upload: Any,
+    dest_path: str,
+    *,
+    max_bytes: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> Tuple[int, str]:
+    """
+    Copia o UploadFile para `dest_path` em blocos de `chunk_size`, sem carregar o arquivo inteiro.
+    Retorna (tamanho em bytes, sha256 hex). Escritas rodam em thread para nao travar o loop.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    out = await asyncio.to_thread(open, dest_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise UploadTooLargeError(f"arquivo excede o limite de {max_bytes} bytes")
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(out.close)
+        try:
+            os.remove(dest_path)
+        except OSError:
+            pass
+        raise
+    await asyncio.to_thread(out.close)
+    return size, digest.hexdigest()
+
+
+def _identifier_from_json(value: Any, position: str) -> str:
+    if isinstance(value, dict):
+        value = value.get("identifier")
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise ValueError(f"{position}: esperado string, numero ou {{\"identifier\": ...}}")
+    return str(value)
+
+
+async def read_json_identifiers(stream: AsyncIterator[bytes], *, max_bytes: int) -> List[str]:
+    """Corpo JSON com um array de identificadores (strings, numeros ou objetos `identifier`)."""
+    body = bytearray()
+    async for chunk in stream:
+        body.extend(chunk)
+        if max_bytes and len(body) > max_bytes:
+            raise UploadTooLargeError(f"corpo excede o limite de {max_bytes} bytes")
+    try:
+        payload = json.loads(bytes(body) or b"null")
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"JSON invalido: {exc}")
+    if not isinstance(payload, list):
+        raise ValueError("esperado um array JSON de identificadores")
+    return [_identifier_from_json(value, f"item {idx}") for idx, value in enumerate(payload)]
+
+
+async def read_ndjson_identifiers(stream: AsyncIterator[bytes], *, max_bytes: int) -> List[str]:
+    """Corpo NDJSON (um identificador por linha), decodificado conforme chega."""
+    identifiers: List[str] = []
+    pending = b""
+    size = 0
+    line_no = 0
+
+    def parse(line: bytes) -> None:
+        nonlocal line_no
+        line_no += 1
+        line = line.strip()
+        if not line:
+            return
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"linha {line_no}: JSON invalido: {exc}")
+        identifiers.append(_identifier_from_json(value, f"linha {line_no}"))
+
+    async for chunk in stream:
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise UploadTooLargeError(f"corpo excede o limite de {max_bytes} bytes")
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            parse(line)
+    parse(pending)
+    return identifiers
@@ -1,11 +1,120 @@
 import re
+from typing import Iterable
+
+import numpy as np
 
 CPF_PATTERN = re.compile(r"^\d{11}$")
 CNPJ_PATTERN = re.compile(r"^\d{14}$")
 
 
+CPF_WEIGHTS = (
+    np.arange(10, 1, -1),  # 1o digito verificador: pesos 10..2
+    np.arange(11, 1, -1),  # 2o digito verificador: pesos 11..2
+)
+CNPJ_WEIGHTS = (
+    np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]),
+    np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]),
+)
+
+
 def validate_cpf_cnpj(identifier: str) -> bool:
     if not identifier:
         return False
     digits = re.sub(r"\D", "", identifier)
-    return bool(CPF_PATTERN.fullmatch(digits) or CNPJ_PATTERN.fullmatch(digits))
+    if not (CPF_PATTERN.fullmatch(digits) or CNPJ_PATTERN.fullmatch(digits)):
+        return False
+    return bool(validate_cpf_cnpj_array(np.asarray([digits]))[0])
+
+
+# --- Versoes vetorizadas (um bloco inteiro de identificadores por chamada) ---
+
+
+def _codepoints(values: np.ndarray) -> np.ndarray:
+    """Matriz (n, largura) com o codepoint de cada caractere; posicoes vazias valem 0."""
+    width = values.dtype.itemsize // 4
+    return values.view(np.uint32).reshape(len(values), width)
+
+
+def non_blank_mask(values: Iterable[str]) -> np.ndarray:
+    """True onde o valor bruto tem algo alem de espacos (o filtro `str(x).strip()`)."""
+    arr = np.asarray(values, dtype=str)
+    return np.char.str_len(np.char.strip(arr)) > 0
+
+
+def normalize_identifiers(values: Iterable[str]) -> np.ndarray:
+    """Mantem apenas os digitos ASCII de cada valor, em lote (equivale a clean_identifier)."""
+    arr = np.ascontiguousarray(np.asarray(values, dtype=str))
+    if arr.size == 0 or arr.dtype.itemsize == 0:
+        return arr
+    codes = _codepoints(arr)
+    is_digit = (codes >= 48) & (codes <= 57)
+    # Ordenacao estavel leva os digitos para a esquerda preservando a ordem; o resto vira 0.
+    order = np.argsort(~is_digit, axis=1, kind="stable")
+    packed = np.take_along_axis(np.where(is_digit, codes, 0), order, axis=1)
+    return np.ascontiguousarray(packed, dtype=np.uint32).view(arr.dtype).ravel()
+
+
+def classify_identifiers(digits: np.ndarray) -> np.ndarray:
+    """'cpf' (11 digitos), 'cnpj' (14) ou 'unknown', pelo tamanho de cada valor."""
+    lengths = np.char.str_len(digits)
+    return np.select([lengths == 11, lengths == 14], ["cpf", "cnpj"], default="unknown")
+
+
+def _digit_matrix(digits: np.ndarray, width: int) -> np.ndarray:
+    """Digitos (0-9) de strings com exatamente `width` caracteres, uma linha por valor."""
+    values = np.ascontiguousarray(np.asarray(digits, dtype=f"<U{width}"))
+    return _codepoints(values).astype(np.int64) - 48
+
+
+def _check_digits_ok(matrix: np.ndarray, weights, mod11) -> np.ndarray:
+    ok = np.ones(len(matrix), dtype=bool)
+    for position, w in zip((-2, -1), weights):
+        expected = mod11((matrix[:, : len(w)] * w).sum(axis=1))
+        ok &= matrix[:, position] == expected
+    # Sequencias repetidas (000..., 111...) passam no modulo 11 mas nao existem.
+    return ok & (matrix != matrix[:, :1]).any(axis=1)
+
+
+def _cpf_mod11(total: np.ndarray) -> np.ndarray:
+    rest = (total * 10) % 11
+    return np.where(rest == 10, 0, rest)
+
+
+def _cnpj_mod11(total: np.ndarray) -> np.ndarray:
+    rest = total % 11
+    return np.where(rest < 2, 0, 11 - rest)
+
+
+def checksum_valid(digits: np.ndarray) -> np.ndarray:
+    """Verifica os digitos verificadores (modulo 11) de CPFs e CNPJs; demais tamanhos sao False."""
+    digits = np.asarray(digits, dtype=str)
+    lengths = np.char.str_len(digits)
+    ok = np.zeros(len(digits), dtype=bool)
+    for size, weights, mod11 in ((11, CPF_WEIGHTS, _cpf_mod11), (14, CNPJ_WEIGHTS, _cnpj_mod11)):
+        mask = lengths == size
+        if mask.any():
+            ok[mask] = _check_digits_ok(_digit_matrix(digits[mask], size), weights, mod11)
+    return ok
+
+
+def validate_cpf_cnpj_array(digits: np.ndarray) -> np.ndarray:
+    """Mascara booleana: 11 ou 14 digitos com digitos verificadores corretos."""
+    return checksum_valid(digits)
+
+
+def recover_leading_zeros(digits: np.ndarray) -> np.ndarray:
+    """
+    Recupera zeros a esquerda removidos pelo Excel: valores curtos viram CPF (11) ou CNPJ (14)
+    via zfill, mas so quando o resultado tem digitos verificadores validos.
+    """
+    digits = np.asarray(digits, dtype=str)
+    lengths = np.char.str_len(digits)
+    recovered = digits.astype(object)
+    for size, shorter in ((11, (lengths >= 9) & (lengths < 11)), (14, (lengths >= 12) & (lengths < 14))):
+        if not shorter.any():
+            continue
+        candidates = np.char.zfill(digits[shorter], size)
+        valid = checksum_valid(candidates)
+        idx = np.flatnonzero(shorter)[valid]
+        recovered[idx] = candidates[valid]
+    return recovered.astype(str)
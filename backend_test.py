@@ -3,7 +3,9 @@ import sys
 import os
 import time
 import tempfile
+import shutil
 import csv
+import json
 from datetime import datetime
 
 class SaudeFetchAPITester:
@@ -29,10 +31,11 @@ class SaudeFetchAPITester:
         self.tests_run = 0
         self.tests_passed = 0
         self.job_id = None
+        self.batch_job_id = None
         self.token = None
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, files=None, params=None, auth_required=False):
-        """Run a single API test"""
+    def run_test(self, name, method, endpoint, expected_status, data=None, files=None, params=None, auth_required=False, body=None, content_type=None):
+        """Run a single API test (`body` sends raw bytes or a generator with `content_type`)"""
         url = f"{self.base_url}/api/{endpoint.lstrip('/')}"
         headers = {}
         
@@ -42,7 +45,7 @@ class SaudeFetchAPITester:
         
         # Don't set Content-Type for multipart/form-data (files)
         if not files:
-            headers['Content-Type'] = 'application/json'
+            headers['Content-Type'] = content_type or 'application/json'
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -57,9 +60,11 @@ class SaudeFetchAPITester:
                     auth_headers = {}
                     if auth_required and self.token:
                         auth_headers['Authorization'] = f'Bearer {self.token}'
-                    response = requests.post(url, files=files, data=data, headers=auth_headers)
+                    response = requests.post(url, files=files, data=data, headers=auth_headers, params=params)
+                elif body is not None:
+                    response = requests.post(url, data=body, headers=headers, params=params)
                 else:
-                    response = requests.post(url, json=data, headers=headers)
+                    response = requests.post(url, json=data, headers=headers, params=params)
 
             success = response.status_code == expected_status
             if success:
@@ -81,6 +86,24 @@ class SaudeFetchAPITester:
             print(f"❌ Failed - Error: {str(e)}")
             return False, {}
 
+    def check(self, name, condition, detail=""):
+        """Record a local (non-HTTP) check in the same tally as the API tests"""
+        self.tests_run += 1
+        if condition:
+            self.tests_passed += 1
+            print(f"✅ {name}")
+            return True
+        print(f"❌ {name} {detail}".rstrip())
+        return False
+
+    def load_backend_module(self, name):
+        """Import a backend module (e.g. utils.validators) from the repository checkout"""
+        backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+        if backend_dir not in sys.path:
+            sys.path.insert(0, backend_dir)
+        import importlib
+        return importlib.import_module(name)
+
     def test_health(self):
         """Test health endpoint (should be public)"""
         success, response = self.run_test(
@@ -234,6 +257,91 @@ class SaudeFetchAPITester:
                 
         return False
 
+    def test_create_batch_job_json(self):
+        """Test submitting identifiers as a JSON array (requires auth)"""
+        success, response = self.run_test(
+            "Create Batch Job (JSON)",
+            "POST",
+            "/jobs/batch",
+            200,
+            data=["529.982.247-25", 11144477735, {"identifier": "11.222.333/0001-81"}],
+            params={'type': 'auto'},
+            auth_required=True
+        )
+        if success and response.get('total') == 3 and response.get('filename') == 'api_batch.json':
+            self.batch_job_id = response['id']
+            print(f"   ✓ Batch job created with ID: {self.batch_job_id}")
+            return True
+        if success:
+            print(f"   ❌ Expected total=3 and filename api_batch.json, got {response}")
+        return False
+
+    def test_create_batch_job_ndjson(self):
+        """Test submitting identifiers as NDJSON, one per line (requires auth)"""
+        body = '"52998224725"\n\n{"identifier": "111.444.777-35"}\n'.encode('utf-8')
+        success, response = self.run_test(
+            "Create Batch Job (NDJSON)",
+            "POST",
+            "/jobs/batch",
+            200,
+            params={'type': 'cpf'},
+            auth_required=True,
+            body=body,
+            content_type='application/x-ndjson'
+        )
+        if success and response.get('total') == 2 and response.get('filename') == 'api_batch.ndjson':
+            print("   ✓ Blank lines skipped, 2 identifiers queued")
+            return True
+        if success:
+            print(f"   ❌ Expected total=2 and filename api_batch.ndjson, got {response}")
+        return False
+
+    def test_create_batch_job_bad_type(self):
+        """Test that an unknown identifier type is rejected (requires auth)"""
+        success, _ = self.run_test(
+            "Create Batch Job (Bad Type)",
+            "POST",
+            "/jobs/batch",
+            400,
+            data=["52998224725"],
+            params={'type': 'rg'},
+            auth_required=True
+        )
+        return success
+
+    def test_batch_body_too_large(self):
+        """Test that batch bodies over max_bytes raise UploadTooLargeError, the 413 of /jobs/batch (local, no HTTP)"""
+        import asyncio
+
+        uploads = self.load_backend_module("utils.uploads")
+        max_bytes = 64
+
+        async def chunks(body, size=16):
+            for start in range(0, len(body), size):
+                yield body[start:start + size]
+
+        def read(reader, body):
+            try:
+                return asyncio.run(reader(chunks(body), max_bytes=max_bytes))
+            except uploads.UploadTooLargeError:
+                return "too large"
+
+        within_json = json.dumps(["52998224725"] * 4).encode("utf-8")
+        within_ndjson = b'"52998224725"\n' * 4
+        over_json = json.dumps(["52998224725"] * 8).encode("utf-8")
+        over_ndjson = b'"52998224725"\n' * 8
+        cases = [
+            ("JSON within max_bytes parsed", uploads.read_json_identifiers, within_json, ["52998224725"] * 4),
+            ("NDJSON within max_bytes parsed", uploads.read_ndjson_identifiers, within_ndjson, ["52998224725"] * 4),
+            ("JSON over max_bytes rejected", uploads.read_json_identifiers, over_json, "too large"),
+            ("NDJSON over max_bytes rejected", uploads.read_ndjson_identifiers, over_ndjson, "too large"),
+        ]
+        ok = True
+        for name, reader, body, expected in cases:
+            result = read(reader, body)
+            ok &= self.check(f"{name} ({len(body)} bytes, limit {max_bytes})", result == expected, f"- {result}")
+        return ok
+
     def test_get_job(self):
         """Test getting a specific job (requires auth)"""
         if not self.job_id:
@@ -295,11 +403,349 @@ class SaudeFetchAPITester:
             auth_required=True
         )
         
-        if json_success and isinstance(json_response, list):
-            print(f"   ✓ JSON results contain {len(json_response)} records")
-            
+        if json_success:
+            items = json_response.get('items') if isinstance(json_response, dict) else None
+            if not isinstance(items, list) or 'next_after' not in json_response:
+                print(f"   ❌ Expected {{\"items\": [...], \"next_after\": ...}}, got {str(json_response)[:200]}")
+                json_success = False
+            elif json_response['next_after'] is not None:
+                print(f"   ❌ Expected next_after=null without limit, got {json_response['next_after']}")
+                json_success = False
+            elif any('id' not in row or 'job_id' in row for row in items):
+                print(f"   ❌ Expected rows with id and without job_id, got {items[:1]}")
+                json_success = False
+            else:
+                print(f"   ✓ JSON results contain {len(items)} records")
+
         return csv_success and json_success and xlsx_success
 
+    def test_job_results_fields(self):
+        """Test the `fields` projection on the JSON/NDJSON results (requires auth)"""
+        if not self.job_id:
+            print("   ⚠️ No job ID available, skipping test")
+            return False
+
+        success, response = self.run_test(
+            "Get Results (fields=input,status)",
+            "GET",
+            f"/jobs/{self.job_id}/results",
+            200,
+            params={'format': 'json', 'fields': 'input,status'},
+            auth_required=True
+        )
+        items = response.get('items') if success else None
+        projected = bool(items) and all(set(item) == {'input', 'status'} for item in items)
+        if projected:
+            print(f"   ✓ {len(items)} items with only input/status")
+        elif success:
+            print(f"   ❌ Unexpected projection: {items}")
+
+        ndjson_url = f"{self.base_url}/api/jobs/{self.job_id}/results"
+        ndjson = requests.get(
+            ndjson_url,
+            headers={'Authorization': f'Bearer {self.token}'},
+            params={'format': 'ndjson', 'fields': 'id,operator'},
+        )
+        lines = [json.loads(line) for line in ndjson.text.splitlines() if line.strip()]
+        ndjson_ok = self.check(
+            "Get Results (NDJSON fields=id,operator)",
+            ndjson.status_code == 200 and bool(lines)
+            and all(set(line) == {'id', 'operator'} for line in lines),
+            f"- status {ndjson.status_code}, lines {lines[:2]}",
+        )
+
+        unknown_ok, _ = self.run_test(
+            "Get Results (unknown field)",
+            "GET",
+            f"/jobs/{self.job_id}/results",
+            400,
+            params={'format': 'json', 'fields': 'input,password'},
+            auth_required=True
+        )
+        return projected and ndjson_ok and unknown_ok
+
+    def test_job_results_cursor(self):
+        """Test `limit`/`after` pagination through `next_after` (requires auth)"""
+        if not self.job_id:
+            print("   ⚠️ No job ID available, skipping test")
+            return False
+
+        success, first = self.run_test(
+            "Get Results (limit=1)",
+            "GET",
+            f"/jobs/{self.job_id}/results",
+            200,
+            params={'format': 'json', 'fields': 'id,input', 'limit': 1},
+            auth_required=True
+        )
+        if not success or len(first.get('items', [])) != 1 or not first.get('next_after'):
+            print(f"   ❌ Expected one item and a next_after cursor, got {first}")
+            return False
+        if first['next_after'] != first['items'][0]['id']:
+            print("   ❌ next_after should be the id of the last item")
+            return False
+
+        success, second = self.run_test(
+            "Get Results (after=next_after)",
+            "GET",
+            f"/jobs/{self.job_id}/results",
+            200,
+            params={'format': 'json', 'fields': 'id,input', 'after': first['next_after']},
+            auth_required=True
+        )
+        ids = [item['id'] for item in second.get('items', [])] if success else []
+        if success and ids and first['items'][0]['id'] not in ids and second.get('next_after') is None:
+            print(f"   ✓ Second page starts after the cursor ({len(ids)} items, no further cursor)")
+        else:
+            print(f"   ❌ Unexpected second page: {second}")
+            return False
+
+        bad_cursor, _ = self.run_test(
+            "Get Results (invalid cursor)",
+            "GET",
+            f"/jobs/{self.job_id}/results",
+            400,
+            params={'format': 'json', 'after': 'not-an-id'},
+            auth_required=True
+        )
+        return bad_cursor
+
+    def test_identifier_check_digits(self):
+        """Test CPF/CNPJ check digit validation (local, no HTTP)"""
+        validators = self.load_backend_module("utils.validators")
+        import numpy as np
+
+        valid = ["529.982.247-25", "111.444.777-35", "11.222.333/0001-81", "01.234.567/0001-95"]
+        wrong_digits = ["529.982.247-24", "111.444.777-36", "11.222.333/0001-80", "12345678901"]
+        repeated = ["111.111.111-11", "000.000.000-00", "99999999999", "11.111.111/1111-11", "00000000000000"]
+        wrong_length = ["", "123", "5299822472", "529982247251"]
+
+        ok = True
+        for value in valid:
+            ok &= self.check(f"Check digits valid: {value}", validators.validate_cpf_cnpj(value))
+        for value in wrong_digits + repeated + wrong_length:
+            ok &= self.check(f"Check digits rejected: {value!r}", not validators.validate_cpf_cnpj(value))
+
+        # The vectorized version (used on ingestion) must agree with the scalar one.
+        samples = valid + wrong_digits + repeated + wrong_length
+        digits = validators.normalize_identifiers(np.asarray(samples, dtype=str))
+        vectorized = validators.validate_cpf_cnpj_array(digits).tolist()
+        scalar = [validators.validate_cpf_cnpj(value) for value in samples]
+        ok &= self.check("Vectorized validation matches scalar", vectorized == scalar, f"- {vectorized} != {scalar}")
+        return ok
+
+    def test_recover_leading_zeros(self):
+        """Test recovery of Excel-stripped leading zeros, using cpfs.csv (local, no HTTP)"""
+        validators = self.load_backend_module("utils.validators")
+        import numpy as np
+
+        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cpfs.csv")
+        with open(csv_path, newline='') as f:
+            raw = [row[0].strip() for row in csv.reader(f)][1:]
+        recovered = validators.recover_leading_zeros(np.asarray(raw, dtype=str)).tolist()
+
+        ok = True
+        stripped = [value for value in raw if len(value) == 10]
+        ok &= self.check("cpfs.csv has Excel-stripped 10-digit CPFs", bool(stripped))
+        for original, fixed in zip(raw, recovered):
+            expected = original.zfill(11)
+            ok &= self.check(
+                f"Leading zeros recovered: {original} -> {fixed}",
+                fixed == expected and validators.validate_cpf_cnpj(fixed),
+                f"- expected {expected}",
+            )
+
+        # Only recovered when the zero-padded value has valid check digits.
+        untouched = ["9068606795", "906860679", "123"]
+        result = validators.recover_leading_zeros(np.asarray(untouched, dtype=str)).tolist()
+        ok &= self.check("Invalid short values left untouched", result == untouched, f"- {result}")
+        cnpj = validators.recover_leading_zeros(np.asarray(["1234567000195"], dtype=str)).tolist()
+        ok &= self.check("Stripped CNPJ recovered", cnpj == ["01234567000195"], f"- {cnpj}")
+        return ok
+
+    def fake_stream_manager(self, driver_count, delay=0.01, failing=()):
+        """
+        DriverManager whose drivers are in-memory fakes answering "ativo" after `delay`;
+        drivers named in `failing` raise while opening their browser session
+        """
+        import asyncio
+        from contextlib import asynccontextmanager
+
+        manager_module = self.load_backend_module("drivers.driver_manager")
+        DriverResult = self.load_backend_module("drivers.base").DriverResult
+
+        class FakeDriver:
+            supported_id_types = ("cpf",)
+
+            def __init__(self, name):
+                self.name = self.operator = name
+
+            @asynccontextmanager
+            async def _lookup_session(self):
+                if self.name in failing:
+                    # Fail after items were already queued for this operator.
+                    await asyncio.sleep(0.05)
+                    raise RuntimeError("browser launch failed")
+                yield None
+
+            async def consult(self, identifier, id_type, **kwargs):
+                await asyncio.sleep(delay)
+                return DriverResult(operator=self.operator, status="ativo", identifier=identifier, id_type=id_type)
+
+        manager = manager_module.DriverManager()
+        manager._drivers = {f"fake_{n}": FakeDriver(f"fake_{n}") for n in range(driver_count)}
+        return manager_module, manager
+
+    def test_stream_finalizes_before_source_ends(self):
+        """Test run_stream with more drivers than MAX_CONCURRENCY finalizes identifiers while the source is read (local, no HTTP)"""
+        import asyncio
+
+        driver_count = self.load_backend_module("drivers.driver_manager").MAX_CONCURRENCY + 1
+        manager_module, manager = self.fake_stream_manager(driver_count)
+        identifiers = [f"{n:011d}" for n in range(20)]
+        answered = {}
+        finalized_while_reading = []
+
+        async def on_result(identifier, driver, result, cached):
+            answered.setdefault(identifier, set()).add(driver.name)
+
+        def finalized():
+            return [ident for ident, drivers in answered.items() if len(drivers) == driver_count]
+
+        async def source():
+            for identifier in identifiers:
+                # Record, before each new identifier, which ones every driver already answered.
+                finalized_while_reading.append(len(finalized()))
+                yield identifier, "cpf"
+                await asyncio.sleep(0.02)
+
+        asyncio.run(manager.run_stream(source(), progress_callback=on_result))
+
+        ok = self.check(
+            f"All {driver_count} drivers answered every identifier",
+            sorted(finalized()) == identifiers,
+            f"- {len(finalized())}/{len(identifiers)} finalized",
+        )
+        ok &= self.check(
+            f"Identifiers finalized before the source ends (MAX_CONCURRENCY={manager_module.MAX_CONCURRENCY})",
+            finalized_while_reading[-1] > 0,
+            f"- finalized while reading: {finalized_while_reading}",
+        )
+        return ok
+
+    def test_stream_reports_failed_operator(self):
+        """Test that a failed operator yields an erro result for queued and later identifiers (local, no HTTP)"""
+        import asyncio
+
+        manager_module, manager = self.fake_stream_manager(3, failing=("fake_1",))
+        identifiers = [f"{n:011d}" for n in range(10)]
+        results = {}
+
+        async def on_result(identifier, driver, result, cached):
+            results.setdefault(identifier, {})[driver.name] = result
+
+        async def source():
+            for identifier in identifiers:
+                yield identifier, "cpf"
+                await asyncio.sleep(0.01)
+
+        asyncio.run(manager.run_stream(source(), progress_callback=on_result))
+
+        ok = self.check(
+            "Every identifier has one result per operator",
+            sorted(results) == identifiers and all(len(r) == 3 for r in results.values()),
+            f"- {[(ident, sorted(r)) for ident, r in results.items() if len(r) != 3]}",
+        )
+        failed = [r.get("fake_1") for r in results.values()]
+        ok &= self.check(
+            "Failed operator reported as erro / falha no lote",
+            all(
+                r is not None and r.status == "erro" and r.message.startswith("falha no lote")
+                for r in failed
+            ),
+            f"- {[(r.status, r.message) if r else None for r in failed]}",
+        )
+        return ok
+
+    def test_partial_exports_fill_during_run(self):
+        """Test that the partial CSV/XLSX exports grow while run_stream is still reading identifiers (local, no HTTP)"""
+        import asyncio
+        from openpyxl import Workbook, load_workbook
+
+        exports = self.load_backend_module("utils.exports")
+        driver_count = self.load_backend_module("drivers.driver_manager").MAX_CONCURRENCY + 1
+        manager_module, manager = self.fake_stream_manager(driver_count)
+        identifiers = [f"{n:011d}" for n in range(20)]
+        export_dir = tempfile.mkdtemp(prefix="partial_exports_")
+        answered = {}
+        csv_rows_while_reading = []
+        xlsx_rows_while_reading = []
+
+        def build_xlsx(df, path):
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("Resultados")
+            ws.append(list(df.columns))
+            for row in df.itertuples(index=False):
+                ws.append(list(row))
+            wb.save(path)
+
+        def csv_rows(path):
+            with open(path, newline="", encoding="utf-8") as f:
+                return max(0, sum(1 for _ in csv.reader(f)) - 1)
+
+        def xlsx_rows(path):
+            if not os.path.exists(path):
+                return 0
+            wb = load_workbook(path, read_only=True)
+            try:
+                return max(0, sum(1 for _ in wb.active.iter_rows()) - 1)
+            finally:
+                wb.close()
+
+        async def run():
+            # Snapshot interval 0: every finalized identifier may schedule a new XLSX.
+            exporter = exports.PartialExporter("partial_check", export_dir, build_xlsx, 0)
+
+            async def on_result(identifier, driver, result, cached):
+                answered.setdefault(identifier, []).append(result)
+                if len(answered[identifier]) == driver_count:
+                    # Same order as process_job: one row per driver, then flush.
+                    for entry in answered[identifier]:
+                        exporter.add({"input": identifier, "type": "cpf", "operator": entry.operator, "status": entry.status})
+                    exporter.flush()
+
+            async def source():
+                for identifier in identifiers:
+                    csv_rows_while_reading.append(csv_rows(exporter.csv_path))
+                    xlsx_rows_while_reading.append(xlsx_rows(exporter.xlsx_path))
+                    yield identifier, "cpf"
+                    await asyncio.sleep(0.02)
+
+            await manager.run_stream(source(), progress_callback=on_result)
+            await exporter.finish(discard=False)
+            return exporter
+
+        exporter = asyncio.run(run())
+        expected_rows = len(identifiers) * driver_count
+        ok = self.check(
+            "Partial CSV filled in before the source ends",
+            csv_rows_while_reading[-1] > 0,
+            f"- rows while reading: {csv_rows_while_reading}",
+        )
+        ok &= self.check(
+            "Partial XLSX snapshot filled in before the source ends",
+            xlsx_rows_while_reading[-1] > 0,
+            f"- rows while reading: {xlsx_rows_while_reading}",
+        )
+        final_rows = (csv_rows(exporter.csv_path), xlsx_rows(exporter.xlsx_path))
+        shutil.rmtree(export_dir, ignore_errors=True)
+        ok &= self.check(
+            "Partial exports complete after the run",
+            final_rows == (expected_rows, expected_rows),
+            f"- (csv, xlsx) rows: {final_rows}, expected {expected_rows}",
+        )
+        return ok
+
     def test_job_log(self):
         """Test getting job log (requires auth)"""
         if not self.job_id:
@@ -385,13 +831,26 @@ def main():
         tester.test_mappings_reload,
         tester.test_list_jobs_empty,
         tester.test_create_job,
+        tester.test_create_batch_job_json,
+        tester.test_create_batch_job_ndjson,
+        tester.test_create_batch_job_bad_type,
         tester.test_get_job,
         tester.test_job_results,
+        tester.test_job_results_fields,
+        tester.test_job_results_cursor,
         tester.test_job_log,
         tester.test_list_jobs_with_data,
         
         # Configuration tests
         tester.test_driver_throttling,
+
+        # Local checks (no HTTP)
+        tester.test_identifier_check_digits,
+        tester.test_recover_leading_zeros,
+        tester.test_stream_finalizes_before_source_ends,
+        tester.test_stream_reports_failed_operator,
+        tester.test_partial_exports_fill_during_run,
+        tester.test_batch_body_too_large,
     ]
     
     for test in tests: